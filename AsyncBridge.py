@@ -0,0 +1,215 @@
+import asyncio
+import sys
+import time
+
+import serial
+
+from BridgeCore import (COMMAND_RECV_ERRORS, UDP_IP, UDP_CMD_PORT, command_ack_sender, handle_control,
+                        submit_command, write_pending_commands)
+from ConsoleLog import get_logger
+from SerialReader import SERIAL_READ_WAIT
+
+log = get_logger("AsyncBridge")
+
+
+class CommandEndpoint(asyncio.DatagramProtocol):
+    """Endpoint UDP dei comandi: ogni datagramma viene passato subito al bridge."""
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.bridge.handle_datagram(data, addr, self.transport)
+
+    def error_received(self, exc):
+        COMMAND_RECV_ERRORS.inc()
+        log.error("Errore nel listener UDP: %s", exc)
+
+
+class AsyncBridge:
+    """
+    Bridge a eventi basato su asyncio.
+
+    L'endpoint UDP dei comandi e la porta seriale sono entrambi sorgenti di
+    eventi dello stesso loop: un comando ricevuto viene scritto sul dongle
+    nella stessa callback, senza attendere il tick del loop a 33 Hz della
+    modalità threaded.
+
+    Su POSIX la seriale è osservata con loop.add_reader; dove non è
+    disponibile (Windows, ProactorEventLoop) la lettura bloccante gira in
+    un executor e i dati vengono elaborati nel loop. In entrambi i casi le
+    letture sono dimensionate dal ReadPacer della sessione (vedi
+    SerialReader): con add_reader l'attesa tra due letture sospende
+    l'osservazione della porta con call_later, senza bloccare il loop.
+
+    La porta è gestita da una SerialSession: se si perde, la riconnessione
+    (bloccante, con backoff) gira in un executor mentre l'endpoint UDP
+    resta attivo.
+
+    I comandi passano comunque dalla CommandQueue (tracciamento e conferme),
+    che qui viene svuotata subito dopo ogni datagramma.
+    """
+    def __init__(self, session, publisher, commands, fanout=None, cmd_addr=(UDP_IP, UDP_CMD_PORT)):
+        self.session = session
+        self.publisher = publisher
+        self.commands = commands
+        self.fanout = fanout
+        self.cmd_addr = cmd_addr
+        self.ser = None
+        self.protocol = None
+        self.commands_written = 0
+        self._stop = None
+        self._lost = None
+        self._loop = None
+        self._paused = None    # call_later che riattiva add_reader dopo l'attesa del pacer
+
+    def handle_datagram(self, data, addr, transport):
+        try:
+            cmd = data.decode('utf-8').strip()
+        except UnicodeDecodeError as e:
+            log.error("Errore nel listener UDP: %s", e)
+            return
+        reply = handle_control(cmd, addr, self.publisher, self.fanout)
+        if reply is not None:
+            transport.sendto(reply, addr)
+            return
+        if submit_command(cmd, addr, self.commands, transport.sendto):
+            self.commands_written += write_pending_commands(self.session, self.commands)
+
+    async def _expire_commands(self):
+        while True:
+            await asyncio.sleep(0.1)
+            self.commands.expire()
+
+    def stop(self):
+        """Richiede l'arresto del bridge (thread-safe)."""
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def _fail(self, exc):
+        self.session.connection_lost(exc)
+        self._lost.set()
+
+    def _on_serial_readable(self):
+        pacer = self.session.pacer
+        try:
+            data = self.ser.read(pacer.read_size(self.ser.in_waiting))
+            if data:
+                self.protocol.data_received(data)
+            pacer.record(len(data))
+            wait = pacer.wait_time(self.ser.in_waiting) if data else 0.0
+        except (serial.SerialException, OSError) as e:
+            self._loop.remove_reader(self.ser.fileno())
+            self._fail(e)
+            return
+        if wait:
+            # I byte si accumulano nel driver finché non si riprende a osservare la porta
+            SERIAL_READ_WAIT.record(wait)
+            self._loop.remove_reader(self.ser.fileno())
+            self._paused = self._loop.call_later(wait, self._resume_reader)
+
+    def _resume_reader(self):
+        self._paused = None
+        if not self._lost.is_set() and not self._stop.is_set():
+            self._loop.add_reader(self.ser.fileno(), self._on_serial_readable)
+
+    def _read_blocking(self):
+        # Ritorna al più dopo ser.timeout (+ l'attesa del pacer), così la cancellazione non resta appesa
+        pacer = self.session.pacer
+        data = self.ser.read(pacer.read_size(self.ser.in_waiting))
+        pacer.record(len(data))
+        wait = pacer.wait_time(self.ser.in_waiting) if data else 0.0
+        if wait:
+            SERIAL_READ_WAIT.record(wait)
+            time.sleep(wait)
+        return data
+
+    async def _executor_reader(self):
+        while not self._lost.is_set():
+            try:
+                data = await self._loop.run_in_executor(None, self._read_blocking)
+            except (serial.SerialException, OSError) as e:
+                self._fail(e)
+                return
+            if data:
+                self.protocol.data_received(data)
+
+    def _add_serial_reader(self):
+        if sys.platform == "win32" or not hasattr(self.ser, "fileno"):
+            return False
+        try:
+            self._loop.add_reader(self.ser.fileno(), self._on_serial_readable)
+        except (NotImplementedError, ValueError, OSError):
+            return False
+        return True
+
+    async def _serve_connection(self):
+        """Legge dalla porta corrente finché non si perde o il bridge viene fermato."""
+        self._lost = asyncio.Event()
+        self.protocol = self.session.make_protocol()
+        reader_task = None
+        uses_add_reader = self._add_serial_reader()
+        if not uses_add_reader:
+            reader_task = asyncio.create_task(self._executor_reader())
+        stop_wait = asyncio.create_task(self._stop.wait())
+        lost_wait = asyncio.create_task(self._lost.wait())
+        try:
+            await asyncio.wait((stop_wait, lost_wait), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop_wait.cancel()
+            lost_wait.cancel()
+            if self._paused is not None:
+                self._paused.cancel()
+                self._paused = None
+            if uses_add_reader and not self._lost.is_set():
+                self._loop.remove_reader(self.ser.fileno())
+            if reader_task is not None:
+                reader_task.cancel()
+                try:
+                    await reader_task
+                except asyncio.CancelledError:
+                    pass
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: CommandEndpoint(self), local_addr=self.cmd_addr)
+        log.info("Ascolto comandi UDP su %s:%s (asyncio)", self.cmd_addr[0], self.cmd_addr[1])
+        self.commands.ack = command_ack_sender(transport)
+        expire_task = asyncio.create_task(self._expire_commands())
+        try:
+            while not self._stop.is_set():
+                connect = self._loop.run_in_executor(None, self.session.connect)
+                stop_wait = asyncio.create_task(self._stop.wait())
+                await asyncio.wait((connect, stop_wait), return_when=asyncio.FIRST_COMPLETED)
+                stop_wait.cancel()
+                if self._stop.is_set():
+                    # Interrompe il backoff della sessione e attende l'executor
+                    self.session.stop()
+                    await connect
+                    break
+                self.ser = connect.result()
+                if self.ser is None:
+                    break
+                await self._serve_connection()
+        finally:
+            # Anche in caso di cancellazione: sblocca un eventuale connect() nell'executor
+            expire_task.cancel()
+            self.session.stop()
+            transport.close()
+
+
+def run_async_bridge(session, publisher, commands, fanout=None):
+    """Esegue AsyncBridge fino a KeyboardInterrupt."""
+    bridge = AsyncBridge(session, publisher, commands, fanout)
+    try:
+        asyncio.run(bridge.run())
+    except KeyboardInterrupt:
+        log.info("Terminazione tramite KeyboardInterrupt.")
+    finally:
+        session.stop()
+    return bridge
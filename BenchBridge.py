@@ -0,0 +1,787 @@
+"""
+Benchmark end-to-end del bridge SixthFingerHostWin con dongle simulato.
+
+Avvia un SimulatedDongle su pty, lancia il bridge come sottoprocesso sulla
+porta simulata e lo pilota tramite le porte UDP comandi/feedback:
+  - latenza comando UDP -> frame seriale ricevuto dal dongle
+  - latenza comando UDP -> primo feedback UDP che riflette il comando
+  - pacchetti/s di feedback sostenuti e pacchetti persi
+Con --scenario replug il dongle simulato viene scollegato e ricollegato
+più volte e si misura il tempo al primo pacchetto dopo il ricollegamento.
+Con --scenario fanout si iscrivono --subscribers consumer locali al
+feedback e si confrontano latenza e throughput del consumer principale
+prima e dopo, insieme ai campioni/s ricevuti da ciascun iscritto.
+Con --scenario console si confrontano i pacchetti/s con la console del
+bridge attiva (livello info, output sul terminale) e disattivata (off).
+Con --scenario shm si confronta il consumer principale via UDP con il
+lettore della memoria condivisa (vedi SharedFeedback): latenza bridge ->
+consumer, campioni/s, perdite e CPU di bridge e consumer.
+Con --scenario filter il consumer principale chiede a turno ciascuno dei
+--filters (vedi FeedbackFilter; "none" = campioni grezzi): datagrammi/s,
+campioni/s ricevuti, latenza e CPU di bridge e consumer.
+Con --scenario reader si prova ogni profilo della porta (--serial-profile
+del bridge) a più frequenze del dongle simulato (--rates): letture/s e
+byte per lettura del reader adattivo (metriche serial.* lette
+dall'endpoint delle metriche), throughput e latenza comando->feedback.
+Il risultato è un documento JSON (stdout o --output) confrontabile tra run.
+
+Esempio:
+    python BenchBridge.py --mode async --rate 2000 --commands 200 --output bench.json
+    python BenchBridge.py --scenario replug --replugs 5 --downtime 0.5
+    python BenchBridge.py --scenario console --rate 20000 --duration 5
+    python BenchBridge.py --scenario fanout --subscribers 50 --every 10
+    python BenchBridge.py --scenario shm --rate 2000 --duration 5
+    python BenchBridge.py --scenario reader --rates 200,2000,20000 --duration 3
+    python BenchBridge.py --scenario filter --rate 20000 --filters "none;minmax:10;ma:8,mean:33,velocity"
+"""
+import argparse
+import json
+import os
+import platform
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from COMDeviceManager import PORT_PROFILES
+from FeedbackProtocol import FeedbackDecoder, FORMAT_BINARY, FORMAT_ASCII, hello_message
+from Metrics import query
+from SimulatedDongle import SimulatedDongle, COMMAND_POSITIONS
+
+UDP_IP = "127.0.0.1"
+UDP_CMD_PORT = 5005
+UDP_FEEDBACK_PORT = 5006
+BRIDGE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "SixthFingerHostWin.py")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize_ms(values):
+    return {
+        "count": len(values),
+        "p50_ms": _ms(percentile(values, 50)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(max(values) if values else None),
+    }
+
+
+def _ms(value):
+    return None if value is None else round(value * 1000.0, 3)
+
+
+class FeedbackCollector:
+    """Riceve il feedback UDP, conta pacchetti e buchi nel contatore del dongle simulato."""
+    def __init__(self, addr=(UDP_IP, UDP_FEEDBACK_PORT)):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(addr)
+        self.sock.settimeout(0.2)
+        self.decoder = FeedbackDecoder()
+        self.samples = 0
+        self.counter_gaps = 0
+        self.position = None
+        self.position_changes = []   # (perf_counter, position)
+        self.first_sample = None
+        self.last_sample = None
+        self._last_counter = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=1.0)
+        self.sock.close()
+
+    def _run(self):
+        while self._running:
+            try:
+                data, _ = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            now = time.perf_counter()
+            try:
+                samples = self.decoder.decode(data)
+            except ValueError:
+                continue
+            if self.first_sample is None:
+                self.first_sample = now
+            self.last_sample = now
+            for counter, position, _ in samples:
+                self.samples += 1
+                if self._last_counter is not None:
+                    self.counter_gaps += (counter - self._last_counter - 1) % 1000
+                self._last_counter = counter
+                if position != self.position:
+                    self.position = position
+                    self.position_changes.append((now, position))
+
+    def reset_rate_window(self):
+        self.samples = 0
+        self.first_sample = None
+        self.last_sample = None
+
+
+def wait_for_bridge(cmd_sock, fmt, timeout, filter_spec=None, feedback_sock=None):
+    """
+    Invia HELLO finché il bridge non risponde con CAPS (pronto a ricevere
+    comandi). Il formato del feedback si negozia per indirizzo: con
+    `feedback_sock` (il socket del consumer legato a 5006) l'HELLO viene poi
+    ripetuto da quel socket, così il flusso principale passa a `fmt`.
+    """
+    deadline = time.monotonic() + timeout
+    cmd_sock.settimeout(0.2)
+    while time.monotonic() < deadline:
+        cmd_sock.sendto(hello_message(fmt, filter_spec), (UDP_IP, UDP_CMD_PORT))
+        try:
+            reply, _ = cmd_sock.recvfrom(1024)
+        except (socket.timeout, ConnectionResetError):
+            continue
+        if reply.startswith(b"CAPS"):
+            if feedback_sock is not None:
+                # La risposta CAPS arriva al consumer, che la scarta come datagramma non valido
+                feedback_sock.sendto(hello_message(fmt, filter_spec), (UDP_IP, UDP_CMD_PORT))
+            return True
+    return False
+
+
+def wait_until(predicate, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.0002)
+    return False
+
+
+def start_bridge(mode, port, log_level="info", console=False, extra_args=()):
+    """
+    Avvia il bridge sulla porta indicata. Con `console` l'output del bridge
+    va sullo stderr del benchmark (il terminale), altrimenti viene scartato.
+    """
+    output = sys.stderr if console else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, BRIDGE_SCRIPT, "--mode", mode, "--port", port,
+                             "--log-level", log_level, *extra_args],
+                            stdout=output, stderr=output)
+
+
+def stop_bridge(bridge):
+    bridge.terminate()
+    try:
+        bridge.wait(timeout=3.0)
+    except subprocess.TimeoutExpired:
+        bridge.kill()
+
+
+def measure_throughput(dongle, collector, duration):
+    """Throughput sostenuto del feedback senza comandi."""
+    collector.reset_rate_window()
+    gaps_before = collector.counter_gaps
+    sent_before = dongle.packets_sent
+    time.sleep(duration)
+    received = collector.samples
+    window = (collector.last_sample or 0) - (collector.first_sample or 0)
+    return {
+        "duration_s": duration,
+        "packets_emitted": dongle.packets_sent - sent_before,
+        "packets_received": received,
+        "packets_per_s": round(received / window, 1) if window > 0 else 0.0,
+        "counter_gaps": collector.counter_gaps - gaps_before,
+    }
+
+
+def measure_commands(dongle, collector, cmd_sock, commands, interval):
+    """
+    Latenze dei comandi: alterna CLOSE/OPEN così ogni comando cambia la position.
+    Restituisce (comando->seriale, comando->feedback, timeout).
+    """
+    to_serial = []
+    to_feedback = []
+    timeouts = 0
+    for i in range(commands):
+        cmd = "CLOSE" if collector.position != COMMAND_POSITIONS[b"C"] else "OPEN"
+        target = COMMAND_POSITIONS[cmd[0].encode()]
+        log_len = len(dongle.command_log)
+        changes_len = len(collector.position_changes)
+        t0 = time.perf_counter()
+        cmd_sock.sendto(cmd.encode('utf-8'), (UDP_IP, UDP_CMD_PORT))
+        if wait_until(lambda: len(dongle.command_log) > log_len, 1.0):
+            to_serial.append(dongle.command_log[log_len][0] - t0)
+        if wait_until(lambda: any(p == target for _, p in collector.position_changes[changes_len:]), 1.0):
+            t1 = next(t for t, p in collector.position_changes[changes_len:] if p == target)
+            to_feedback.append(t1 - t0)
+        else:
+            timeouts += 1
+        time.sleep(interval)
+    return to_serial, to_feedback, timeouts
+
+
+def run_benchmark(mode="threaded", rate=1000, commands=100, interval=0.05, duration=5.0,
+                  fmt=FORMAT_BINARY, startup_timeout=10.0, log_level="info", console=False):
+    dongle = SimulatedDongle(rate).start()
+    collector = FeedbackCollector().start()
+    bridge = start_bridge(mode, dongle.port_name, log_level, console)
+    cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        if not wait_for_bridge(cmd_sock, fmt, startup_timeout, feedback_sock=collector.sock):
+            raise RuntimeError("Il bridge non ha risposto all'handshake")
+        if not wait_until(lambda: collector.samples > 0, startup_timeout):
+            raise RuntimeError("Nessun feedback ricevuto dal bridge")
+
+        throughput = measure_throughput(dongle, collector, duration)
+        to_serial, to_feedback, timeouts = measure_commands(dongle, collector, cmd_sock, commands, interval)
+        return {
+            "benchmark": "bridge_latency",
+            "timestamp": time.time(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "config": {"mode": mode, "rate": rate, "commands": commands, "interval_s": interval,
+                       "format": fmt, "log_level": log_level, "console": console},
+            "command_to_serial": summarize_ms(to_serial),
+            "command_to_feedback": summarize_ms(to_feedback),
+            "command_timeouts": timeouts,
+            "throughput": throughput,
+            "drops": {
+                "counter_gaps": collector.counter_gaps,
+                "udp_datagrams_lost": collector.decoder.lost,
+                "pty_bytes_overflowed": dongle.bytes_overflowed,
+            },
+        }
+    finally:
+        stop_bridge(bridge)
+        cmd_sock.close()
+        collector.stop()
+        dongle.stop()
+
+
+def run_replug_benchmark(mode="threaded", rate=1000, replugs=5, downtime=0.5, fmt=FORMAT_BINARY,
+                         startup_timeout=10.0, recovery_timeout=15.0):
+    """
+    Scollega e ricollega il dongle simulato (symlink stabile, pty nuova) e
+    misura il tempo al primo pacchetto di feedback dopo il ricollegamento.
+    """
+    link = os.path.join(tempfile.mkdtemp(prefix="sixthfinger-"), "dongle")
+    dongle = SimulatedDongle(rate, link=link).start()
+    collector = FeedbackCollector().start()
+    bridge = start_bridge(mode, link)
+    cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        if not wait_for_bridge(cmd_sock, fmt, startup_timeout, feedback_sock=collector.sock):
+            raise RuntimeError("Il bridge non ha risposto all'handshake")
+        if not wait_until(lambda: collector.samples > 0, startup_timeout):
+            raise RuntimeError("Nessun feedback ricevuto dal bridge")
+
+        from_plug = []
+        from_unplug = []
+        failures = 0
+        for _ in range(replugs):
+            t_unplug = time.perf_counter()
+            dongle.unplug()
+            time.sleep(downtime)
+            dongle.plug()
+            t_plug = time.perf_counter()
+            if wait_until(lambda: (collector.last_sample or 0) > t_plug, recovery_timeout):
+                from_plug.append(collector.last_sample - t_plug)
+                from_unplug.append(collector.last_sample - t_unplug)
+            else:
+                failures += 1
+            time.sleep(0.2)
+        return {
+            "benchmark": "bridge_replug",
+            "timestamp": time.time(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "config": {"mode": mode, "rate": rate, "replugs": replugs, "downtime_s": downtime,
+                       "format": fmt},
+            "time_to_first_packet": summarize_ms(from_plug),
+            "outage": summarize_ms(from_unplug),
+            "recovery_failures": failures,
+        }
+    finally:
+        stop_bridge(bridge)
+        cmd_sock.close()
+        collector.stop()
+        dongle.stop()
+        os.rmdir(os.path.dirname(link))
+
+
+class SubscriberPool:
+    """
+    Consumer locali iscritti al feedback con SUBSCRIBE (vedi FeedbackFanout),
+    letti tutti da un solo thread. Le lease vengono rinnovate a metà durata.
+    """
+    def __init__(self, count, every=1, fmt=FORMAT_BINARY, lease=5.0):
+        self.every = every
+        self.format = fmt
+        self.lease = lease
+        self.selector = selectors.DefaultSelector()
+        self.stats = []
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 18)
+            sock.bind((UDP_IP, 0))
+            sock.setblocking(False)
+            entry = {"sock": sock, "decoder": FeedbackDecoder(), "samples": 0, "subscribed": False}
+            self.stats.append(entry)
+            self.selector.register(sock, selectors.EVENT_READ, entry)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=1.0)
+        for entry in self.stats:
+            try:
+                entry["sock"].sendto(b"UNSUBSCRIBE", (UDP_IP, UDP_CMD_PORT))
+            except OSError:
+                pass
+            entry["sock"].close()
+        self.selector.close()
+
+    def _subscribe_all(self):
+        message = f"SUBSCRIBE format={self.format} every={self.every} lease={self.lease:g}".encode('ascii')
+        for entry in self.stats:
+            entry["sock"].sendto(message, (UDP_IP, UDP_CMD_PORT))
+
+    @property
+    def subscribed(self):
+        return sum(1 for entry in self.stats if entry["subscribed"])
+
+    def reset(self):
+        for entry in self.stats:
+            entry["samples"] = 0
+            entry["decoder"].lost = 0
+
+    def _run(self):
+        next_renew = 0.0
+        while self._running:
+            now = time.monotonic()
+            if now >= next_renew:
+                self._subscribe_all()
+                next_renew = now + self.lease / 2
+            for key, _ in self.selector.select(timeout=0.1):
+                entry = key.data
+                try:
+                    data = entry["sock"].recv(4096)
+                except OSError:
+                    continue
+                if data.startswith(b"SUBSCRIBED"):
+                    entry["subscribed"] = True
+                    continue
+                try:
+                    entry["samples"] += len(entry["decoder"].decode(data))
+                except ValueError:
+                    continue
+
+
+def run_fanout_benchmark(mode="threaded", rate=2000, subscribers=50, every=10, duration=5.0, commands=50,
+                         interval=0.05, fmt=FORMAT_BINARY, startup_timeout=10.0):
+    """
+    Misura latenza comando->feedback e throughput del consumer principale
+    senza iscritti e con `subscribers` iscritti locali, più i campioni/s
+    ricevuti da ogni iscritto.
+    """
+    dongle = SimulatedDongle(rate).start()
+    collector = FeedbackCollector().start()
+    bridge = start_bridge(mode, dongle.port_name, "warning")
+    cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    pool = None
+    try:
+        if not wait_for_bridge(cmd_sock, fmt, startup_timeout, feedback_sock=collector.sock):
+            raise RuntimeError("Il bridge non ha risposto all'handshake")
+        if not wait_until(lambda: collector.samples > 0, startup_timeout):
+            raise RuntimeError("Nessun feedback ricevuto dal bridge")
+
+        phases = {}
+        baseline_throughput = measure_throughput(dongle, collector, duration)
+        _, to_feedback, timeouts = measure_commands(dongle, collector, cmd_sock, commands, interval)
+        phases["without_subscribers"] = {"throughput": baseline_throughput,
+                                         "command_to_feedback": summarize_ms(to_feedback),
+                                         "command_timeouts": timeouts}
+
+        pool = SubscriberPool(subscribers, every, fmt).start()
+        if not wait_until(lambda: pool.subscribed == subscribers, startup_timeout):
+            raise RuntimeError(f"Solo {pool.subscribed}/{subscribers} iscrizioni confermate")
+        pool.reset()
+        t0 = time.perf_counter()
+        loaded_throughput = measure_throughput(dongle, collector, duration)
+        _, to_feedback, timeouts = measure_commands(dongle, collector, cmd_sock, commands, interval)
+        elapsed = time.perf_counter() - t0
+        rates = [entry["samples"] / elapsed for entry in pool.stats]
+        phases["with_subscribers"] = {"throughput": loaded_throughput,
+                                      "command_to_feedback": summarize_ms(to_feedback),
+                                      "command_timeouts": timeouts}
+        return {
+            "benchmark": "bridge_fanout",
+            "timestamp": time.time(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "config": {"mode": mode, "rate": rate, "subscribers": subscribers, "every": every,
+                       "commands": commands, "format": fmt},
+            **phases,
+            "subscribers": {
+                "expected_samples_per_s": round(rate / every, 1),
+                "min_samples_per_s": round(min(rates), 1),
+                "mean_samples_per_s": round(sum(rates) / len(rates), 1),
+                "datagrams_lost": sum(entry["decoder"].lost for entry in pool.stats),
+            },
+        }
+    finally:
+        if pool is not None:
+            pool.stop()
+        stop_bridge(bridge)
+        cmd_sock.close()
+        collector.stop()
+        dongle.stop()
+
+
+def run_console_benchmark(mode="threaded", rate=20000, duration=5.0, fmt=FORMAT_BINARY, commands=20):
+    """
+    Misura il throughput del bridge con la console attiva (livello info,
+    output sul terminale) e con la console disattivata (livello off).
+    """
+    runs = {}
+    for name, log_level, console in (("console_on", "info", True), ("console_off", "off", False)):
+        result = run_benchmark(mode, rate, commands, 0.05, duration, fmt, log_level=log_level, console=console)
+        runs[name] = {
+            "throughput": result["throughput"],
+            "command_to_feedback": result["command_to_feedback"],
+            "drops": result["drops"],
+        }
+    on = runs["console_on"]["throughput"]["packets_per_s"]
+    off = runs["console_off"]["throughput"]["packets_per_s"]
+    return {
+        "benchmark": "bridge_console",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"mode": mode, "rate": rate, "duration_s": duration, "format": fmt},
+        **runs,
+        "on_off_ratio": round(on / off, 3) if off else None,
+    }
+
+
+class TransportConsumer:
+    """
+    Consumer del feedback su un solo thread, via UDP (porta 5006) o memoria
+    condivisa. Per ogni blocco ricevuto misura il ritardo tra il timestamp
+    host dell'ultimo campione (assegnato dal bridge alla lettura seriale) e
+    la ricezione; misura anche la CPU usata dal proprio thread.
+    """
+    def __init__(self, transport, shm_name=None):
+        self.transport = transport
+        self.shm_name = shm_name
+        self.samples = 0
+        self.datagrams = 0
+        self.counter_gaps = 0
+        self.lost = 0
+        self.delays = []
+        self.cpu_seconds = 0.0
+        self._last_counter = None
+        self.sock = None
+        if transport != "shm":
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            self.sock.bind((UDP_IP, UDP_FEEDBACK_PORT))
+            self.sock.settimeout(0.2)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=2.0)
+
+    def reset(self):
+        self.samples = 0
+        self.datagrams = 0
+        self.counter_gaps = 0
+        self.delays = []
+
+    def _account(self, counters, timestamp):
+        self.delays.append(time.time() - timestamp)
+        self.samples += len(counters)
+        for counter in counters:
+            if self._last_counter is not None:
+                self.counter_gaps += (counter - self._last_counter - 1) % 1000
+            self._last_counter = counter
+
+    def _run(self):
+        cpu_start = time.thread_time()
+        try:
+            if self.transport == "shm":
+                self._run_shm()
+            else:
+                self._run_udp()
+        finally:
+            self.cpu_seconds = time.thread_time() - cpu_start
+
+    def _run_udp(self):
+        sock = self.sock
+        decoder = FeedbackDecoder()
+        try:
+            while self._running:
+                try:
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                try:
+                    torque, _, timestamps = decoder.decode_columns(data)
+                except ValueError:
+                    continue
+                self.datagrams += 1
+                if len(torque):
+                    self._account([int(t) for t in torque], float(timestamps[-1]))
+                self.lost = decoder.lost
+        finally:
+            sock.close()
+
+    def _run_shm(self):
+        from SharedFeedback import SharedFeedbackReader
+        reader = None
+        while reader is None and self._running:
+            try:
+                reader = SharedFeedbackReader(self.shm_name)
+            except FileNotFoundError:
+                time.sleep(0.05)
+        if reader is None:
+            return
+        try:
+            while self._running:
+                if not reader.wait(0.2):
+                    continue
+                batch = reader.read_new()
+                if len(batch):
+                    self._account(batch.torque.tolist(), float(batch.timestamp[-1]))
+                self.lost = reader.lost
+        finally:
+            reader.close()
+
+
+def _children_cpu():
+    """CPU (utente + sistema) dei sottoprocessi terminati; None dove resource non esiste (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_transport(transport, mode, rate, duration, startup_timeout=10.0, filter_spec=None):
+    """
+    Una run del bridge con il consumer principale su `transport` ("udp" o
+    "shm"); via UDP il consumer può chiedere i filtri `filter_spec`.
+    """
+    shm_name = f"sixthfinger_bench_{os.getpid()}"
+    dongle = SimulatedDongle(rate).start()
+    consumer = TransportConsumer(transport, shm_name).start()
+    cpu_before = _children_cpu()
+    started = time.perf_counter()
+    bridge = start_bridge(mode, dongle.port_name, "warning",
+                          extra_args=("--feedback-transport", transport, "--shm-name", shm_name))
+    cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # HELLO anche con shm: il bridge è pronto quando risponde CAPS
+        if not wait_for_bridge(cmd_sock, FORMAT_BINARY, startup_timeout, filter_spec, consumer.sock):
+            raise RuntimeError("Il bridge non ha risposto all'handshake")
+        if not wait_until(lambda: consumer.samples > 0, startup_timeout):
+            raise RuntimeError(f"Nessun feedback ricevuto via {transport}")
+        consumer.reset()
+        sent_before = dongle.packets_sent
+        time.sleep(duration)
+        emitted = dongle.packets_sent - sent_before
+        samples, gaps, delays = consumer.samples, consumer.counter_gaps, list(consumer.delays)
+        datagrams = consumer.datagrams
+    finally:
+        stop_bridge(bridge)
+        lifetime = time.perf_counter() - started
+        cmd_sock.close()
+        consumer.stop()
+        dongle.stop()
+    cpu_after = _children_cpu()
+    bridge_cpu = None if cpu_before is None else cpu_after - cpu_before
+    return {
+        "samples_emitted": emitted,
+        "samples_received": samples,
+        "samples_per_s": round(samples / duration, 1),
+        "datagrams_per_s": round(datagrams / duration, 1),
+        "counter_gaps": gaps,
+        "lost": consumer.lost,
+        "bridge_to_consumer": summarize_ms(delays),
+        "blocks_per_s": round(len(delays) / duration, 1),
+        # CPU dell'intero processo del bridge (avvio compreso), diviso la sua durata
+        "bridge_cpu_percent": None if bridge_cpu is None else round(100.0 * bridge_cpu / lifetime, 2),
+        "consumer_cpu_percent": round(100.0 * consumer.cpu_seconds / lifetime, 2),
+    }
+
+
+def run_shm_benchmark(mode="threaded", rate=2000, duration=5.0):
+    """Confronta il consumer principale via UDP e via memoria condivisa."""
+    runs = {transport: run_transport(transport, mode, rate, duration) for transport in ("udp", "shm")}
+    return {
+        "benchmark": "bridge_transport",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"mode": mode, "rate": rate, "duration_s": duration},
+        **runs,
+    }
+
+
+def run_filter_benchmark(mode="threaded", rate=20000, duration=5.0,
+                         filters=("none", "minmax:10", "mean:33", "ma:8,mean:33,velocity")):
+    """
+    Consumer principale via UDP con ciascuno dei filtri chiesti nell'HELLO.
+    counter_gaps è significativo solo per i campioni grezzi ("none"): i
+    filtri cambiano il campo torque che porta il contatore del dongle.
+    """
+    runs = []
+    for spec in filters:
+        run = run_transport("udp", mode, rate, duration, filter_spec=spec)
+        runs.append({"filter": spec, **run})
+    return {
+        "benchmark": "bridge_filter",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"mode": mode, "rate": rate, "duration_s": duration, "filters": list(filters)},
+        "runs": runs,
+    }
+
+
+def run_reader_benchmark(mode="threaded", rates=(200, 2000, 20000), profiles=tuple(PORT_PROFILES),
+                         duration=3.0, commands=30, interval=0.05, startup_timeout=10.0):
+    """
+    Per ogni profilo e frequenza: throughput, sveglie del reader (letture/s),
+    byte per lettura e latenza comando->feedback, che comprende l'attesa
+    aggiunta dal reader adattivo.
+    """
+    runs = []
+    for profile in profiles:
+        for rate in rates:
+            dongle = SimulatedDongle(rate).start()
+            collector = FeedbackCollector().start()
+            bridge = start_bridge(mode, dongle.port_name, "warning", extra_args=("--serial-profile", profile))
+            cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                if not wait_for_bridge(cmd_sock, FORMAT_BINARY, startup_timeout, feedback_sock=collector.sock):
+                    raise RuntimeError("Il bridge non ha risposto all'handshake")
+                if not wait_until(lambda: collector.samples > 0, startup_timeout):
+                    raise RuntimeError("Nessun feedback ricevuto dal bridge")
+                throughput = measure_throughput(dongle, collector, duration)
+                metrics = query()["metrics"]
+                _, to_feedback, timeouts = measure_commands(dongle, collector, cmd_sock, commands, interval)
+            finally:
+                stop_bridge(bridge)
+                cmd_sock.close()
+                collector.stop()
+                dongle.stop()
+            runs.append({
+                "profile": profile,
+                "rate": rate,
+                "packets_per_s": throughput["packets_per_s"],
+                "counter_gaps": throughput["counter_gaps"],
+                "reads_per_s": metrics["serial.reads_per_s.robot"],
+                "bytes_per_read": metrics["serial.bytes_per_read.robot"],
+                "packets_per_read": round(metrics["serial.bytes_per_read.robot"] / 11, 2),
+                "read_target_bytes": metrics["serial.read_target_bytes.robot"],
+                "read_wait": metrics["serial.read_wait_seconds"],
+                "command_to_feedback": summarize_ms(to_feedback),
+                "command_timeouts": timeouts,
+            })
+    return {
+        "benchmark": "bridge_reader",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"mode": mode, "rates": list(rates), "profiles": list(profiles), "duration_s": duration,
+                   "commands": commands},
+        "runs": runs,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark latenza/throughput del bridge con dongle simulato")
+    parser.add_argument("--scenario", choices=("latency", "replug", "console", "fanout", "shm", "reader",
+                                                 "filter"), default="latency")
+    parser.add_argument("--mode", choices=("threaded", "async"), default="threaded")
+    parser.add_argument("--rate", type=float, default=1000, help="pacchetti/s emessi dal dongle simulato")
+    parser.add_argument("--commands", type=int, default=100, help="numero di comandi da misurare")
+    parser.add_argument("--interval", type=float, default=0.05, help="pausa tra i comandi (s)")
+    parser.add_argument("--duration", type=float, default=5.0, help="durata della misura di throughput (s)")
+    parser.add_argument("--replugs", type=int, default=5, help="scenario replug: numero di scollegamenti")
+    parser.add_argument("--downtime", type=float, default=0.5, help="scenario replug: durata scollegamento (s)")
+    parser.add_argument("--subscribers", type=int, default=50, help="scenario fanout: consumer iscritti")
+    parser.add_argument("--every", type=int, default=10, help="scenario fanout: decimazione degli iscritti")
+    parser.add_argument("--rates", default="200,2000,20000",
+                        help="scenario reader: frequenze del dongle simulato separate da virgole")
+    parser.add_argument("--filters", default="none;minmax:10;mean:33;ma:8,mean:33,velocity",
+                        help="scenario filter: filtri da provare separati da ';'")
+    parser.add_argument("--format", choices=(FORMAT_BINARY, FORMAT_ASCII), default=FORMAT_BINARY)
+    parser.add_argument("--output", default=None, help="file JSON di uscita (default stdout)")
+    parser.add_argument("--max-p99-ms", type=float, default=None,
+                        help="esce con codice 1 se la p99 comando->feedback supera la soglia")
+    args = parser.parse_args(argv)
+
+    if args.scenario == "replug":
+        result = run_replug_benchmark(args.mode, args.rate, args.replugs, args.downtime, args.format)
+    elif args.scenario == "fanout":
+        result = run_fanout_benchmark(args.mode, args.rate, args.subscribers, args.every, args.duration,
+                                      args.commands, args.interval, args.format)
+    elif args.scenario == "reader":
+        rates = [float(rate) for rate in args.rates.split(",")]
+        result = run_reader_benchmark(args.mode, rates, duration=args.duration, commands=min(args.commands, 30),
+                                      interval=args.interval)
+    elif args.scenario == "filter":
+        result = run_filter_benchmark(args.mode, args.rate, args.duration, args.filters.split(";"))
+    elif args.scenario == "shm":
+        result = run_shm_benchmark(args.mode, args.rate, args.duration)
+    elif args.scenario == "console":
+        result = run_console_benchmark(args.mode, args.rate, args.duration, args.format)
+    else:
+        result = run_benchmark(args.mode, args.rate, args.commands, args.interval, args.duration, args.format)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.scenario == "replug":
+        return 1 if result["recovery_failures"] else 0
+    if args.scenario in ("console", "shm", "reader", "filter"):
+        return 0
+    if args.scenario == "fanout":
+        p99 = result["with_subscribers"]["command_to_feedback"]["p99_ms"]
+    else:
+        p99 = result["command_to_feedback"]["p99_ms"]
+    if args.max_p99_ms is not None and (p99 is None or p99 > args.max_p99_ms):
+        print(f"Regressione: p99 comando->feedback {p99} ms > {args.max_p99_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
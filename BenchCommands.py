@@ -0,0 +1,546 @@
+"""
+Generatore di carico per la porta comandi UDP del bridge e soak test.
+
+Più client (--senders, ognuno con il proprio socket e quindi il proprio
+indirizzo) inviano comandi con identificativo ("CLOSE 3.17", vedi
+CommandQueue) alla frequenza complessiva --rate, secondo uno schema:
+  - sequence: ripete la sequenza --sequence (es. "CLOSE,OPEN,STOP", oppure
+    "@file" con un comando per riga)
+  - random: OPEN/CLOSE casuali, con STOP in proporzione --stop-ratio
+Con --junk-ratio una parte dei datagrammi è spazzatura (comandi sconosciuti
+e datagrammi oltre i 1024 byte letti dal listener), a cui il bridge deve
+rispondere NAK UNKNOWN senza smettere di ascoltare.
+
+Di default avvia un SimulatedDongle su pty e il bridge come sottoprocesso
+(come BenchBridge); con --attach usa un bridge già avviato (e, con
+--bridge-pid, ne misura la memoria). Ogni --sample-interval secondi
+registra nella timeline:
+  - comandi inviati, conferme ricevute per stato, comandi persi (nessuna
+    risposta finale entro --reply-timeout) e latenza di andata e ritorno
+    fino ad ACK WRITTEN
+  - comandi scritti sulla seriale al secondo (ricevuti dal dongle simulato)
+    e contatori del bridge dall'endpoint delle metriche (command.*)
+  - continuità del feedback: campioni/s, buchi nel contatore del dongle,
+    datagrammi persi e pausa massima tra due datagrammi
+  - memoria residente (RSS) del bridge
+Il risultato è un documento JSON (stdout o --output) con la timeline e il
+riepilogo, compresa la crescita della memoria in MB/ora (regressione
+lineare sulla timeline, esclusi i primi campioni di riscaldamento).
+L'avanzamento viene stampato su stderr a ogni campione.
+
+Esempio:
+    python BenchCommands.py --rate 500 --senders 50 --duration 60
+    python BenchCommands.py --mode async --pattern random --rate 2000 --duration 3600 --max-rss-growth 5
+"""
+import argparse
+import json
+import platform
+import random
+import selectors
+import socket
+import sys
+import threading
+import time
+
+from BenchBridge import (UDP_CMD_PORT, UDP_FEEDBACK_PORT, UDP_IP, start_bridge, stop_bridge, summarize_ms,
+                         wait_for_bridge, wait_until)
+from FeedbackProtocol import FORMAT_BINARY, FeedbackDecoder
+from Metrics import query
+
+COMMANDS = ("CLOSE", "OPEN", "STOP")
+# Stati che chiudono il tracciamento di un comando (vedi CommandQueue)
+FINAL_STATUSES = ("CONFIRMED", "SUPERSEDED", "PREEMPTED", "TIMEOUT", "ERROR", "UNKNOWN")
+# Contatori del bridge riportati nella timeline
+BRIDGE_METRICS = ("command.received", "command.written", "command.coalesced", "command.preempted",
+                  "command.confirmed", "command.timeouts", "command.unknown", "command.recv_errors",
+                  "command.queued", "log.records_dropped")
+MAX_BURST = 1000
+
+
+def process_rss(pid):
+    """Memoria residente del processo in byte (psutil o /proc), None se non disponibile."""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def load_sequence(text):
+    """"CLOSE,OPEN,STOP" oppure "@file" (un comando per riga, # per i commenti)."""
+    if text.startswith("@"):
+        with open(text[1:]) as f:
+            names = [line.split("#")[0].strip() for line in f]
+    else:
+        names = [name.strip() for name in text.split(",")]
+    names = [name.upper() for name in names if name]
+    unknown = [name for name in names if name not in COMMANDS]
+    if not names or unknown:
+        raise ValueError(f"sequenza non valida: {', '.join(unknown) or 'vuota'}")
+    return names
+
+
+def make_pattern(kind, sequence=("CLOSE", "OPEN"), stop_ratio=0.05, seed=1):
+    """Restituisce una funzione senza argomenti che produce il prossimo comando."""
+    if kind == "sequence":
+        state = {"index": 0}
+
+        def next_command():
+            name = sequence[state["index"] % len(sequence)]
+            state["index"] += 1
+            return name
+        return next_command
+    rng = random.Random(seed)
+
+    def next_random():
+        if rng.random() < stop_ratio:
+            return "STOP"
+        return "CLOSE" if rng.random() < 0.5 else "OPEN"
+    return next_random
+
+
+def junk_datagram(rng, cmd_id):
+    """Comando sconosciuto, a volte oltre i 1024 byte letti dal listener."""
+    if rng.random() < 0.5:
+        return f"JUNK {cmd_id}".encode('ascii')
+    return f"JUNK {cmd_id} ".encode('ascii') + b"x" * rng.randint(1024, 4000)
+
+
+class CommandLoad:
+    """
+    Invia comandi con identificativo da `senders` socket a `rate` comandi/s e
+    ne segue le conferme. Un comando è perso se non riceve una risposta
+    finale (FINAL_STATUSES) entro `reply_timeout` secondi; `unanswered`
+    conta quelli che non hanno ricevuto nessuna risposta (datagramma perso
+    prima del bridge o nel bridge).
+    """
+    def __init__(self, senders=10, rate=100.0, pattern=None, junk_ratio=0.0, reply_timeout=3.0,
+                 dest=(UDP_IP, UDP_CMD_PORT), seed=1):
+        self.rate = rate
+        self.pattern = pattern or make_pattern("sequence")
+        self.junk_ratio = junk_ratio
+        self.reply_timeout = reply_timeout
+        self.dest = dest
+        self._rng = random.Random(seed)
+        self._socks = []
+        self._selector = selectors.DefaultSelector()
+        for index in range(senders):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((UDP_IP, 0))
+            sock.setblocking(False)
+            self._socks.append(sock)
+            self._selector.register(sock, selectors.EVENT_READ, index)
+        self._lock = threading.Lock()
+        self._pending = {}          # id -> [istante di invio, risposta ricevuta, spazzatura]
+        self._running = False
+        self._threads = []
+        self.sent = 0
+        self.junk_sent = 0
+        self.send_errors = 0
+        self.statuses = dict.fromkeys(("WRITTEN",) + FINAL_STATUSES, 0)
+        self.lost = 0
+        self.unanswered = 0
+        self.junk_unanswered = 0
+        self.late_replies = 0
+        self._written_rtt = []      # secondi fino ad ACK WRITTEN, azzerati a ogni snapshot
+
+    def start(self):
+        self._running = True
+        self._threads = [threading.Thread(target=self._send_loop, name="load-send", daemon=True),
+                         threading.Thread(target=self._recv_loop, name="load-recv", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop_sending(self):
+        self._running = False
+        self._threads[0].join(timeout=2.0)
+
+    def close(self):
+        """Attende le risposte ancora attese, poi chiude i socket."""
+        self._running = False
+        deadline = time.perf_counter() + self.reply_timeout
+        while self._pending and time.perf_counter() < deadline:
+            time.sleep(0.05)
+            self.sweep()
+        self.sweep(force=True)
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._selector.close()
+        for sock in self._socks:
+            sock.close()
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def _send_loop(self):
+        start = time.perf_counter()
+        socks = self._socks
+        junk_ratio = self.junk_ratio
+        rng = self._rng
+        sent = 0
+        while self._running:
+            due = int((time.perf_counter() - start) * self.rate) - sent
+            if due <= 0:
+                time.sleep(0.0005)
+                continue
+            for _ in range(min(due, MAX_BURST)):
+                index = sent % len(socks)
+                cmd_id = f"{index}.{sent}"
+                junk = junk_ratio and rng.random() < junk_ratio
+                payload = junk_datagram(rng, cmd_id) if junk else f"{self.pattern()} {cmd_id}".encode('ascii')
+                with self._lock:
+                    self._pending[cmd_id] = [time.perf_counter(), False, junk]
+                try:
+                    socks[index].sendto(payload, self.dest)
+                except OSError:
+                    # Es. buffer di invio pieno: conta come comando perso
+                    self.send_errors += 1
+                sent += 1
+                if junk:
+                    self.junk_sent += 1
+                else:
+                    self.sent += 1
+
+    def _recv_loop(self):
+        while self._running or self._pending:
+            try:
+                events = self._selector.select(0.1)
+            except (OSError, ValueError):
+                return
+            for key, _ in events:
+                while True:
+                    try:
+                        data = key.fileobj.recv(256)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        # Windows: ICMP "port unreachable" se il bridge è fermo
+                        break
+                    self._handle_reply(data, time.perf_counter())
+
+    def _handle_reply(self, data, now):
+        tokens = data.decode('ascii', errors='replace').split()
+        if len(tokens) < 3 or tokens[0] not in ("ACK", "NAK"):
+            return
+        cmd_id, status = tokens[1], tokens[2]
+        with self._lock:
+            entry = self._pending.get(cmd_id)
+            if entry is None:
+                self.late_replies += 1
+                return
+            entry[1] = True
+            if status in FINAL_STATUSES:
+                del self._pending[cmd_id]
+        if status in self.statuses:
+            self.statuses[status] += 1
+        if status == "WRITTEN":
+            self._written_rtt.append(now - entry[0])
+
+    def sweep(self, force=False):
+        """Conta come persi i comandi senza risposta finale entro reply_timeout."""
+        deadline = time.perf_counter() - self.reply_timeout
+        with self._lock:
+            expired = [cmd_id for cmd_id, entry in self._pending.items() if force or entry[0] < deadline]
+            entries = [self._pending.pop(cmd_id) for cmd_id in expired]
+        for _, answered, junk in entries:
+            if junk:
+                self.junk_unanswered += 1
+                continue
+            self.lost += 1
+            if not answered:
+                self.unanswered += 1
+
+    def snapshot(self):
+        """Contatori cumulativi e latenze (azzerate) dall'ultimo snapshot."""
+        self.sweep()
+        rtt, self._written_rtt = self._written_rtt, []
+        return {
+            "sent": self.sent,
+            "junk_sent": self.junk_sent,
+            "send_errors": self.send_errors,
+            "statuses": dict(self.statuses),
+            "lost": self.lost,
+            "unanswered": self.unanswered,
+            "junk_unanswered": self.junk_unanswered,
+            "late_replies": self.late_replies,
+            "in_flight": self.in_flight,
+            "written_rtt": summarize_ms(rtt),
+        }
+
+
+class ContinuityMonitor:
+    """
+    Consumer del feedback per le prove lunghe: solo contatori (nessuna lista
+    che cresce con la durata). Conta campioni, buchi nel contatore del dongle
+    simulato, datagrammi persi e la pausa più lunga tra due datagrammi.
+    """
+    def __init__(self, addr=(UDP_IP, UDP_FEEDBACK_PORT)):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(addr)
+        self.sock.settimeout(0.2)
+        self.decoder = FeedbackDecoder()
+        self.samples = 0
+        self.counter_gaps = 0
+        self.max_stall = 0.0        # azzerata a ogni snapshot
+        self._last_counter = None
+        self._last_datagram = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="feedback-monitor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=1.0)
+        self.sock.close()
+
+    def _run(self):
+        while self._running:
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            now = time.perf_counter()
+            try:
+                counters, _, _ = self.decoder.decode_columns(data)
+            except ValueError:
+                continue
+            if self._last_datagram is not None:
+                self.max_stall = max(self.max_stall, now - self._last_datagram)
+            self._last_datagram = now
+            last = self._last_counter
+            for counter in counters.tolist() if hasattr(counters, "tolist") else counters:
+                if last is not None:
+                    self.counter_gaps += (counter - last - 1) % 1000
+                last = counter
+            self._last_counter = last
+            self.samples += len(counters)
+
+    def snapshot(self):
+        stall, self.max_stall = self.max_stall, 0.0
+        if self._last_datagram is not None:
+            # Anche una pausa ancora in corso conta
+            stall = max(stall, time.perf_counter() - self._last_datagram)
+        return {"samples": self.samples, "counter_gaps": self.counter_gaps,
+                "datagrams_lost": self.decoder.lost, "max_stall_ms": round(stall * 1000.0, 3)}
+
+
+def bridge_metrics(stats_port):
+    """Contatori command.* del bridge dall'endpoint delle metriche (None se non risponde)."""
+    try:
+        metrics = query(addr=(UDP_IP, stats_port))["metrics"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return {name: metrics.get(name) for name in BRIDGE_METRICS}
+
+
+def rss_growth(timeline, warmup):
+    """Pendenza (MB/ora) della RSS sulla timeline, esclusi i primi `warmup` campioni."""
+    points = [(entry["elapsed_s"], entry["bridge_rss_mb"]) for entry in timeline[warmup:]
+              if entry["bridge_rss_mb"] is not None]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_m = sum(m for _, m in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if var == 0:
+        return None
+    slope = sum((t - mean_t) * (m - mean_m) for t, m in points) / var
+    return round(slope * 3600.0, 3)
+
+
+def run_load(load, monitor, dongle, bridge_pid, duration, sample_interval, stats_port):
+    """Esegue il carico per `duration` secondi e restituisce la timeline."""
+    timeline = []
+    previous = {"sent": 0, "lost": 0, "samples": 0, "counter_gaps": 0}
+    dongle_before = dongle.commands_received if dongle is not None else None
+    load.start()
+    started = last = time.perf_counter()
+    end = started + duration
+    next_sample = started + sample_interval
+    while last < end:
+        time.sleep(max(0.0, min(next_sample, end) - time.perf_counter()))
+        now = time.perf_counter()
+        elapsed = now - last
+        last = now
+        next_sample += sample_interval
+        commands = load.snapshot()
+        feedback = monitor.snapshot()
+        rss = process_rss(bridge_pid) if bridge_pid else None
+        serial_commands = None
+        if dongle is not None:
+            serial_commands = dongle.commands_received - dongle_before
+            dongle_before = dongle.commands_received
+        entry = {
+            "elapsed_s": round(now - started, 3),
+            "commands_sent": commands["sent"] - previous["sent"],
+            "commands_per_s": round((commands["sent"] - previous["sent"]) / elapsed, 1),
+            "commands_lost": commands["lost"] - previous["lost"],
+            "in_flight": commands["in_flight"],
+            "written_rtt": commands["written_rtt"],
+            "serial_writes_per_s": None if serial_commands is None else round(serial_commands / elapsed, 1),
+            "feedback_samples_per_s": round((feedback["samples"] - previous["samples"]) / elapsed, 1),
+            "feedback_counter_gaps": feedback["counter_gaps"] - previous["counter_gaps"],
+            "feedback_max_stall_ms": feedback["max_stall_ms"],
+            "bridge_rss_mb": None if rss is None else round(rss / 1e6, 3),
+            "bridge": bridge_metrics(stats_port) if stats_port else None,
+        }
+        timeline.append(entry)
+        previous = {"sent": commands["sent"], "lost": commands["lost"], "samples": feedback["samples"],
+                    "counter_gaps": feedback["counter_gaps"]}
+        print(f"[{entry['elapsed_s']:8.1f} s] comandi {entry['commands_per_s']:.0f}/s, persi "
+              f"{commands['lost']}, in attesa {entry['in_flight']}, seriale {entry['serial_writes_per_s']}/s, "
+              f"feedback {entry['feedback_samples_per_s']:.0f}/s (buchi {entry['feedback_counter_gaps']}), "
+              f"RSS {entry['bridge_rss_mb']} MB", file=sys.stderr)
+    load.stop_sending()
+    return timeline
+
+
+def run_soak(mode="threaded", rate=200.0, senders=20, duration=60.0, pattern="sequence", sequence=("CLOSE", "OPEN"),
+             stop_ratio=0.05, junk_ratio=0.0, dongle_rate=1000, sample_interval=5.0, reply_timeout=3.0,
+             warmup=1, attach=False, bridge_pid=None, stats_port=5007, bridge_args=(), startup_timeout=10.0):
+    dongle = bridge = None
+    monitor = ContinuityMonitor().start()
+    cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        if not attach:
+            from SimulatedDongle import SimulatedDongle
+            dongle = SimulatedDongle(dongle_rate, log_commands=False).start()
+            bridge = start_bridge(mode, dongle.port_name, "warning",
+                                  extra_args=("--stats-port", str(stats_port), *bridge_args))
+            bridge_pid = bridge.pid
+        if not wait_for_bridge(cmd_sock, FORMAT_BINARY, startup_timeout, feedback_sock=monitor.sock):
+            raise RuntimeError("Il bridge non ha risposto all'handshake")
+        if not wait_until(lambda: monitor.samples > 0, startup_timeout):
+            raise RuntimeError("Nessun feedback ricevuto dal bridge")
+        load = CommandLoad(senders, rate, make_pattern(pattern, sequence, stop_ratio), junk_ratio, reply_timeout)
+        rss_start = process_rss(bridge_pid) if bridge_pid else None
+        timeline = run_load(load, monitor, dongle, bridge_pid, duration, sample_interval, stats_port)
+        load.close()
+        commands = load.snapshot()
+        feedback = monitor.snapshot()
+        rss_end = process_rss(bridge_pid) if bridge_pid else None
+        bridge_final = bridge_metrics(stats_port) if stats_port else None
+        if bridge is not None and bridge.poll() is not None:
+            raise RuntimeError(f"Il bridge è terminato durante la prova (codice {bridge.returncode})")
+    finally:
+        if bridge is not None:
+            stop_bridge(bridge)
+        cmd_sock.close()
+        monitor.stop()
+        if dongle is not None:
+            dongle.stop()
+
+    sent = commands["sent"]
+    return {
+        "benchmark": "command_soak",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"mode": mode, "attach": attach, "rate": rate, "senders": senders, "duration_s": duration,
+                   "pattern": pattern, "sequence": list(sequence), "stop_ratio": stop_ratio,
+                   "junk_ratio": junk_ratio, "dongle_rate": dongle_rate, "sample_interval_s": sample_interval,
+                   "reply_timeout_s": reply_timeout},
+        "summary": {
+            "commands_sent": sent,
+            "commands_per_s": round(sent / duration, 1),
+            "statuses": commands["statuses"],
+            "commands_lost": commands["lost"],
+            "loss_ratio": round(commands["lost"] / sent, 6) if sent else None,
+            "unanswered": commands["unanswered"],
+            "send_errors": commands["send_errors"],
+            "late_replies": commands["late_replies"],
+            "junk_sent": commands["junk_sent"],
+            "junk_unanswered": commands["junk_unanswered"],
+            "serial_writes": dongle.commands_received if dongle is not None else None,
+            "serial_writes_per_s": round(dongle.commands_received / duration, 1) if dongle is not None else None,
+            "feedback_samples": feedback["samples"],
+            "feedback_counter_gaps": feedback["counter_gaps"],
+            "feedback_datagrams_lost": feedback["datagrams_lost"],
+            "feedback_max_stall_ms": max((entry["feedback_max_stall_ms"] for entry in timeline), default=None),
+            "bridge_rss_start_mb": None if rss_start is None else round(rss_start / 1e6, 3),
+            "bridge_rss_end_mb": None if rss_end is None else round(rss_end / 1e6, 3),
+            "bridge_rss_growth_mb_per_hour": rss_growth(timeline, warmup),
+            "bridge": bridge_final,
+        },
+        "timeline": timeline,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generatore di carico per la porta comandi UDP e soak test del bridge")
+    parser.add_argument("--mode", choices=("threaded", "async"), default="threaded", help="modalità del bridge avviato")
+    parser.add_argument("--rate", type=float, default=200.0, help="comandi/s complessivi")
+    parser.add_argument("--senders", type=int, default=20, help="client concorrenti (un socket ciascuno)")
+    parser.add_argument("--duration", type=float, default=60.0, help="durata della prova (s)")
+    parser.add_argument("--pattern", choices=("sequence", "random"), default="sequence")
+    parser.add_argument("--sequence", default="CLOSE,OPEN",
+                        help="comandi ripetuti dallo schema sequence, separati da virgole, oppure @file")
+    parser.add_argument("--stop-ratio", type=float, default=0.05, help="schema random: frazione di STOP")
+    parser.add_argument("--junk-ratio", type=float, default=0.0,
+                        help="frazione di datagrammi spazzatura (comandi sconosciuti, anche oltre 1024 byte)")
+    parser.add_argument("--dongle-rate", type=float, default=1000, help="pacchetti/s del dongle simulato")
+    parser.add_argument("--sample-interval", type=float, default=5.0, help="intervallo tra i campioni della timeline (s)")
+    parser.add_argument("--reply-timeout", type=float, default=3.0,
+                        help="attesa massima della risposta finale prima di contare un comando come perso (s)")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="campioni della timeline esclusi dal calcolo della crescita della memoria")
+    parser.add_argument("--attach", action="store_true",
+                        help="usa un bridge già avviato invece di avviarne uno con il dongle simulato")
+    parser.add_argument("--bridge-pid", type=int, default=None, help="con --attach: PID del bridge per la memoria")
+    parser.add_argument("--stats-port", type=int, default=5007, help="porta dell'endpoint delle metriche (0: non usarlo)")
+    parser.add_argument("--bridge-arg", action="append", default=[],
+                        help="argomento aggiuntivo per il bridge avviato (ripetibile), es. --bridge-arg=--serial-profile=low-latency")
+    parser.add_argument("--output", default=None, help="file JSON di uscita (default stdout)")
+    parser.add_argument("--max-loss", type=float, default=None,
+                        help="esce con codice 1 se la frazione di comandi persi supera la soglia")
+    parser.add_argument("--max-rss-growth", type=float, default=None, metavar="MB_ORA",
+                        help="esce con codice 1 se la memoria del bridge cresce più della soglia (MB/ora)")
+    args = parser.parse_args(argv)
+
+    try:
+        sequence = load_sequence(args.sequence)
+    except (OSError, ValueError) as e:
+        parser.error(f"--sequence: {e}")
+    result = run_soak(args.mode, args.rate, args.senders, args.duration, args.pattern, sequence, args.stop_ratio,
+                      args.junk_ratio, args.dongle_rate, args.sample_interval, args.reply_timeout, args.warmup,
+                      args.attach, args.bridge_pid, args.stats_port, args.bridge_arg)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    summary = result["summary"]
+    status = 0
+    if args.max_loss is not None and (summary["loss_ratio"] or 0.0) > args.max_loss:
+        print(f"Regressione: comandi persi {summary['loss_ratio']} > {args.max_loss}", file=sys.stderr)
+        status = 1
+    growth = summary["bridge_rss_growth_mb_per_hour"]
+    if args.max_rss_growth is not None and growth is not None and growth > args.max_rss_growth:
+        print(f"Regressione: memoria del bridge +{growth} MB/ora > {args.max_rss_growth}", file=sys.stderr)
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
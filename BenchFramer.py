@@ -0,0 +1,165 @@
+"""
+Benchmark fuzz del framer seriale (PacketFramer) con flussi misti.
+
+Genera un flusso di pacchetti di feedback validi in cui, con probabilità
+--garbage per pacchetto, viene inserito un disturbo:
+  - noise: 1-24 byte casuali (ricchi di '$' e cifre)
+  - stray_start: uno start byte isolato
+  - truncated: un pacchetto troncato
+  - corrupt: un pacchetto con un byte non cifra al posto di una cifra
+  - digit_swap: un pacchetto con una cifra cambiata (rilevabile solo dal CRC)
+e lo passa al framer a blocchi di dimensione casuale, come farebbe il
+reader seriale. Per ogni validazione (PacketFramer.FRAME_CHECKS) misura
+MB/s e pacchetti/s (framing + decodifica), pacchetti validi persi,
+pacchetti accettati ma non validi e i contatori del framer.
+Il risultato è un documento JSON (stdout o --output) confrontabile tra run.
+
+Esempio:
+    python BenchFramer.py --packets 200000 --garbage 0,0.01,0.1,0.5
+"""
+import argparse
+import collections
+import json
+import platform
+import random
+import sys
+import time
+
+from PacketDecoder import check_layout, decode_batch
+from PacketFramer import FRAME_CHECKS, RingBufferFramer, add_crc8_hex
+
+DISTURBANCES = ("noise", "stray_start", "truncated", "corrupt", "digit_swap")
+NOISE_ALPHABET = b"$$$0123456789_*" + bytes(range(256))
+
+
+def make_frame(index, crc):
+    # torque e position diversi per ogni pacchetto (fino a 1e6): pacchetti tutti distinti
+    if crc:
+        return add_crc8_hex(b"$%03d_%03d*" % (index % 1000, index // 1000 % 1000))
+    return b"$%03d_%03d***" % (index % 1000, index // 1000 % 1000)
+
+
+def make_stream(packets, garbage, crc, seed=1):
+    """Restituisce (flusso, pacchetti validi attesi, conteggio dei disturbi per tipo)."""
+    rng = random.Random(seed)
+    out = bytearray()
+    expected = set()
+    counts = dict.fromkeys(DISTURBANCES, 0)
+    for index in range(packets):
+        frame = make_frame(index, crc)
+        kind = rng.choice(DISTURBANCES) if rng.random() < garbage else None
+        if kind is not None:
+            counts[kind] += 1
+        if kind == "noise":
+            out += bytes(rng.choice(NOISE_ALPHABET) for _ in range(rng.randint(1, 24)))
+        elif kind == "stray_start":
+            out += b"$"
+        elif kind == "truncated":
+            out += frame[:rng.randint(1, len(frame) - 1)]
+        elif kind in ("corrupt", "digit_swap"):
+            frame = bytearray(frame)
+            col = rng.choice((1, 2, 3, 5, 6, 7))
+            if kind == "corrupt":
+                frame[col] = rng.choice(b"abcxyz#@ \x00\xff")
+            else:
+                frame[col] = ord("0") + (frame[col] - ord("0") + rng.randint(1, 9)) % 10
+            out += frame
+            continue
+        out += frame
+        expected.add(frame)
+    return bytes(out), expected, counts
+
+
+def chunks(stream, seed=2, max_chunk=512):
+    rng = random.Random(seed)
+    position = 0
+    while position < len(stream):
+        size = rng.randint(1, max_chunk)
+        yield stream[position:position + size]
+        position += size
+
+
+def measure_throughput(stream, spec, repeat=3):
+    """Miglior tempo su `repeat` passaggi di framing + decodifica in blocco."""
+    pieces = list(chunks(stream))
+    length = check_layout(spec)
+    best = None
+    for _ in range(repeat):
+        framer = RingBufferFramer(None, spec, 4096, lambda buf, offsets: decode_batch(buf, offsets, length=length))
+        start = time.perf_counter()
+        for piece in pieces:
+            framer.feed(piece)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, framer
+
+
+def check_delivery(stream, spec, expected):
+    """Confronta i pacchetti consegnati con quelli validi attesi."""
+    delivered = []
+    framer = RingBufferFramer(None, spec, 4096,
+                              lambda buf, offsets: delivered.extend(bytes(buf[o:o + 11]) for o in offsets))
+    for piece in chunks(stream):
+        framer.feed(piece)
+    # Un pacchetto atteso conta una sola volta (una cifra cambiata può riprodurre un altro pacchetto)
+    good = sum(1 for frame in collections.Counter(delivered) if frame in expected)
+    return {
+        "expected": len(expected),
+        "accepted": len(delivered),
+        "valid_lost": len(expected) - good,
+        "invalid_accepted": len(delivered) - good,
+    }
+
+
+def run_framer_benchmark(packets=200000, garbage_levels=(0.0, 0.01, 0.1, 0.5), checks=tuple(FRAME_CHECKS)):
+    runs = []
+    for check in checks:
+        spec = FRAME_CHECKS[check]
+        crc = spec.checksum is not None
+        for garbage in garbage_levels:
+            stream, expected, disturbances = make_stream(packets, garbage, crc)
+            elapsed, framer = measure_throughput(stream, spec)
+            runs.append({
+                "check": check,
+                "garbage": garbage,
+                "disturbances": disturbances,
+                "stream_bytes": len(stream),
+                "mb_per_s": round(len(stream) / elapsed / 1e6, 2),
+                "packets_per_s": round(framer.packets / elapsed, 1),
+                "delivery": check_delivery(stream, spec, expected),
+                "framer": {"accepted": framer.packets, "rejected": framer.rejected,
+                           "resyncs": framer.resyncs, "bytes_dropped": framer.bytes_dropped},
+            })
+    return {
+        "benchmark": "framer_fuzz",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": {"packets": packets, "garbage": list(garbage_levels), "checks": list(checks)},
+        "runs": runs,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark fuzz del framer seriale con flussi misti")
+    parser.add_argument("--packets", type=int, default=200000, help="pacchetti validi generati per run")
+    parser.add_argument("--garbage", default="0,0.01,0.1,0.5",
+                        help="probabilità di disturbo per pacchetto, separate da virgole")
+    parser.add_argument("--check", action="append", choices=tuple(FRAME_CHECKS),
+                        help="validazioni da provare (ripetibile, default tutte)")
+    parser.add_argument("--output", default=None, help="file JSON di uscita (default stdout)")
+    args = parser.parse_args(argv)
+
+    levels = [float(level) for level in args.garbage.split(",")]
+    result = run_framer_benchmark(args.packets, levels, tuple(args.check or FRAME_CHECKS))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
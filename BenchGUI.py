@@ -0,0 +1,159 @@
+"""
+Benchmark della GUI (HostWinGUI) senza display, con il driver video "dummy" di SDL.
+
+Misura:
+  - avvio a freddo: in un interprete nuovo, tempo di import del modulo, di
+    init_display() + asset e del primo frame completo (mediana di --runs avvii)
+  - frame/s: rendering continuo senza limite di frequenza, con lo storico
+    alimentato da un thread che simula il feedback a --rate campioni/s, sia
+    ridisegnando il solo grafico a ogni frame (caso normale con dati in
+    arrivo) sia ridisegnando tutta la finestra
+Il risultato è un documento JSON (stdout o --output) confrontabile tra run.
+
+Esempio:
+    python BenchGUI.py --runs 5 --duration 3 --rate 2000
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from BenchBridge import summarize_ms
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Eseguito in un interprete nuovo: stampa i tempi delle fasi di avvio
+COLD_START_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+import HostWinGUI as gui
+t1 = time.perf_counter()
+gui.configure_history()
+renderer = gui.Renderer(gui.init_display(headless=True))
+t2 = time.perf_counter()
+renderer.frame((0, 0), False)
+t3 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "init_s": t2 - t1, "first_frame_s": t3 - t2, "total_s": t3 - t0}))
+"""
+
+
+def measure_cold_start(runs):
+    """Avvia `runs` interpreti nuovi e restituisce la mediana di ogni fase (ms)."""
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=HERE, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        phases = json.loads(output.strip().splitlines()[-1])
+        phases["process_s"] = time.perf_counter() - start
+        samples.append(phases)
+    return {f"{name[:-2]}_ms": round(float(np.median([s[name] for s in samples])) * 1000.0, 2)
+            for name in samples[0]}
+
+
+class SyntheticFeed:
+    """Riempie gui.history come farebbe il listener del feedback, a blocchi di 1 ms."""
+    def __init__(self, history, rate):
+        self.history = history
+        self.rate = rate
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join(timeout=1.0)
+
+    def _run(self):
+        sent = 0
+        start = time.time()
+        while self._running:
+            now = time.time()
+            n = int((now - start) * self.rate) - sent
+            if n > 0:
+                index = np.arange(sent, sent + n)
+                timestamps = start + index / self.rate
+                torque = (500 + 400 * np.sin(index / 200.0)).astype(np.int16)
+                position = (index // 1000 % 2 * 100).astype(np.int16)
+                self.history.extend(timestamps, torque=torque, position=position)
+                sent += n
+            time.sleep(0.001)
+
+
+def measure_fps(renderer, duration, full_redraw):
+    """Frame renderizzati al secondo senza limite di frequenza (clock.tick assente)."""
+    times = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if full_redraw:
+            renderer.invalidate()
+        else:
+            # Come se a ogni frame arrivassero nuovi dati: si ridisegna il grafico
+            renderer.last_data_version = None
+        t0 = time.perf_counter()
+        dirty = renderer.frame((0, 0), False)
+        if dirty:
+            times.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return {"frames_per_s": round(len(times) / elapsed, 1), "frame_time": summarize_ms(times)}
+
+
+def run_gui_benchmark(runs=5, duration=3.0, rate=2000, history_seconds=60.0):
+    cold_start = measure_cold_start(runs)
+
+    import HostWinGUI as gui
+    gui.configure_history(history_seconds, rate)
+    renderer = gui.Renderer(gui.init_display(headless=True))
+    feed = SyntheticFeed(gui.history, rate).start()
+    try:
+        # Qualche campione nello storico prima di misurare
+        time.sleep(0.5)
+        graph_only = measure_fps(renderer, duration, full_redraw=False)
+        full = measure_fps(renderer, duration, full_redraw=True)
+    finally:
+        feed.stop()
+    return {
+        "benchmark": "gui_headless",
+        "timestamp": time.time(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "pygame": gui.pygame.version.ver,
+        "config": {"runs": runs, "duration_s": duration, "rate": rate, "history_s": history_seconds},
+        "cold_start": cold_start,
+        "graph_updates": graph_only,
+        "full_redraw": full,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark avvio a freddo e frame/s della GUI senza display")
+    parser.add_argument("--runs", type=int, default=5, help="avvii a freddo misurati")
+    parser.add_argument("--duration", type=float, default=3.0, help="durata di ogni misura dei frame/s (s)")
+    parser.add_argument("--rate", type=float, default=2000, help="campioni/s del feedback simulato")
+    parser.add_argument("--history", type=float, default=60.0, help="secondi di storico del grafico")
+    parser.add_argument("--output", default=None, help="file JSON di uscita (default stdout)")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    result = run_gui_benchmark(args.runs, args.duration, args.rate, args.history)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
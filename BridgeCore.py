@@ -0,0 +1,267 @@
+"""
+Parti comuni ai bridge UDP <-> seriale (SixthFingerHostWin, AsyncBridge,
+MultiDongleBridge, SerialSession): porte UDP, protocollo seriale del dongle
+(SerialProtocol, open_dongle), codifica dei comandi, gestione dei comandi
+UDP e dei messaggi di controllo (HELLO, SUBSCRIBE) e relative metriche.
+
+Gli script importano da qui e non l'uno dall'altro: SixthFingerHostWin
+eseguito come __main__ non viene importato una seconda volta.
+"""
+import time
+
+from serial.threaded import Protocol
+
+from COMDeviceManager import COMDeviceManager
+from CommandQueue import TrackedCommand, format_ack, parse_command
+from ConsoleLog import get_logger
+from FeedbackFanout import SUBSCRIBE_PREFIX, UNSUBSCRIBE_PREFIX
+from FeedbackFilter import normalize_spec
+from FeedbackProtocol import HELLO_PREFIX, caps_message, hello_filter, negotiate_format
+from Metrics import PROFILER, counter, histogram
+from PacketDecoder import check_layout, decode_batch
+from PacketFramer import DEFAULT_SPEC, PacketSpec, RingBufferFramer
+
+log = get_logger("BridgeCore")
+
+# Impostazioni UDP
+UDP_IP = "127.0.0.1"
+UDP_CMD_PORT = 5005       # Porta per ricevere i comandi (stato)
+UDP_FEEDBACK_PORT = 5006  # Porta per inviare i dati (torque e position)
+
+# Codici dei comandi per il dongle
+COMMAND_CODES = {"CLOSE": b"C", "STOP": b"S", "OPEN": b"O"}
+
+# Metriche (vedi Metrics): aggiornate dal reader seriale e dal listener UDP
+SERIAL_BYTES = counter("serial.bytes_received")
+SERIAL_PACKETS = counter("serial.packets")
+SERIAL_RESYNCS = counter("serial.resyncs")
+SERIAL_REJECTED = counter("serial.frames_rejected")
+SERIAL_BYTES_DROPPED = counter("serial.bytes_dropped")
+SERIAL_CALLBACK_TIME = histogram("serial.callback_seconds")
+COMMANDS_RECEIVED = counter("command.received")
+COMMANDS_WRITTEN = counter("command.written")
+COMMANDS_UNKNOWN = counter("command.unknown")
+COMMAND_RECV_ERRORS = counter("command.recv_errors")
+COMMAND_WRITE_ERRORS = counter("command.write_errors")
+COMMAND_DELAY = histogram("command.queue_delay_seconds")
+
+
+def submit_command(text, addr, commands, reply):
+    """
+    Accoda un comando ricevuto via UDP ("CLOSE" oppure "CLOSE <id>").
+    I comandi sconosciuti vengono scartati subito (con NAK se hanno un
+    identificativo). Restituisce True se il comando è stato accodato.
+    """
+    received_at = time.perf_counter()
+    COMMANDS_RECEIVED.inc()
+    log.info("Ricevuto comando UDP: %s", text)
+    name, cmd_id = parse_command(text)
+    command = TrackedCommand(name, cmd_id, addr, received_at)
+    if build_command_frame(name) is None:
+        COMMANDS_UNKNOWN.inc()
+        log.warning("Comando sconosciuto ricevuto: %s", text)
+        if cmd_id is not None:
+            reply(format_ack(command, "UNKNOWN"), addr)
+        return False
+    commands.submit(command)
+    return True
+
+
+def write_pending_commands(session, commands):
+    """
+    Scrive sul dongle i comandi in coda (STOP per primo) e ne avvia il
+    tracciamento. Restituisce il numero di comandi scritti.
+    """
+    written = 0
+    for command in commands.pop_ready():
+        frame = build_command_frame(command.name)
+        try:
+            session.write(frame)
+        except Exception as e:
+            COMMAND_WRITE_ERRORS.inc()
+            commands.mark_failed(command)
+            log.error("Errore nell'invio del comando sulla porta seriale: %s", e)
+            continue
+        COMMAND_DELAY.record(time.perf_counter() - command.received_at)
+        COMMANDS_WRITTEN.inc()
+        commands.mark_written(command)
+        written += 1
+        log.info("Comando inviato al dongle: %s", frame.decode('ascii', errors='ignore'))
+    return written
+
+
+def command_ack_sender(sock):
+    """Callback per CommandQueue.ack: invia la conferma al client che ha inviato il comando."""
+    def ack(command, status, latency):
+        sock.sendto(format_ack(command, status, latency), command.addr)
+    return ack
+
+
+def handle_control(cmd, addr, publisher, fanout=None):
+    """
+    Gestisce i messaggi di controllo sulla porta comandi e restituisce la
+    risposta da inviare al mittente, oppure None se `cmd` non è un messaggio
+    di controllo:
+      - "HELLO <formato> [filter=<filtri>]": negozia formato e filtri del consumer principale
+      - "SUBSCRIBE ..."/"UNSUBSCRIBE ...": iscrizioni al feedback (vedi FeedbackFanout)
+    """
+    if cmd.startswith(HELLO_PREFIX):
+        return handle_hello(cmd, addr, publisher)
+    if cmd.startswith(SUBSCRIBE_PREFIX) or cmd.startswith(UNSUBSCRIBE_PREFIX):
+        if fanout is None:
+            return b"ERROR iscrizioni non disponibili"
+        return fanout.handle_request(cmd, addr)
+    return None
+
+
+def handle_hello(cmd, addr, publisher):
+    """
+    Negozia il formato e i filtri del feedback (vedi FeedbackFilter) e
+    restituisce la risposta "CAPS" da inviare. Senza "filter=" si usano i
+    filtri di default del bridge (--feedback-filter); con filtri non
+    validi il consumer riceve i campioni grezzi.
+
+    Il formato del flusso principale cambia solo se HELLO arriva dal suo
+    indirizzo (publisher.dest), cioè dal socket su cui il consumer riceve il
+    feedback: un HELLO da un altro indirizzo (es. un socket dei comandi che
+    verifica se il bridge è attivo) riceve CAPS senza cambiare il formato
+    per un consumer che legge in ASCII.
+    """
+    fmt = negotiate_format(cmd)
+    requested = hello_filter(cmd)
+    if requested is None:
+        requested = publisher.default_filter if publisher is not None else None
+    if publisher is None or tuple(addr) != tuple(publisher.dest):
+        try:
+            spec = normalize_spec(requested)
+        except ValueError:
+            spec = None
+        log.info("HELLO da %s: flusso principale invariato (%s)", addr, publisher.format if publisher else "-")
+        return caps_message(fmt, spec)
+    publisher.format = fmt
+    try:
+        spec = publisher.set_filter(requested)
+    except ValueError as e:
+        log.warning("Filtri del feedback richiesti da %s non validi (%s): campioni grezzi", addr, e)
+        spec = publisher.set_filter(None)
+    log.info("Formato feedback negoziato con %s: %s (filtri: %s)", addr, fmt, spec or "nessuno")
+    return caps_message(fmt, spec)
+
+
+def build_command_frame(cmd):
+    """
+    Converte un comando UDP ("CLOSE", "STOP", "OPEN") nel frame seriale
+    '$C****', '$S****' o '$O****'. Restituisce None per comandi sconosciuti.
+    """
+    code = COMMAND_CODES.get(cmd)
+    if code is None:
+        return None
+    return b"$" + code + b"****"
+
+
+class SerialProtocol(Protocol):
+    """
+    Protocollo per ReaderThread che accumula i dati in un ring buffer.
+    Quando trova un pacchetto completo e valido (11 byte '$ddd?ddd???',
+    oppure il formato di `spec`, vedi PacketFramer.FRAME_CHECKS), lo passa
+    alla callback `packet_callback` come memoryview (senza copie).
+    Se è indicata `batch_callback`, tutti i pacchetti completi di un blocco
+    ricevuto vengono decodificati insieme e passati come SampleBatch.
+    Se è indicata `raw_callback`, riceve anche i byte grezzi così come
+    arrivano dalla seriale (es. per la registrazione della sessione).
+    I contatori di pacchetti accettati e scartati, byte scartati e
+    risincronizzazioni sono esposti tramite `framer` e riportati nelle
+    metriche "serial.*" (vedi Metrics).
+    """
+    def __init__(self, packet_callback=None, packet_length=11, start_byte=b'$', spec=None, capacity=4096,
+                 batch_callback=None, raw_callback=None):
+        self.packet_callback = packet_callback
+        self.batch_callback = batch_callback
+        self.raw_callback = raw_callback
+        if spec is None:
+            if (start_byte, packet_length) == (DEFAULT_SPEC.start_byte, DEFAULT_SPEC.length):
+                spec = DEFAULT_SPEC
+            else:
+                spec = PacketSpec(start_byte, packet_length)
+        self.packet_length = spec.length
+        self.start_byte = spec.start_byte
+        if batch_callback is not None:
+            check_layout(spec)
+        self.framer = RingBufferFramer(packet_callback, spec, capacity,
+                                       self._frames_received if batch_callback is not None else None)
+        self._seen = (0, 0, 0, 0)   # packets, resyncs, bytes_dropped, rejected già riportati nelle metriche
+
+    def _frames_received(self, buffer, offsets):
+        self.batch_callback(decode_batch(buffer, offsets, length=self.packet_length))
+
+    def connection_lost(self, exc):
+        # Non rilancia l'eccezione: la riconnessione è gestita da SerialSession
+        if exc is not None:
+            log.warning("Connessione seriale persa: %s", exc)
+
+    def data_received(self, data):
+        if PROFILER.enabled:
+            PROFILER.watch_current_thread()
+        start = time.perf_counter()
+        if self.raw_callback is not None:
+            self.raw_callback(data)
+        framer = self.framer
+        framer.feed(data)
+        SERIAL_BYTES.inc(len(data))
+        packets, resyncs, dropped, rejected = self._seen
+        if framer.packets != packets:
+            SERIAL_PACKETS.inc(framer.packets - packets)
+        if framer.resyncs != resyncs:
+            SERIAL_RESYNCS.inc(framer.resyncs - resyncs)
+        if framer.bytes_dropped != dropped:
+            SERIAL_BYTES_DROPPED.inc(framer.bytes_dropped - dropped)
+        if framer.rejected != rejected:
+            SERIAL_REJECTED.inc(framer.rejected - rejected)
+        self._seen = (framer.packets, framer.resyncs, framer.bytes_dropped, framer.rejected)
+        SERIAL_CALLBACK_TIME.record(time.perf_counter() - start)
+
+
+def set_velocity_cmd(ser):
+    """Invia il comando di velocità '$VS***' alla porta seriale."""
+    data = b"$VS***"
+    log.info("Invio comando di velocità: %s", data)
+    try:
+        ser.write(data)
+    except Exception as e:
+        log.error("Errore nell'invio del comando di velocità: %s", e)
+
+
+def flush_serial_input(ser):
+    """
+    Scarta i dati già presenti nel buffer di ricezione della porta seriale
+    (una sola chiamata al driver: con il dongle che trasmette, un ciclo su
+    in_waiting potrebbe non svuotarlo mai).
+    """
+    try:
+        ser.reset_input_buffer()
+    except Exception as e:
+        log.error("Errore nel flush della porta seriale: %s", e)
+
+
+def open_dongle(dongle_type="robot", comport=None, send_velocity=True, profile=None):
+    """
+    Individua (se `comport` non è indicata) e apre la porta del dongle con
+    il profilo indicato (vedi COMDeviceManager.PortProfile), svuota il
+    buffer di ricezione e invia il comando di velocità (se `send_velocity`).
+    Restituisce la porta seriale aperta oppure None.
+    """
+    if not comport:
+        comport = COMDeviceManager.discover_com_devices(dongle_type)
+        if not comport:
+            log.warning("Nessun dispositivo COM trovato per il dongle specificato.")
+            return None
+    ser = COMDeviceManager.open_serial_port(comport, profile)
+    if ser is None:
+        log.warning("Apertura della porta seriale fallita.")
+        return None
+    log.info("Porta seriale aperta correttamente: %s", comport)
+
+    flush_serial_input(ser)
+    if send_velocity:
+        set_velocity_cmd(ser)
+    return ser
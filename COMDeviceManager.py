@@ -1,69 +1,214 @@
+import json
+import os
+import threading
+import time
+
 import serial
 from serial.tools import list_ports
 
+from ConsoleLog import get_logger
+
+log = get_logger("COMDeviceManager")
+
+# Variabile d'ambiente con il percorso di un file JSON di numeri di serie
+SERIALS_CONFIG_ENV = "SIXTHFINGER_DONGLES"
+
+class PortProfile:
+    """
+    Impostazioni della porta seriale e del reader adattivo (vedi SerialReader):
+      - baudrate, timeout, inter_byte_timeout: come in pyserial
+      - rx_buffer, tx_buffer: buffer del driver in byte (solo Windows, None = default)
+      - low_latency: modalità ASYNC_LOW_LATENCY dei driver Linux che la supportano (es. ftdi_sio)
+      - latency_budget: ritardo massimo (s) che il reader può aggiungere per leggere blocchi più grandi
+      - min_chunk, max_chunk: limiti (byte) del blocco letto
+    """
+    def __init__(self, name, baudrate=115200, timeout=0.1, inter_byte_timeout=None, rx_buffer=None,
+                 tx_buffer=None, low_latency=False, latency_budget=0.001, min_chunk=11, max_chunk=4096):
+        self.name = name
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.inter_byte_timeout = inter_byte_timeout
+        self.rx_buffer = rx_buffer
+        self.tx_buffer = tx_buffer
+        self.low_latency = low_latency
+        self.latency_budget = latency_budget
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+
+    def replace(self, **changes):
+        """Copia del profilo con alcuni campi modificati (es. da riga di comando)."""
+        values = dict(vars(self))
+        values.update({k: v for k, v in changes.items() if v is not None})
+        return PortProfile(**values)
+
+    def __repr__(self):
+        return f"PortProfile({', '.join(f'{k}={v!r}' for k, v in vars(self).items())})"
+
+
+# Profili predefiniti: "default" legge blocchi fino a 1 ms di dati, "low-latency"
+# legge ogni byte appena arriva, "throughput" privilegia poche sveglie
+PORT_PROFILES = {
+    "default": PortProfile("default"),
+    "low-latency": PortProfile("low-latency", low_latency=True, latency_budget=0.0),
+    "throughput": PortProfile("throughput", rx_buffer=65536, tx_buffer=4096, latency_budget=0.005,
+                              max_chunk=16384),
+}
+
+
 class COMDeviceManager:
-    @staticmethod
-    def is_in_list(serial_number, serial_list):
-        """Verifica se il numero di serie è presente nella lista."""
-        return serial_number in serial_list
+    # Numeri di serie noti per ciascun tipo di dongle (hard-coded come nell'implementazione C++)
+    KNOWN_SERIALS = {
+        "feedback": ["EC:DA:3B:5D:28:B4", "EC:DA:3B:5D:28:B5", "EC:DA:3B:5D:28:B6"],
+        "input": ["EC:DA:3B:5D:27:33", "EC:DA:3B:5D:27:31", "EC:DA:3B:5D:27:32"],
+        "robot": ["EC:DA:3B:5B:6C:00", "EC:DA:3B:5D:27:30", "EC:DA:3B:5D:27:35", "DC:DA:0C:30:C2:74"],
+    }
+    # Durata (s) della cache dell'enumerazione delle porte
+    CACHE_TTL = 5.0
+
+    _serial_lookup = None
+    _cache = None
+    _config_loaded = False
+    _lock = threading.RLock()
 
     @staticmethod
-    def open_serial_port(comport):
+    def open_serial_port(comport, profile=None):
         """
         Apre la porta seriale con le impostazioni:
-          - Baudrate: 115200
+          - baudrate, timeout e buffer del profilo (PortProfile o nome in
+            PORT_PROFILES; default 115200, timeout 0.1 s)
           - 8 bit, nessuna parità, 1 bit di stop
           - Nessun controllo hardware/software
         """
+        if profile is None or isinstance(profile, str):
+            profile = PORT_PROFILES[profile or "default"]
         try:
-            ser = serial.Serial(comport, baudrate=115200, timeout=0.1)
+            ser = serial.Serial(comport, baudrate=profile.baudrate, timeout=profile.timeout,
+                                inter_byte_timeout=profile.inter_byte_timeout)
         except Exception as e:
-            print(f"Errore nell'apertura della porta COM {comport}: {e}")
+            log.error("Errore nell'apertura della porta COM %s: %s", comport, e)
+            # La porta potrebbe essere sparita o cambiata: la prossima ricerca rienumera
+            COMDeviceManager.invalidate_cache()
             return None
 
         # Impostazioni aggiuntive (pyserial imposta per default 8N1, ma le esplicitiamo)
         ser.bytesize = serial.EIGHTBITS
         ser.parity = serial.PARITY_NONE
         ser.stopbits = serial.STOPBITS_ONE
-        ser.timeout = 0.1
         ser.xonxoff = False
         ser.rtscts = False
         ser.dsrdtr = False
+        # Opzioni dipendenti dal driver: se non supportate si prosegue con i default
+        if profile.rx_buffer and hasattr(ser, "set_buffer_size"):
+            try:
+                ser.set_buffer_size(rx_size=profile.rx_buffer, tx_size=profile.tx_buffer or profile.rx_buffer)
+            except Exception as e:
+                log.debug("Dimensione dei buffer non impostata su %s: %s", comport, e)
+        if profile.low_latency and hasattr(ser, "set_low_latency_mode"):
+            try:
+                ser.set_low_latency_mode(True)
+            except Exception as e:
+                log.debug("Modalità low latency non supportata su %s: %s", comport, e)
         return ser
 
     @staticmethod
-    def discover_com_devices(dongle_type):
+    def load_serial_table(path):
+        """
+        Carica la tabella dei numeri di serie da un file JSON nella forma
+        {"robot": ["EC:DA:...", ...], "feedback": [...], "input": [...]}
+        e sostituisce quella hard-coded. Invalida la cache delle porte.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        if not isinstance(table, dict):
+            raise ValueError(f"Tabella dei numeri di serie non valida in {path}")
+        for dongle_type, serials in table.items():
+            # Una stringa al posto della lista verrebbe letta carattere per carattere
+            if not isinstance(serials, list) or not all(isinstance(s, str) for s in serials):
+                raise ValueError(f"Numeri di serie di {dongle_type} in {path}: attesa una lista di stringhe")
+        with COMDeviceManager._lock:
+            COMDeviceManager.KNOWN_SERIALS = {str(k): list(v) for k, v in table.items()}
+            COMDeviceManager._serial_lookup = None
+            COMDeviceManager._cache = None
+            # Una tabella esplicita (es. --dongles-config) ha la precedenza su SERIALS_CONFIG_ENV
+            COMDeviceManager._config_loaded = True
+        log.info("Tabella dei numeri di serie caricata da %s", path)
+
+    @staticmethod
+    def _get_serial_lookup():
+        """
+        Dizionario numero di serie -> tipo di dongle, costruito una sola volta.
+        Il file di SERIALS_CONFIG_ENV viene letto solo se non è già stata
+        caricata una tabella con load_serial_table.
+        """
+        lookup = COMDeviceManager._serial_lookup
+        if lookup is None:
+            config = os.environ.get(SERIALS_CONFIG_ENV)
+            if config and not COMDeviceManager._config_loaded:
+                COMDeviceManager._config_loaded = True
+                COMDeviceManager.load_serial_table(config)
+            lookup = {}
+            for dongle_type, serials in COMDeviceManager.KNOWN_SERIALS.items():
+                for serial_number in serials:
+                    lookup.setdefault(serial_number, dongle_type)
+            COMDeviceManager._serial_lookup = lookup
+        return lookup
+
+    @staticmethod
+    def invalidate_cache():
+        """Forza una nuova enumerazione delle porte alla prossima ricerca."""
+        with COMDeviceManager._lock:
+            COMDeviceManager._cache = None
+
+    @staticmethod
+    def scan_devices(force=False):
+        """
+        Enumera le porte COM una sola volta e restituisce l'indice
+        {numero di serie: (tipo di dongle, porta)} dei soli dongle noti,
+        nell'ordine di enumerazione. Il risultato resta in cache per
+        CACHE_TTL secondi (force=True ignora la cache).
+        """
+        with COMDeviceManager._lock:
+            cache = COMDeviceManager._cache
+            now = time.monotonic()
+            if not force and cache is not None and now - cache[0] < COMDeviceManager.CACHE_TTL:
+                return cache[1]
+
+            lookup = COMDeviceManager._get_serial_lookup()
+            index = {}
+            # Usa serial.tools.list_ports per Windows
+            for port in list_ports.comports():
+                serial_number = getattr(port, 'serial_number', None)
+                if not serial_number:
+                    continue
+                log.info("HARIA device found: %s at COM Port: %s", serial_number, port.device)
+                dongle_type = lookup.get(serial_number)
+                if dongle_type is not None:
+                    index[serial_number] = (dongle_type, port.device)
+            COMDeviceManager._cache = (now, index)
+            return index
+
+    @staticmethod
+    def discover_com_devices(dongle_type, force=False):
         """
         Cerca porte COM e restituisce la porta associata al tipo di dongle richiesto.
         I tipi ammessi sono "feedback", "input" o "robot". Le liste dei numeri di serie sono
-        hard-coded come nell'implementazione C++.
+        hard-coded come nell'implementazione C++, oppure caricate con load_serial_table.
+        """
+        for found_type, comport in COMDeviceManager.scan_devices(force).values():
+            if found_type == dongle_type:
+                return comport
+        return ""
+
+    @staticmethod
+    def discover_all_com_devices(force=False):
+        """
+        Enumera le porte COM una sola volta e restituisce un dizionario
+        {tipo di dongle: porta} con tutti i dongle noti trovati.
         """
-        comport_associated = ""
-
-        # Liste di numeri di serie per ciascun tipo
-        feedback = ["EC:DA:3B:5D:28:B4", "EC:DA:3B:5D:28:B5", "EC:DA:3B:5D:28:B6"]
-        input_list = ["EC:DA:3B:5D:27:33", "EC:DA:3B:5D:27:31", "EC:DA:3B:5D:27:32"]
-        robot = ["EC:DA:3B:5B:6C:00", "EC:DA:3B:5D:27:30", "EC:DA:3B:5D:27:35", "DC:DA:0C:30:C2:74"]
-
-        # Usa serial.tools.list_ports per Windows
-        ports = list_ports.comports()
-        for port in ports:
-            comport = port.device
-            serial_number = getattr(port, 'serial_number', None)
-            if not serial_number:
-                continue
-            print(f"HARIA device found: {serial_number} at COM Port: {comport}")
-            if dongle_type == "feedback" and COMDeviceManager.is_in_list(serial_number, feedback):
-                comport_associated = comport
-                break
-            elif dongle_type == "input" and COMDeviceManager.is_in_list(serial_number, input_list):
-                comport_associated = comport
-                break
-            elif dongle_type == "robot" and COMDeviceManager.is_in_list(serial_number, robot):
-                comport_associated = comport
-                break
-
-        return comport_associated
+        found = {}
+        for dongle_type, comport in COMDeviceManager.scan_devices(force).values():
+            found.setdefault(dongle_type, comport)
+        return found
 
 
 # Esempio di utilizzo
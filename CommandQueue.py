@@ -0,0 +1,203 @@
+"""
+Coda dei comandi per il dongle con coalescenza e tracciamento.
+
+Regole di coalescenza:
+  - per ogni attuatore resta in coda solo l'ultimo comando ricevuto
+    (latest-wins): quello precedente viene scartato come SUPERSEDED;
+  - STOP ha la precedenza su tutto: svuota la coda (PREEMPTED) e viene
+    scritto per primo.
+La coda contiene quindi al più un comando per attuatore più uno STOP.
+
+Ogni comando viene seguito dalla ricezione UDP alla scrittura sulla seriale
+fino al primo feedback che lo riflette (vedi CONFIRM_DIRECTION). Il client
+che invia il comando con un identificativo ("CLOSE 42") riceve sulla stessa
+porta le conferme, con la latenza in ms dalla ricezione:
+    ACK 42 WRITTEN 0.412
+    ACK 42 CONFIRMED 12.950
+    NAK 42 SUPERSEDED | PREEMPTED | TIMEOUT | ERROR | UNKNOWN
+I comandi senza identificativo (client storici) non ricevono risposte.
+"""
+import collections
+import threading
+import time
+
+from ConsoleLog import get_logger
+from Metrics import counter, histogram
+
+log = get_logger("CommandQueue")
+
+STOP_COMMAND = "STOP"
+# Attuatore comandato da ciascun comando (latest-wins per attuatore)
+COMMAND_ACTUATORS = {"CLOSE": "finger", "OPEN": "finger", STOP_COMMAND: None}
+# Variazione di position che conferma il comando rispetto alla position al
+# momento della scrittura: +1 aumenta, -1 diminuisce, 0 qualsiasi feedback
+CONFIRM_DIRECTION = {"CLOSE": 1, "OPEN": -1, STOP_COMMAND: 0}
+
+COMMANDS_COALESCED = counter("command.coalesced")
+COMMANDS_PREEMPTED = counter("command.preempted")
+COMMANDS_CONFIRMED = counter("command.confirmed")
+COMMANDS_TIMED_OUT = counter("command.timeouts")
+FEEDBACK_LATENCY = histogram("command.feedback_latency_seconds")
+
+
+def parse_command(text):
+    """Separa "CLOSE 42" in ("CLOSE", "42"); l'identificativo è opzionale."""
+    tokens = text.split()
+    if not tokens:
+        return "", None
+    return tokens[0], tokens[1] if len(tokens) > 1 else None
+
+
+class TrackedCommand:
+    __slots__ = ("name", "cmd_id", "addr", "received_at", "written_at", "reference")
+
+    def __init__(self, name, cmd_id=None, addr=None, received_at=None):
+        self.name = name
+        self.cmd_id = cmd_id
+        self.addr = addr
+        self.received_at = time.perf_counter() if received_at is None else received_at
+        self.written_at = None
+        self.reference = None   # position al momento della scrittura
+
+    @property
+    def actuator(self):
+        return COMMAND_ACTUATORS.get(self.name)
+
+
+class CommandQueue:
+    """
+    Coda limitata dei comandi con coalescenza (vedi modulo).
+
+    submit() è chiamato dal listener UDP, pop_ready()/mark_written() dal
+    thread che scrive sulla seriale, feedback() dal reader seriale.
+    `ack(command, status, latency)` viene chiamata a ogni cambio di stato
+    dei comandi con identificativo.
+    """
+    def __init__(self, ack=None, confirm_timeout=1.0, max_inflight=256):
+        self.ack = ack
+        self.confirm_timeout = confirm_timeout
+        self._pending = collections.OrderedDict()   # attuatore -> TrackedCommand
+        self._stop = None
+        self._inflight = collections.deque(maxlen=max_inflight)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.last_position = None
+
+    def _notify(self, command, status, latency=None):
+        if self.ack is not None and command.cmd_id is not None:
+            try:
+                self.ack(command, status, latency)
+            except Exception as e:
+                log.error("Errore nell'invio della conferma del comando: %s", e)
+
+    def submit(self, command):
+        """Accoda un comando noto applicando le regole di coalescenza."""
+        dropped = []
+        with self._lock:
+            if command.name == STOP_COMMAND:
+                dropped.extend(self._pending.values())
+                self._pending.clear()
+                if self._stop is not None:
+                    dropped.append(self._stop)
+                self._stop = command
+                COMMANDS_PREEMPTED.inc(len(dropped))
+                status = "PREEMPTED"
+            else:
+                previous = self._pending.pop(command.actuator, None)
+                if previous is not None:
+                    dropped.append(previous)
+                    COMMANDS_COALESCED.inc()
+                self._pending[command.actuator] = command
+                status = "SUPERSEDED"
+            self._ready.set()
+        for old in dropped:
+            self._notify(old, status)
+
+    def __len__(self):
+        return len(self._pending) + (self._stop is not None)
+
+    def wait(self, timeout=None):
+        """Attende un comando in coda (True) o la scadenza del timeout (False)."""
+        return self._ready.wait(timeout)
+
+    def pop_ready(self):
+        """Restituisce i comandi da scrivere ora, STOP per primo."""
+        with self._lock:
+            commands = [self._stop] if self._stop is not None else []
+            commands.extend(self._pending.values())
+            self._stop = None
+            self._pending.clear()
+            self._ready.clear()
+        return commands
+
+    def mark_written(self, command):
+        """Registra la scrittura sulla seriale e avvia l'attesa del feedback."""
+        command.written_at = time.perf_counter()
+        command.reference = self.last_position
+        with self._lock:
+            superseded = [c for c in self._inflight
+                          if c.actuator == command.actuator or command.name == STOP_COMMAND]
+            for old in superseded:
+                self._inflight.remove(old)
+            if len(self._inflight) == self._inflight.maxlen:
+                superseded.append(self._inflight.popleft())
+            self._inflight.append(command)
+        for old in superseded:
+            self._notify(old, "SUPERSEDED")
+        self._notify(command, "WRITTEN", command.written_at - command.received_at)
+
+    def mark_failed(self, command):
+        self._notify(command, "ERROR")
+
+    def feedback(self, position):
+        """
+        Aggiorna la position corrente (ultimo campione di un blocco) e
+        conferma i comandi in attesa che questa riflette.
+        """
+        self.last_position = position
+        if not self._inflight:
+            return
+        now = time.perf_counter()
+        confirmed = []
+        expired = []
+        with self._lock:
+            for command in list(self._inflight):
+                direction = CONFIRM_DIRECTION.get(command.name, 0)
+                reference = command.reference
+                if (reference is None or direction == 0
+                        or (position - reference) * direction > 0):
+                    confirmed.append(command)
+                    self._inflight.remove(command)
+                elif now - command.written_at > self.confirm_timeout:
+                    expired.append(command)
+                    self._inflight.remove(command)
+        for command in confirmed:
+            latency = now - command.received_at
+            FEEDBACK_LATENCY.record(latency)
+            COMMANDS_CONFIRMED.inc()
+            self._notify(command, "CONFIRMED", latency)
+        self._expired(expired)
+
+    def expire(self):
+        """Scarta i comandi senza feedback entro confirm_timeout (chiamata periodica)."""
+        if not self._inflight:
+            return
+        deadline = time.perf_counter() - self.confirm_timeout
+        with self._lock:
+            expired = [c for c in self._inflight if c.written_at < deadline]
+            for command in expired:
+                self._inflight.remove(command)
+        self._expired(expired)
+
+    def _expired(self, expired):
+        for command in expired:
+            COMMANDS_TIMED_OUT.inc()
+            self._notify(command, "TIMEOUT")
+
+
+def format_ack(command, status, latency=None):
+    """Risposta UDP per il client: "ACK <id> <stato> <latenza ms>" oppure "NAK <id> <stato>"."""
+    if latency is not None:
+        return f"ACK {command.cmd_id} {status} {latency * 1000.0:.3f}".encode('ascii')
+    kind = "ACK" if status in ("WRITTEN", "CONFIRMED") else "NAK"
+    return f"{kind} {command.cmd_id} {status}".encode('ascii')
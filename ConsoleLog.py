@@ -0,0 +1,193 @@
+"""
+Log asincrono e riga di stato per il bridge.
+
+Le chiamate di log (logging standard, logger "sixthfinger.*") non scrivono
+sulla console: accodano il record e tornano subito. Un solo thread in
+background scrive sulla console sia i messaggi sia la riga di stato, che
+viene ridisegnata al più `status_rate` volte al secondo con l'ultimo valore
+impostato da set_status(), indipendentemente dalla frequenza dei pacchetti.
+
+Il livello "off" (o un livello sopra INFO per la riga di stato) silenzia
+completamente la console.
+
+Esempio:
+    from ConsoleLog import get_logger, setup_logging, set_status
+    log = get_logger("bridge")
+    setup_logging("info")
+    log.info("Porta aperta: %s", port)
+    set_status("Torque: %d - Position: %d", torque, position)
+"""
+import logging
+import queue
+import sys
+import threading
+import time
+
+LOGGER_NAME = "sixthfinger"
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "off": logging.CRITICAL + 10,
+}
+
+logging.getLogger(LOGGER_NAME).setLevel(logging.INFO)
+
+
+def get_logger(name):
+    """Logger figlio di "sixthfinger": il livello si controlla con setup_logging()."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+class QueueConsoleHandler(logging.Handler):
+    """
+    Handler non bloccante: accoda i record per il thread della console.
+    Se la coda è piena, o se lo stesso messaggio supera `max_per_second`
+    occorrenze al secondo, il record viene scartato e contato in `dropped`.
+    """
+    def __init__(self, records, max_per_second=20):
+        super().__init__()
+        self.records = records
+        self.max_per_second = max_per_second
+        self.dropped = 0
+        self._window = 0
+        self._counts = {}
+
+    def emit(self, record):
+        now = int(time.monotonic())
+        if now != self._window:
+            self._window = now
+            self._counts.clear()
+        count = self._counts.get(record.msg, 0) + 1
+        self._counts[record.msg] = count
+        if count > self.max_per_second:
+            self.dropped += 1
+            return
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Console:
+    """Thread unico che scrive sulla console i record accodati e la riga di stato."""
+    def __init__(self, level=logging.INFO, status_rate=10.0, stream=None, max_queue=1024):
+        self.stream = stream or sys.stdout
+        self.level = level
+        self.status_period = 1.0 / status_rate if status_rate > 0 else None
+        self.records = queue.Queue(maxsize=max_queue)
+        self.handler = QueueConsoleHandler(self.records)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.status = None          # (template, args) impostato da set_status
+        self._shown_status = None
+        self._status_visible = False
+        self._thread = None
+        self._running = False
+
+    @property
+    def status_enabled(self):
+        return self.status_period is not None and self.level <= logging.INFO
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="console", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running = False
+        self.records.put(None)
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def _run(self):
+        timeout = self.status_period or 0.5
+        next_status = time.monotonic()
+        while True:
+            try:
+                record = self.records.get(timeout=timeout)
+            except queue.Empty:
+                record = ()
+            if record is None:
+                break
+            if record:
+                self._write_record(record)
+            now = time.monotonic()
+            if self.status_enabled and now >= next_status:
+                self._write_status()
+                next_status = now + self.status_period
+        if self._status_visible:
+            self._write("\n")
+
+    def _write(self, text):
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def _write_record(self, record):
+        try:
+            message = self.handler.format(record)
+        except Exception as e:
+            message = f"Errore nella formattazione del log: {e}"
+        # Il messaggio sostituisce la riga di stato, che viene ridisegnata al prossimo giro
+        prefix = "\r\033[K" if self._status_visible else ""
+        self._status_visible = False
+        self._shown_status = None
+        self._write(prefix + message + "\n")
+
+    def _write_status(self):
+        status = self.status
+        if status is None or status is self._shown_status:
+            return
+        self._shown_status = status
+        template, args = status
+        try:
+            line = template % args if args else template
+        except Exception:
+            return
+        self._status_visible = True
+        self._write("\r" + line + "\033[K")
+
+
+_console = None
+
+
+def setup_logging(level="info", status_rate=10.0, stream=None):
+    """
+    Configura la console asincrona per tutti i logger "sixthfinger.*".
+    `level` è un nome di LEVELS; "off" silenzia anche la riga di stato.
+    """
+    global _console
+    shutdown_logging()
+    numeric = LEVELS[level.lower()] if isinstance(level, str) else level
+    _console = Console(numeric, status_rate, stream).start()
+    root = logging.getLogger(LOGGER_NAME)
+    root.setLevel(numeric)
+    root.propagate = False
+    root.addHandler(_console.handler)
+    return _console
+
+
+def shutdown_logging():
+    """Scrive i record ancora in coda e ferma il thread della console."""
+    global _console
+    if _console is None:
+        return
+    logging.getLogger(LOGGER_NAME).removeHandler(_console.handler)
+    _console.stop()
+    _console = None
+
+
+def set_status(template, *args):
+    """
+    Aggiorna la riga di stato (solo un'assegnazione: adatto al percorso caldo).
+    La formattazione avviene nel thread della console, al più status_rate volte al secondo.
+    """
+    console = _console
+    if console is not None:
+        console.status = (template, args)
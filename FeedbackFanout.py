@@ -0,0 +1,298 @@
+"""
+Distribuzione del feedback a più consumer (fan-out).
+
+Il consumer principale (porta 5006, formato negoziato con HELLO) continua a
+ricevere il feedback direttamente dal reader seriale tramite
+FeedbackPublisher. Gli altri consumer si iscrivono sulla porta comandi:
+
+    SUBSCRIBE [port=<porta>] [format=BIN1|ASCII] [every=<n>] [lease=<s>] [filter=<filtri>]
+    UNSUBSCRIBE [port=<porta>]
+
+Senza `port` il feedback viene inviato all'indirizzo del mittente. Il bridge
+risponde "SUBSCRIBED <porta> <formato> <every> <lease> [filter=<filtri>]"
+oppure "ERROR <motivo>". L'iscrizione scade dopo `lease` secondi se non
+viene rinnovata ripetendo SUBSCRIBE; `every=n` invia un campione ogni n
+(decimazione); `filter` applica una pipeline di filtri (vedi FeedbackFilter)
+prima della decimazione. Gli iscritti con gli stessi filtri condividono la
+stessa pipeline, calcolata una sola volta per blocco.
+
+L'invio agli iscritti avviene su un thread separato: il reader seriale si
+limita ad accodare il blocco, quindi aggiungere consumer non aggiunge
+latenza al consumer principale. Ogni iscritto ha un proprio socket già
+connesso; i blocchi sono codificati una sola volta per ogni coppia
+(filtri, formato, decimazione). Opzionalmente il feedback può essere inviato a un
+gruppo multicast (add_multicast).
+"""
+import queue
+import socket
+import threading
+import time
+
+from ConsoleLog import get_logger
+from FeedbackFilter import normalize_spec, parse_pipeline
+from FeedbackProtocol import (FORMAT_ASCII, FORMAT_BINARY, SEQ_MODULO, SUPPORTED_FORMATS, encode_ascii,
+                              encode_datagram, max_samples_for)
+from Metrics import counter, gauge, histogram
+
+log = get_logger("FeedbackFanout")
+
+SUBSCRIBE_PREFIX = "SUBSCRIBE"
+UNSUBSCRIBE_PREFIX = "UNSUBSCRIBE"
+DEFAULT_LEASE = 10.0
+MAX_LEASE = 300.0
+MAX_SUBSCRIBERS = 64
+
+FANOUT_DATAGRAMS = counter("fanout.datagrams_sent")
+FANOUT_SEND_ERRORS = counter("fanout.send_errors")
+FANOUT_BATCHES_DROPPED = counter("fanout.batches_dropped")
+FANOUT_EXPIRED = counter("fanout.leases_expired")
+FANOUT_BATCH_TIME = histogram("fanout.batch_seconds")
+
+
+class Subscriber:
+    """Un consumer iscritto: socket UDP connesso alla sua destinazione."""
+    def __init__(self, dest, fmt=FORMAT_BINARY, every=1, lease=DEFAULT_LEASE, multicast=False, filter_spec=None):
+        self.dest = dest
+        self.format = fmt
+        self.every = every
+        self.filter = filter_spec
+        self.lease = lease
+        self.expires = None if lease is None else time.monotonic() + lease
+        self.datagrams_sent = 0
+        self.send_errors = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if multicast:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.sock.connect(dest)
+
+    def renew(self, lease):
+        self.lease = lease
+        self.expires = time.monotonic() + lease
+
+    def send(self, payloads):
+        for payload in payloads:
+            try:
+                self.sock.send(payload)
+                self.datagrams_sent += 1
+            except OSError:
+                # Es. ConnectionRefused se il consumer è stato chiuso: la lease lo rimuoverà
+                self.send_errors += 1
+                FANOUT_SEND_ERRORS.inc()
+        FANOUT_DATAGRAMS.inc(len(payloads))
+
+    def close(self):
+        self.sock.close()
+
+
+def parse_subscription(message, addr):
+    """
+    Interpreta "SUBSCRIBE port=.. format=.. every=.. lease=.. filter=.." e
+    restituisce (destinazione, formato, every, lease, filtri). Solleva
+    ValueError se non valido.
+    """
+    options = {}
+    for token in message.split()[1:]:
+        key, sep, value = token.partition("=")
+        if not sep:
+            raise ValueError(f"opzione non valida: {token}")
+        options[key.lower()] = value
+    port = int(options.pop("port", addr[1]))
+    fmt = options.pop("format", FORMAT_BINARY).upper()
+    every = int(options.pop("every", 1))
+    lease = float(options.pop("lease", DEFAULT_LEASE))
+    filter_spec = normalize_spec(options.pop("filter", None))
+    if options:
+        raise ValueError(f"opzioni sconosciute: {', '.join(options)}")
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"formato non supportato: {fmt}")
+    if not 0 < port < 65536 or every < 1 or lease <= 0:
+        raise ValueError("parametri fuori intervallo")
+    return (addr[0], port), fmt, every, min(lease, MAX_LEASE), filter_spec
+
+
+class FeedbackFanout:
+    """
+    Fan-out del feedback agli iscritti (vedi modulo).
+
+    publish() è chiamato dal reader seriale e non blocca: se la coda verso
+    il thread di invio è piena il blocco viene scartato e contato.
+    Con più fan-out nello stesso processo (un dongle ciascuno) `name`
+    distingue la gauge degli iscritti: fanout.subscribers.<name>.
+    """
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS, max_queue=256, name=None):
+        self.max_subscribers = max_subscribers
+        self.subscribers = {}    # destinazione -> Subscriber
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._samples = 0        # indice globale del prossimo campione (per la decimazione)
+        self._pipelines = {}     # filtri -> [FilterPipeline, indice del prossimo campione filtrato]
+        self._seq = {}           # (filtri, formato, every) -> numero di sequenza
+        gauge(f"fanout.subscribers.{name}" if name else "fanout.subscribers", lambda: len(self.subscribers))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="fanout", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        with self._lock:
+            for subscriber in self.subscribers.values():
+                subscriber.close()
+            self.subscribers.clear()
+
+    # -------------------------
+    # Iscrizioni (thread dei comandi)
+    # -------------------------
+    def handle_request(self, message, addr):
+        """Gestisce SUBSCRIBE/UNSUBSCRIBE e restituisce la risposta da inviare al mittente."""
+        if message.startswith(UNSUBSCRIBE_PREFIX):
+            try:
+                dest = parse_subscription(message.replace(UNSUBSCRIBE_PREFIX, SUBSCRIBE_PREFIX, 1), addr)[0]
+            except ValueError as e:
+                return f"ERROR {e}".encode('utf-8')
+            self.unsubscribe(dest)
+            return f"UNSUBSCRIBED {dest[1]}".encode('ascii')
+        try:
+            dest, fmt, every, lease, filter_spec = parse_subscription(message, addr)
+            self.subscribe(dest, fmt, every, lease, filter_spec=filter_spec)
+        except (ValueError, OSError) as e:
+            return f"ERROR {e}".encode('utf-8')
+        reply = f"SUBSCRIBED {dest[1]} {fmt} {every} {lease:g}"
+        if filter_spec:
+            reply += f" filter={filter_spec}"
+        return reply.encode('ascii')
+
+    def subscribe(self, dest, fmt=FORMAT_BINARY, every=1, lease=DEFAULT_LEASE, multicast=False, filter_spec=None):
+        filter_spec = normalize_spec(filter_spec)
+        if filter_spec is not None:
+            # Verifica subito che la pipeline si possa costruire (es. NumPy assente)
+            parse_pipeline(filter_spec)
+        with self._lock:
+            subscriber = self.subscribers.get(dest)
+            if (subscriber is not None and subscriber.format == fmt and subscriber.every == every
+                    and subscriber.filter == filter_spec):
+                if lease is not None:
+                    subscriber.renew(lease)
+                return subscriber
+            if subscriber is None and len(self.subscribers) >= self.max_subscribers:
+                raise ValueError("troppi iscritti")
+            new = Subscriber(dest, fmt, every, lease, multicast, filter_spec)
+            # Copy-on-write: il thread di invio legge il dizionario senza lock
+            subscribers = dict(self.subscribers)
+            subscribers[dest] = new
+            self.subscribers = subscribers
+        if subscriber is not None:
+            subscriber.close()
+        log.info("Feedback inviato anche a %s:%s (%s, 1 campione ogni %s, filtri: %s)", dest[0], dest[1], fmt,
+                 every, filter_spec or "nessuno")
+        return new
+
+    def add_multicast(self, group, port, fmt=FORMAT_BINARY, every=1, filter_spec=None):
+        """Invia il feedback a un gruppo multicast, senza scadenza."""
+        return self.subscribe((group, port), fmt, every, lease=None, multicast=True, filter_spec=filter_spec)
+
+    def unsubscribe(self, dest):
+        with self._lock:
+            subscribers = dict(self.subscribers)
+            subscriber = subscribers.pop(dest, None)
+            self.subscribers = subscribers
+        if subscriber is not None:
+            subscriber.close()
+            log.info("Iscrizione al feedback rimossa: %s:%s", dest[0], dest[1])
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [dest for dest, s in self.subscribers.items() if s.expires is not None and s.expires < now]
+        for dest in expired:
+            FANOUT_EXPIRED.inc()
+            self.unsubscribe(dest)
+
+    # -------------------------
+    # Invio (reader seriale -> thread di fan-out)
+    # -------------------------
+    def publish(self, batch):
+        """Accoda un SampleBatch per gli iscritti (non bloccante)."""
+        if not len(batch) or not self.subscribers:
+            return
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            FANOUT_BATCHES_DROPPED.inc()
+
+    def _run(self):
+        last_expire = time.monotonic()
+        while True:
+            try:
+                batch = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                batch = ()
+            if batch is None:
+                return
+            if batch:
+                start = time.perf_counter()
+                self._send(batch)
+                FANOUT_BATCH_TIME.record(time.perf_counter() - start)
+            now = time.monotonic()
+            if now - last_expire >= 1.0:
+                self._expire()
+                last_expire = now
+
+    def _send(self, batch):
+        n = len(batch)
+        first = self._samples
+        self._samples += n
+        streams = {None: (batch, first)}
+        encoded = {}
+        for subscriber in self.subscribers.values():
+            key = (subscriber.filter, subscriber.format, subscriber.every)
+            payloads = encoded.get(key)
+            if payloads is None:
+                stream = streams.get(subscriber.filter)
+                if stream is None:
+                    stream = streams[subscriber.filter] = self._filter(batch, subscriber.filter)
+                payloads = encoded[key] = self._encode(*stream, *key)
+            if payloads:
+                subscriber.send(payloads)
+        # Le pipeline senza più iscritti vengono scartate (con il loro stato)
+        for spec in [spec for spec in self._pipelines if spec not in streams]:
+            del self._pipelines[spec]
+
+    def _filter(self, batch, spec):
+        """Filtra il blocco con la pipeline condivisa dagli iscritti con filtri `spec`."""
+        entry = self._pipelines.get(spec)
+        if entry is None:
+            entry = self._pipelines[spec] = [parse_pipeline(spec), 0]
+        filtered = entry[0].process(batch)
+        first = entry[1]
+        entry[1] += len(filtered)
+        return filtered, first
+
+    def _encode(self, batch, first, spec, fmt, every):
+        if not len(batch):
+            return []
+        # Stessa scelta di campioni per tutti gli iscritti con lo stesso `every`
+        offset = (-first) % every
+        torque = batch.torque[offset::every]
+        position = batch.position[offset::every]
+        timestamps = batch.timestamp[offset::every]
+        velocity = None if batch.velocity is None else batch.velocity[offset::every]
+        if fmt == FORMAT_ASCII:
+            return encode_ascii(torque, position, velocity)
+        payloads = []
+        seq = self._seq.get((spec, fmt, every), 0)
+        step = max_samples_for(batch)
+        for start in range(0, len(torque), step):
+            end = start + step
+            chunk_ts = timestamps[start:end]
+            payloads.append(encode_datagram(seq, float(chunk_ts[0]), torque[start:end], position[start:end],
+                                            chunk_ts, None if velocity is None else velocity[start:end]))
+            seq = (seq + 1) % SEQ_MODULO
+        self._seq[(spec, fmt, every)] = seq
+        return payloads
@@ -0,0 +1,406 @@
+"""
+Filtri e sottocampionamento del feedback nel bridge.
+
+Il reader seriale produce blocchi di campioni grezzi (SampleBatch) fino a
+decine di migliaia al secondo; un consumer di visualizzazione ne disegna
+al più qualche centinaio. Una FilterPipeline elabora i blocchi prima
+dell'invio, per ogni consumer che la chiede, riducendo datagrammi e CPU
+del consumer. Chi non chiede filtri continua a ricevere i campioni grezzi.
+
+Una pipeline si descrive con una stringa di stadi separati da virgole,
+applicati in ordine (es. "ma:8,mean:33,velocity"):
+  - ma:<n>        media mobile causale su n campioni
+  - lp:<alpha>    passa-basso del primo ordine, y += alpha * (x - y), 0 < alpha <= 1
+  - mean:<ms>     un campione medio per finestra di <ms> millisecondi
+  - min:<ms>      un campione con i minimi della finestra
+  - max:<ms>      un campione con i massimi della finestra
+  - minmax:<ms>   due campioni per finestra (minimi poi massimi): conserva i
+                  picchi, adatto ai grafici
+  - deadband:<n>  invia un campione solo se torque o position cambiano di
+                  almeno n rispetto all'ultimo inviato (almeno uno ogni
+                  DEADBAND_KEEPALIVE secondi, perché il consumer sappia che
+                  il bridge è attivo)
+  - velocity      stima la velocità della position (unità/s) dalla
+                  differenza tra campioni consecutivi e dalla loro frequenza
+                  (da mettere prima di deadband e non dopo min/max/minmax)
+
+Le finestre usano i timestamp host dei campioni: una finestra viene inviata
+quando arriva il primo campione della successiva. Gli stadi mantengono lo
+stato tra un blocco e l'altro, quindi ogni consumer (o gruppo di consumer
+con la stessa stringa) ha la propria pipeline. I filtri richiedono NumPy.
+
+Metriche: filter.samples_in, filter.samples_out.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale per il bridge, ma necessario per i filtri
+    np = None
+
+from Metrics import counter
+from PacketDecoder import SampleBatch
+
+FILTER_SAMPLES_IN = counter("filter.samples_in")
+FILTER_SAMPLES_OUT = counter("filter.samples_out")
+
+DEADBAND_KEEPALIVE = 1.0
+# Limiti degli argomenti: finestre fino a un minuto, medie mobili fino a
+# 10000 campioni, soglie entro l'intervallo dei valori int16
+MAX_WINDOW_MS = 60000.0
+MAX_MOVING_AVERAGE = 10000
+MAX_DEADBAND = 65535.0
+# Finestra (s) su cui lo stadio velocity stima la frequenza dei campioni
+VELOCITY_RATE_WINDOW = 0.05
+# Esponente massimo delle potenze usate da LowPass (e^300 resta lontano dall'overflow)
+LOWPASS_SPAN = 300.0
+LOWPASS_MAX_SPAN = 4096
+# Parole che indicano i campioni grezzi, senza filtri
+RAW_SPECS = ("", "none", "raw")
+
+
+def _columns(batch):
+    """Colonne del blocco come array NumPy (float64 per i valori)."""
+    columns = {
+        "torque": np.asarray(batch.torque, dtype=np.float64),
+        "position": np.asarray(batch.position, dtype=np.float64),
+        "timestamp": np.asarray(batch.timestamp, dtype=np.float64),
+    }
+    if batch.velocity is not None:
+        columns["velocity"] = np.asarray(batch.velocity, dtype=np.float64)
+    return columns
+
+
+def _make_batch(columns):
+    velocity = columns.get("velocity")
+    return SampleBatch(np.rint(columns["torque"]).astype(np.int16),
+                       np.rint(columns["position"]).astype(np.int16),
+                       columns["timestamp"],
+                       velocity=None if velocity is None else velocity.astype(np.float32))
+
+
+def _value_fields(columns):
+    return [name for name in columns if name != "timestamp"]
+
+
+class MovingAverage:
+    """Media mobile causale su `size` campioni (anche a cavallo dei blocchi)."""
+    def __init__(self, size):
+        if not 1 <= size <= MAX_MOVING_AVERAGE:
+            raise ValueError(f"ma: la finestra deve essere tra 1 e {MAX_MOVING_AVERAGE} campioni")
+        self.size = size
+        self._tail = {}     # campo -> ultimi size-1 valori del blocco precedente
+
+    def process(self, batch):
+        if not len(batch) or self.size == 1:
+            return batch
+        columns = _columns(batch)
+        for name in _value_fields(columns):
+            previous = self._tail.get(name, np.empty(0))
+            values = np.concatenate((previous, columns[name]))
+            sums = np.concatenate(([0.0], np.cumsum(values)))
+            end = np.arange(len(previous) + 1, len(values) + 1)
+            start = np.maximum(end - self.size, 0)
+            columns[name] = (sums[end] - sums[start]) / (end - start)
+            self._tail[name] = values[-(self.size - 1):]
+        return _make_batch(columns)
+
+
+class LowPass:
+    """
+    Passa-basso del primo ordine (media mobile esponenziale) per campione,
+    y[i] = y[i-1] + alpha * (x[i] - y[i-1]), calcolato in forma chiusa su
+    tutto il blocco: con r = 1 - alpha,
+        y[i] = r^(i+1) * (y + alpha * sum_{k<=i} x[k] / r^(k+1))
+    Le potenze r^-k crescono con i campioni: i blocchi lunghi si elaborano
+    a tratti di `span` campioni (r^-span <= e^LOWPASS_SPAN, senza overflow,
+    e al più LOWPASS_MAX_SPAN).
+    """
+    def __init__(self, alpha):
+        if not 0 < alpha <= 1:
+            raise ValueError("lp: alpha deve essere in (0, 1]")
+        self.alpha = alpha
+        self._state = {}
+        r = 1.0 - alpha
+        if r > 0:
+            self.span = max(1, min(int(LOWPASS_SPAN / -np.log(r)), LOWPASS_MAX_SPAN))
+            self._decay = r ** np.arange(1, self.span + 1)
+            self._growth = 1.0 / self._decay
+
+    def _filter(self, values, y):
+        if self.alpha == 1:
+            return values, float(values[-1])
+        out = np.empty(len(values))
+        span = self.span
+        for start in range(0, len(values), span):
+            x = values[start:start + span]
+            n = len(x)
+            out[start:start + n] = self._decay[:n] * (y + self.alpha * np.cumsum(x * self._growth[:n]))
+            y = out[start + n - 1]
+        return out, float(y)
+
+    def process(self, batch):
+        if not len(batch):
+            return batch
+        columns = _columns(batch)
+        for name in _value_fields(columns):
+            values = columns[name]
+            columns[name], self._state[name] = self._filter(values, self._state.get(name, values[0]))
+        return _make_batch(columns)
+
+
+class WindowAggregate:
+    """
+    Aggregazione per finestre di `window` secondi: "mean", "min", "max" o
+    "minmax". Della finestra aperta si tengono solo gli aggregati parziali
+    (somma, minimi, massimi, numero di campioni), aggiornati a ogni blocco
+    finché arriva il blocco che la chiude: il costo per blocco non dipende
+    dalla durata della finestra.
+    """
+    KINDS = ("mean", "min", "max", "minmax")
+    # Aggregati parziali necessari per ciascun tipo
+    STATS = {"mean": ("sum",), "min": ("min",), "max": ("max",), "minmax": ("min", "max")}
+    REDUCE = {"sum": np.add, "min": np.minimum, "max": np.maximum} if np is not None else {}
+
+    def __init__(self, kind, window):
+        if kind not in self.KINDS:
+            raise ValueError(f"aggregazione sconosciuta: {kind}")
+        if not math.isfinite(window) or not 0 < window <= MAX_WINDOW_MS / 1000.0:
+            raise ValueError(f"{kind}: la finestra deve essere tra 0 e {MAX_WINDOW_MS} ms")
+        self.kind = kind
+        self.window = window
+        self._open = None       # aggregati della finestra aperta (vedi _segments)
+        self._fields = None
+
+    def _segments(self, columns, fields):
+        """Aggregati dei tratti consecutivi del blocco che cadono nella stessa finestra."""
+        timestamps = columns["timestamp"]
+        windows = np.floor(timestamps / self.window).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(windows[1:] != windows[:-1]) + 1))
+        ends = np.append(starts[1:], len(timestamps))
+        segments = {"window": windows[starts], "timestamp": timestamps[ends - 1],
+                    "count": (ends - starts).astype(np.float64)}
+        for name in fields:
+            for stat in self.STATS[self.kind]:
+                segments[name, stat] = self.REDUCE[stat].reduceat(columns[name], starts)
+        return segments
+
+    def process(self, batch):
+        if not len(batch):
+            return batch
+        columns = _columns(batch)
+        fields = _value_fields(columns)
+        current = self._open if fields == self._fields else None
+        timestamps = columns["timestamp"]
+        if current is not None and np.floor(timestamps[-1] / self.window) == current["window"][0] \
+                and np.floor(timestamps[0] / self.window) == current["window"][0]:
+            # Caso più frequente: tutto il blocco cade nella finestra aperta
+            current["count"][0] += len(timestamps)
+            current["timestamp"][0] = timestamps[-1]
+            for name in fields:
+                for stat in self.STATS[self.kind]:
+                    reduce = self.REDUCE[stat]
+                    current[name, stat][0] = reduce(current[name, stat][0], reduce.reduce(columns[name]))
+            return _make_batch({name: columns[name][:0] for name in columns})
+        segments = self._segments(columns, fields)
+        if current is not None:
+            if current["window"][0] == segments["window"][0]:
+                # Il blocco continua la finestra aperta
+                segments["count"][0] += current["count"][0]
+                for key, values in segments.items():
+                    if isinstance(key, tuple):
+                        values[0] = self.REDUCE[key[1]](values[0], current[key][0])
+            else:
+                segments = {key: np.concatenate((current[key], values)) for key, values in segments.items()}
+        self._open = {key: values[-1:].copy() for key, values in segments.items()}
+        self._fields = fields
+        closed = {key: values[:-1] for key, values in segments.items()}
+        if not len(closed["count"]):
+            return _make_batch({name: columns[name][:0] for name in columns})
+        out = {"timestamp": closed["timestamp"]}
+        if self.kind == "mean":
+            for name in fields:
+                out[name] = closed[name, "sum"] / closed["count"]
+        elif self.kind in ("min", "max"):
+            for name in fields:
+                out[name] = closed[name, self.kind]
+        else:
+            # Minimi e massimi alternati, con il timestamp della finestra
+            out["timestamp"] = np.repeat(out["timestamp"], 2)
+            for name in fields:
+                pairs = np.empty(2 * len(closed["count"]))
+                pairs[0::2] = closed[name, "min"]
+                pairs[1::2] = closed[name, "max"]
+                out[name] = pairs
+        return _make_batch(out)
+
+
+class Deadband:
+    """Scarta i campioni che non cambiano di almeno `threshold` (vedi modulo)."""
+    def __init__(self, threshold, keepalive=DEADBAND_KEEPALIVE):
+        if threshold < 0:
+            raise ValueError("deadband: la soglia non può essere negativa")
+        self.threshold = threshold
+        self.keepalive = keepalive
+        self._last = None   # (torque, position, timestamp) dell'ultimo campione inviato
+
+    def process(self, batch):
+        if not len(batch):
+            return batch
+        columns = _columns(batch)
+        threshold = self.threshold
+        keepalive = self.keepalive
+        keep = []
+        last = self._last
+        for i, (torque, position, timestamp) in enumerate(zip(columns["torque"].tolist(),
+                                                              columns["position"].tolist(),
+                                                              columns["timestamp"].tolist())):
+            if (last is None or abs(torque - last[0]) >= threshold or abs(position - last[1]) >= threshold
+                    or timestamp - last[2] >= keepalive):
+                keep.append(i)
+                last = (torque, position, timestamp)
+        self._last = last
+        if len(keep) == len(batch):
+            return batch
+        keep = np.array(keep, dtype=np.intp)
+        return _make_batch({name: values[keep] for name, values in columns.items()})
+
+
+class Velocity:
+    """
+    Velocità della position in unità/s: differenza tra campioni consecutivi
+    per la frequenza dei campioni, stimata dai timestamp (i campioni di uno
+    stesso blocco hanno lo stesso timestamp di ricezione).
+    """
+    def __init__(self, rate_window=VELOCITY_RATE_WINDOW):
+        self.rate_window = rate_window
+        self.rate = 0.0
+        self._last_position = None
+        self._since = None
+        self._count = 0
+
+    def _update_rate(self, n, timestamp):
+        if self._since is None:
+            self._since = timestamp
+            return
+        self._count += n
+        elapsed = timestamp - self._since
+        if elapsed < self.rate_window:
+            return
+        rate = self._count / elapsed
+        # Media con la stima precedente, come ReadPacer
+        self.rate = rate if not self.rate else 0.5 * (self.rate + rate)
+        self._since = timestamp
+        self._count = 0
+
+    def process(self, batch):
+        n = len(batch)
+        if not n:
+            return batch
+        columns = _columns(batch)
+        position = columns["position"]
+        self._update_rate(n, float(columns["timestamp"][-1]))
+        previous = position[0] if self._last_position is None else self._last_position
+        columns["velocity"] = np.diff(position, prepend=previous) * self.rate
+        self._last_position = position[-1]
+        return _make_batch(columns)
+
+
+def _ms_to_seconds(value):
+    return float(value) / 1000.0
+
+
+STAGES = {
+    "ma": lambda arg: MovingAverage(int(arg)),
+    "lp": lambda arg: LowPass(float(arg)),
+    "mean": lambda arg: WindowAggregate("mean", _ms_to_seconds(arg)),
+    "min": lambda arg: WindowAggregate("min", _ms_to_seconds(arg)),
+    "max": lambda arg: WindowAggregate("max", _ms_to_seconds(arg)),
+    "minmax": lambda arg: WindowAggregate("minmax", _ms_to_seconds(arg)),
+    "deadband": lambda arg: Deadband(float(arg)),
+    "velocity": lambda arg: Velocity(),
+}
+# Stadi senza argomento
+NO_ARGUMENT = ("velocity",)
+# Intervalli ammessi per gli argomenti (estremo inferiore escluso, tranne per deadband)
+ARGUMENT_LIMITS = {
+    "ma": (0, MAX_MOVING_AVERAGE),
+    "lp": (0, 1),
+    "mean": (0, MAX_WINDOW_MS),
+    "min": (0, MAX_WINDOW_MS),
+    "max": (0, MAX_WINDOW_MS),
+    "minmax": (0, MAX_WINDOW_MS),
+    "deadband": (0, MAX_DEADBAND),
+}
+
+
+class FilterPipeline:
+    """Sequenza di stadi applicati a ogni blocco (vedi modulo)."""
+    def __init__(self, stages, spec):
+        self.stages = stages
+        self.spec = spec
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def process(self, batch):
+        n = len(batch)
+        self.samples_in += n
+        FILTER_SAMPLES_IN.inc(n)
+        for stage in self.stages:
+            batch = stage.process(batch)
+            if not len(batch):
+                break
+        self.samples_out += len(batch)
+        FILTER_SAMPLES_OUT.inc(len(batch))
+        return batch
+
+
+def _check_argument(name, arg):
+    """Verifica l'argomento di uno stadio (numero finito entro ARGUMENT_LIMITS)."""
+    try:
+        value = float(arg)
+    except ValueError:
+        raise ValueError(f"argomento del filtro {name} non valido: {arg}")
+    low, high = ARGUMENT_LIMITS[name]
+    in_range = low <= value <= high if name == "deadband" else low < value <= high
+    if not math.isfinite(value) or not in_range:
+        raise ValueError(f"argomento del filtro {name} fuori intervallo: {arg}")
+    if name == "ma" and value != int(value):
+        raise ValueError(f"argomento del filtro {name} non intero: {arg}")
+
+
+def normalize_spec(text):
+    """
+    Forma canonica della stringa dei filtri (None per i campioni grezzi).
+    Solleva ValueError se la stringa non è valida.
+    """
+    if text is None or text.strip().lower() in RAW_SPECS:
+        return None
+    stages = []
+    for token in text.split(","):
+        name, sep, arg = token.strip().lower().partition(":")
+        if name not in STAGES:
+            raise ValueError(f"filtro sconosciuto: {name}")
+        if (name in NO_ARGUMENT) == bool(sep):
+            raise ValueError(f"argomento del filtro {name} non valido")
+        if sep:
+            _check_argument(name, arg)
+        stages.append(f"{name}:{arg}" if sep else name)
+    return ",".join(stages)
+
+
+def parse_pipeline(text):
+    """
+    Costruisce una FilterPipeline dalla stringa dei filtri, oppure None per
+    i campioni grezzi. Solleva ValueError se la stringa non è valida.
+    """
+    spec = normalize_spec(text)
+    if spec is None:
+        return None
+    if np is None:
+        raise ValueError("i filtri del feedback richiedono NumPy")
+    stages = []
+    for token in spec.split(","):
+        name, _, arg = token.partition(":")
+        stages.append(STAGES[name](arg))
+    return FilterPipeline(stages, spec)
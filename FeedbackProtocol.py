@@ -0,0 +1,293 @@
+import struct
+import time
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale: si usa struct
+    np = None
+
+from ConsoleLog import get_logger
+from FeedbackFilter import normalize_spec, parse_pipeline
+from Metrics import counter
+
+log = get_logger("FeedbackProtocol")
+
+DATAGRAMS_SENT = counter("udp.datagrams_sent")
+SEND_ERRORS = counter("udp.send_errors")
+
+# -------------------------
+# Formato binario del feedback (versione 1)
+# -------------------------
+# Header: magic 'SF', versione, flag, numero di sequenza, timestamp del primo
+# campione (time.time()), numero di campioni.
+# Ogni campione: torque, position (int16) e offset temporale in secondi
+# rispetto al timestamp dell'header (float32). Con FLAG_VELOCITY ogni
+# campione è seguito dalla velocità stimata (float32, unità di position/s),
+# inviata solo ai consumer che l'hanno chiesta (vedi FeedbackFilter).
+MAGIC = b'SF'
+VERSION = 1
+HEADER = struct.Struct('<2sBBIdH')
+SAMPLE = struct.Struct('<hhf')
+SAMPLE_VELOCITY = struct.Struct('<hhff')
+FLAG_VELOCITY = 0x01
+# 18 + 120 * 8 = 978 byte: resta sotto i 1024 byte letti dai consumer storici
+MAX_SAMPLES = 120
+# 18 + 80 * 12 = 978 byte
+MAX_SAMPLES_VELOCITY = 80
+SEQ_MODULO = 1 << 32
+
+FORMAT_ASCII = "ASCII"
+FORMAT_BINARY = "BIN1"
+
+# Handshake sulla porta comandi: il consumer invia "HELLO BIN1" e il bridge
+# risponde "CAPS BIN1" al mittente. Chi non invia HELLO riceve il formato ASCII.
+# Il formato si negozia per indirizzo: HELLO va inviato dal socket su cui si
+# riceve il feedback (es. quello legato a 5006); da altri indirizzi il bridge
+# risponde CAPS senza cambiare il flusso principale.
+# Con "HELLO BIN1 filter=<filtri>" il consumer chiede il feedback filtrato
+# (vedi FeedbackFilter) e il bridge lo conferma in "CAPS BIN1 filter=<filtri>";
+# "filter=none" chiede esplicitamente i campioni grezzi.
+HELLO_PREFIX = "HELLO"
+CAPS_PREFIX = "CAPS"
+FILTER_OPTION = "filter="
+SUPPORTED_FORMATS = (FORMAT_BINARY, FORMAT_ASCII)
+
+if np is not None:
+    _SAMPLE_DTYPE = np.dtype([('torque', '<i2'), ('position', '<i2'), ('dt', '<f4')])
+    _SAMPLE_VELOCITY_DTYPE = np.dtype([('torque', '<i2'), ('position', '<i2'), ('dt', '<f4'), ('velocity', '<f4')])
+
+
+def hello_message(fmt=FORMAT_BINARY, filter_spec=None):
+    if filter_spec:
+        return f"{HELLO_PREFIX} {fmt} {FILTER_OPTION}{filter_spec}".encode('ascii')
+    return f"{HELLO_PREFIX} {fmt}".encode('ascii')
+
+
+def negotiate_format(message):
+    """
+    Interpreta un messaggio "HELLO <formati...>" e restituisce il primo
+    formato supportato, oppure FORMAT_ASCII.
+    """
+    tokens = message.split()
+    for fmt in tokens[1:]:
+        if fmt.upper() in SUPPORTED_FORMATS:
+            return fmt.upper()
+    return FORMAT_ASCII
+
+
+def hello_filter(message):
+    """
+    Restituisce il filtro chiesto in un messaggio HELLO: la stringa dopo
+    "filter=", "" per "filter=none" o None se il consumer non lo indica.
+    """
+    for token in message.split()[1:]:
+        if token.lower().startswith(FILTER_OPTION):
+            spec = token[len(FILTER_OPTION):]
+            return "" if spec.lower() == "none" else spec
+    return None
+
+
+def caps_message(fmt, filter_spec=None):
+    if filter_spec:
+        return f"{CAPS_PREFIX} {fmt} {FILTER_OPTION}{filter_spec}".encode('ascii')
+    return f"{CAPS_PREFIX} {fmt}".encode('ascii')
+
+
+def max_samples_for(batch):
+    """Campioni per datagramma binario per il blocco (meno se include la velocità)."""
+    return MAX_SAMPLES if batch.velocity is None else MAX_SAMPLES_VELOCITY
+
+
+def encode_ascii(torque, position, velocity=None):
+    """Un datagramma "torque position [velocity]" per campione."""
+    if velocity is None:
+        return [b"%d %d" % (t, p) for t, p in zip(torque, position)]
+    return [b"%d %d %.1f" % (t, p, v) for t, p, v in zip(torque, position, velocity)]
+
+
+def encode_datagram(seq, timestamp, torque, position, timestamps, velocity=None):
+    """
+    Impacchetta fino a MAX_SAMPLES campioni (MAX_SAMPLES_VELOCITY con la
+    velocità) in un datagramma binario. torque, position, timestamps e
+    velocity (opzionale) sono sequenze della stessa lunghezza.
+    """
+    n = len(torque)
+    flags = 0 if velocity is None else FLAG_VELOCITY
+    header = HEADER.pack(MAGIC, VERSION, flags, seq % SEQ_MODULO, timestamp, n)
+    if np is not None:
+        samples = np.empty(n, dtype=_SAMPLE_DTYPE if velocity is None else _SAMPLE_VELOCITY_DTYPE)
+        samples['torque'] = torque
+        samples['position'] = position
+        samples['dt'] = np.asarray(timestamps, dtype=np.float64) - timestamp
+        if velocity is not None:
+            samples['velocity'] = velocity
+        return header + samples.tobytes()
+    sample = SAMPLE if velocity is None else SAMPLE_VELOCITY
+    out = bytearray(HEADER.size + n * sample.size)
+    out[:HEADER.size] = header
+    offset = HEADER.size
+    if velocity is None:
+        for t, p, ts in zip(torque, position, timestamps):
+            sample.pack_into(out, offset, t, p, ts - timestamp)
+            offset += sample.size
+    else:
+        for t, p, ts, v in zip(torque, position, timestamps, velocity):
+            sample.pack_into(out, offset, t, p, ts - timestamp, v)
+            offset += sample.size
+    return bytes(out)
+
+
+def is_binary(datagram):
+    return len(datagram) >= HEADER.size and datagram[:2] == MAGIC
+
+
+class FeedbackPublisher:
+    """
+    Invia i blocchi di campioni (SampleBatch) al consumer di feedback.
+    Nel formato ASCII invia un datagramma "torque position" per campione,
+    nel formato binario fino a MAX_SAMPLES campioni per datagramma con
+    numero di sequenza.
+
+    I blocchi possono essere filtrati prima dell'invio (vedi FeedbackFilter
+    e set_filter); `default_filter` sono i filtri usati finché il consumer
+    non ne chiede altri con HELLO (None: campioni grezzi).
+    """
+    def __init__(self, sock, dest, fmt=FORMAT_ASCII, max_samples=MAX_SAMPLES, default_filter=None):
+        self.sock = sock
+        self.dest = dest
+        self.format = fmt
+        self.max_samples = max(1, min(max_samples, MAX_SAMPLES))
+        self.default_filter = normalize_spec(default_filter)
+        self.filter = None
+        self.set_filter(self.default_filter)
+        self.seq = 0
+        self.datagrams_sent = 0
+        self.send_errors = 0
+
+    @property
+    def filter_spec(self):
+        return None if self.filter is None else self.filter.spec
+
+    def set_filter(self, spec):
+        """
+        Imposta i filtri (stringa, vedi FeedbackFilter; None per i campioni
+        grezzi) e restituisce la loro forma canonica. Se i filtri non
+        cambiano la pipeline, con il suo stato, resta la stessa. Solleva
+        ValueError se la stringa non è valida.
+        """
+        spec = normalize_spec(spec)
+        if spec != self.filter_spec:
+            # Sostituzione atomica: il reader seriale usa la pipeline vecchia o quella nuova
+            self.filter = parse_pipeline(spec)
+        return spec
+
+    def publish(self, batch):
+        pipeline = self.filter
+        if pipeline is not None:
+            batch = pipeline.process(batch)
+        if not len(batch):
+            return
+        if self.format == FORMAT_BINARY:
+            self._publish_binary(batch)
+        else:
+            self._publish_ascii(batch)
+
+    def _send(self, payload):
+        try:
+            self.sock.sendto(payload, self.dest)
+            self.datagrams_sent += 1
+            DATAGRAMS_SENT.inc()
+        except Exception as e:
+            self.send_errors += 1
+            SEND_ERRORS.inc()
+            log.error("Errore nell'invio UDP: %s", e)
+
+    def _publish_ascii(self, batch):
+        velocity = None if batch.velocity is None else batch.velocity.tolist()
+        for payload in encode_ascii(batch.torque.tolist(), batch.position.tolist(), velocity):
+            self._send(payload)
+
+    def _publish_binary(self, batch):
+        n = len(batch)
+        step = min(self.max_samples, max_samples_for(batch))
+        velocity = batch.velocity
+        for start in range(0, n, step):
+            end = min(start + step, n)
+            timestamps = batch.timestamp[start:end]
+            payload = encode_datagram(self.seq, float(timestamps[0]), batch.torque[start:end],
+                                      batch.position[start:end], timestamps,
+                                      None if velocity is None else velocity[start:end])
+            self.seq = (self.seq + 1) % SEQ_MODULO
+            self._send(payload)
+
+
+class FeedbackDecoder:
+    """
+    Decodifica i datagrammi di feedback in entrambi i formati.
+    Per il formato binario tiene traccia dei numeri di sequenza e conta
+    i datagrammi persi (`lost`). Se il datagramma include la velocità
+    (feedback filtrato, vedi FeedbackFilter) questa resta in `velocity`
+    fino al datagramma successivo, altrimenti `velocity` è None.
+    """
+    def __init__(self):
+        self.expected_seq = None
+        self.received = 0
+        self.lost = 0
+        self.ascii_datagrams = 0
+        self.velocity = None
+
+    def decode(self, datagram):
+        """Restituisce una lista di tuple (torque, position, timestamp)."""
+        if is_binary(datagram):
+            return self._decode_binary(datagram)
+        self.ascii_datagrams += 1
+        tokens = datagram.decode('utf-8').split()
+        self.velocity = [float(tokens[2])] if len(tokens) >= 3 else None
+        if len(tokens) >= 2:
+            return [(int(tokens[0]), int(tokens[1]), time.time())]
+        return [(0, int(tokens[0]), time.time())]
+
+    def decode_columns(self, datagram):
+        """
+        Come decode(), ma restituisce le colonne (torque, position, timestamp).
+        Con NumPy sono array letti direttamente dal datagramma binario, senza
+        passare da tuple Python.
+        """
+        if np is None or not is_binary(datagram):
+            samples = self.decode(datagram)
+            return tuple(list(column) for column in zip(*samples)) if samples else ([], [], [])
+        timestamp, count, flags = self._parse_header(datagram)
+        velocity = flags & FLAG_VELOCITY
+        samples = np.frombuffer(datagram, dtype=_SAMPLE_VELOCITY_DTYPE if velocity else _SAMPLE_DTYPE,
+                                count=count, offset=HEADER.size)
+        self.velocity = samples['velocity'] if velocity else None
+        return samples['torque'], samples['position'], timestamp + samples['dt'].astype(np.float64)
+
+    def _parse_header(self, datagram):
+        magic, version, flags, seq, timestamp, count = HEADER.unpack_from(datagram, 0)
+        if version != VERSION:
+            raise ValueError(f"Versione del protocollo di feedback non supportata: {version}")
+        sample = SAMPLE_VELOCITY if flags & FLAG_VELOCITY else SAMPLE
+        if len(datagram) < HEADER.size + count * sample.size:
+            raise ValueError("Datagramma di feedback troncato")
+        self._track_seq(seq)
+        return timestamp, count, flags
+
+    def _decode_binary(self, datagram):
+        timestamp, count, flags = self._parse_header(datagram)
+        payload = memoryview(datagram)[HEADER.size:]
+        if flags & FLAG_VELOCITY:
+            samples = list(SAMPLE_VELOCITY.iter_unpack(payload[:count * SAMPLE_VELOCITY.size]))
+            self.velocity = [v for _, _, _, v in samples]
+            return [(t, p, timestamp + dt) for t, p, dt, _ in samples]
+        self.velocity = None
+        return [(t, p, timestamp + dt) for t, p, dt in SAMPLE.iter_unpack(payload[:count * SAMPLE.size])]
+
+    def _track_seq(self, seq):
+        self.received += 1
+        if self.expected_seq is not None:
+            gap = (seq - self.expected_seq) % SEQ_MODULO
+            # Un salto "all'indietro" indica un riavvio del bridge o un riordino
+            if gap < SEQ_MODULO // 2:
+                self.lost += gap
+        self.expected_seq = (seq + 1) % SEQ_MODULO
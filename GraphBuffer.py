@@ -0,0 +1,240 @@
+import numpy as np
+
+
+class SampleRing:
+    """
+    Ring buffer preallocato per lo storico dei campioni della GUI.
+
+    Pensato per un solo produttore (thread del listener UDP) e un solo
+    consumatore (loop di rendering), senza lock: il produttore scrive prima
+    i dati negli slot e poi pubblica il nuovo contatore `count`; il
+    consumatore legge il contatore, copia gli slot e ricontrolla che nel
+    frattempo il produttore non abbia sovrascritto la parte copiata,
+    altrimenti ripete la copia.
+
+    Gli slot allocati sono più di `capacity`: il margine in più permette al
+    produttore di continuare a scrivere durante una copia senza costringere
+    il consumatore a ripeterla.
+
+    Ogni campo (es. "position") ha un array float32; i timestamp sono float64.
+    """
+    def __init__(self, capacity, fields=("position",)):
+        if capacity < 2:
+            raise ValueError("capacity deve essere almeno 2")
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._size = capacity + max(256, capacity // 4)
+        self._timestamps = np.zeros(self._size, dtype=np.float64)
+        self._data = {name: np.zeros(self._size, dtype=np.float32) for name in self.fields}
+        # Numero totale di campioni scritti (monotono): fa anche da versione dei dati
+        self.count = 0
+
+    def extend(self, timestamps, **values):
+        """Aggiunge un blocco di campioni (lato produttore)."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        n = len(timestamps)
+        if n == 0:
+            return
+        if n > self.capacity:
+            timestamps = timestamps[-self.capacity:]
+            values = {name: np.asarray(v)[-self.capacity:] for name, v in values.items()}
+            n = self.capacity
+        start = self.count % self._size
+        first = min(n, self._size - start)
+        self._timestamps[start:start + first] = timestamps[:first]
+        self._timestamps[:n - first] = timestamps[first:]
+        for name in self.fields:
+            column = np.asarray(values[name])
+            self._data[name][start:start + first] = column[:first]
+            self._data[name][:n - first] = column[first:]
+        # Pubblicazione: il consumatore vede i nuovi dati solo da qui in poi
+        self.count += n
+
+    def _copy_last(self, array, end, n):
+        start = (end - n) % self._size
+        if start + n <= self._size:
+            return array[start:start + n].copy()
+        return np.concatenate((array[start:], array[:(start + n) - self._size]))
+
+    def latest(self, n=None):
+        """
+        Restituisce (timestamps, {campo: valori}) degli ultimi `n` campioni,
+        dal più vecchio al più recente (lato consumatore).
+        """
+        while True:
+            end = self.count
+            available = min(end, self.capacity)
+            n_read = available if n is None else min(n, available)
+            timestamps = self._copy_last(self._timestamps, end, n_read)
+            values = {name: self._copy_last(self._data[name], end, n_read) for name in self.fields}
+            # Se il produttore ha riempito gli slot appena copiati la lettura va ripetuta
+            if self.count - end <= self._size - n_read:
+                return timestamps, values
+
+    def timestamp_back(self, back):
+        """Timestamp dell'elemento `back` posizioni prima della fine (1 = il più recente)."""
+        return float(self._timestamps[(self.count - back) % self._size])
+
+    def window(self, seconds):
+        """Campioni degli ultimi `seconds` secondi rispetto al campione più recente."""
+        timestamps, values = self.latest()
+        if len(timestamps) == 0:
+            return timestamps, values
+        cutoff = np.searchsorted(timestamps, timestamps[-1] - seconds, side="left")
+        return timestamps[cutoff:], {name: v[cutoff:] for name, v in values.items()}
+
+
+class _PyramidLevel:
+    """Un livello della piramide: blocchi di `group` elementi del livello precedente ridotti a min/max."""
+    def __init__(self, group, size, capacity, fields):
+        self.group = group
+        self.size = size          # campioni grezzi coperti da un blocco
+        self.fields = fields
+        self.ring = SampleRing(capacity, [f"{name}_{kind}" for name in fields for kind in ("min", "max")])
+        self._pending = None
+
+    def add(self, timestamps, mins, maxs):
+        """Aggrega i nuovi elementi e restituisce i blocchi completati (per il livello successivo)."""
+        if self._pending is not None:
+            p_ts, p_mins, p_maxs = self._pending
+            timestamps = np.concatenate((p_ts, timestamps))
+            mins = {name: np.concatenate((p_mins[name], mins[name])) for name in self.fields}
+            maxs = {name: np.concatenate((p_maxs[name], maxs[name])) for name in self.fields}
+        full = len(timestamps) // self.group * self.group
+        rest = slice(full, None)
+        self._pending = (timestamps[rest], {n: mins[n][rest] for n in self.fields},
+                         {n: maxs[n][rest] for n in self.fields}) if full < len(timestamps) else None
+        if not full:
+            return None
+        # Timestamp di un blocco = timestamp del suo primo campione
+        block_ts = timestamps[:full:self.group]
+        block_mins = {n: mins[n][:full].reshape(-1, self.group).min(axis=1) for n in self.fields}
+        block_maxs = {n: maxs[n][:full].reshape(-1, self.group).max(axis=1) for n in self.fields}
+        values = {}
+        for name in self.fields:
+            values[f"{name}_min"] = block_mins[name]
+            values[f"{name}_max"] = block_maxs[name]
+        self.ring.extend(block_ts, **values)
+        return block_ts, block_mins, block_maxs
+
+
+class MinMaxPyramid:
+    """
+    Storico dei campioni con piramide min/max mantenuta in modo incrementale.
+
+    Il livello 0 è il SampleRing dei campioni grezzi; il livello 1 riduce
+    blocchi di `bin_size` campioni al loro minimo e massimo, ogni livello
+    successivo riduce `factor` blocchi del precedente. Per disegnare una
+    finestra si sceglie il livello più fine che la copre con al massimo
+    `oversample` blocchi per colonna di pixel: il costo per frame dipende
+    solo dalla larghezza del grafico, non dalla durata della finestra né
+    dalla frequenza di campionamento.
+
+    Come SampleRing: un solo produttore (extend) e un solo consumatore.
+    """
+    def __init__(self, capacity, fields=("position",), bin_size=8, factor=4, max_bins=1024):
+        self.fields = tuple(fields)
+        self.raw = SampleRing(capacity, self.fields)
+        self.levels = []
+        group, size = bin_size, bin_size
+        while True:
+            bins = capacity // size + 1
+            self.levels.append(_PyramidLevel(group, size, max(2, bins), self.fields))
+            if bins <= max_bins:
+                break
+            group = factor
+            size *= factor
+
+    @property
+    def capacity(self):
+        return self.raw.capacity
+
+    @property
+    def count(self):
+        """Numero totale di campioni ricevuti (fa anche da versione dei dati)."""
+        return self.raw.count
+
+    def extend(self, timestamps, **values):
+        """Aggiunge un blocco di campioni (lato produttore)."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(timestamps) == 0:
+            return
+        columns = {name: np.asarray(values[name], dtype=np.float32) for name in self.fields}
+        self.raw.extend(timestamps, **columns)
+        if len(timestamps) > self.raw.capacity:
+            timestamps = timestamps[-self.raw.capacity:]
+            columns = {name: v[-self.raw.capacity:] for name, v in columns.items()}
+        block = (timestamps, columns, columns)
+        for level in self.levels:
+            block = level.add(*block)
+            if block is None:
+                break
+
+    def latest(self, n=None):
+        return self.raw.latest(n)
+
+    def window(self, seconds):
+        return self.raw.window(seconds)
+
+    def _covers(self, ring, t_start, max_items):
+        """True se gli ultimi `max_items` elementi di `ring` coprono la finestra da t_start."""
+        available = min(ring.count, ring.capacity)
+        if available == 0:
+            return True
+        if available <= max_items:
+            # Tutto il contenuto è leggibile: basta se il ring non ha ancora perso dati
+            # oppure se il suo elemento più vecchio precede la finestra
+            return ring.count <= ring.capacity or ring.timestamp_back(available) <= t_start
+        return ring.timestamp_back(max_items) <= t_start
+
+    def envelope(self, seconds, columns, oversample=4):
+        """
+        Riduce gli ultimi `seconds` secondi a un inviluppo min/max per colonna.
+
+        Restituisce (colonne, {campo: (minimi, massimi)}), dove `colonne` sono
+        gli indici (0..columns-1) delle colonne che contengono dati; la colonna
+        columns-1 corrisponde al campione più recente.
+        """
+        empty = np.empty(0, dtype=np.int64), {name: (np.empty(0), np.empty(0)) for name in self.fields}
+        if self.raw.count == 0 or columns <= 0:
+            return empty
+        t_end = self.raw.timestamp_back(1)
+        t_start = t_end - seconds
+        max_items = columns * oversample
+
+        if self._covers(self.raw, t_start, max_items):
+            timestamps, values = self.raw.latest(max_items)
+            mins = maxs = values
+        else:
+            level = self.levels[-1]
+            for candidate in self.levels:
+                if self._covers(candidate.ring, t_start, max_items):
+                    level = candidate
+                    break
+            # Contatore letto prima dei blocchi: al più qualche campione compare due volte
+            level_count = level.ring.count
+            n_read = min(max_items, level.ring.capacity)
+            timestamps, values = level.ring.latest(n_read)
+            mins = {name: values[f"{name}_min"] for name in self.fields}
+            maxs = {name: values[f"{name}_max"] for name in self.fields}
+            # Campioni grezzi non ancora ridotti in un blocco completo di questo livello
+            tail = min(max(self.raw.count - level_count * level.size, 0), self.raw.capacity)
+            if tail:
+                tail_ts, tail_values = self.raw.latest(tail)
+                timestamps = np.concatenate((timestamps, tail_ts))
+                mins = {n: np.concatenate((mins[n], tail_values[n])) for n in self.fields}
+                maxs = {n: np.concatenate((maxs[n], tail_values[n])) for n in self.fields}
+
+        first = np.searchsorted(timestamps, t_start, side="left")
+        timestamps = timestamps[first:]
+        if len(timestamps) == 0:
+            return empty
+        col = ((timestamps - t_start) * (columns / seconds)).astype(np.int64)
+        np.clip(col, 0, columns - 1, out=col)
+        # Gli elementi sono ordinati nel tempo: ogni colonna è un tratto contiguo
+        starts = np.flatnonzero(np.concatenate(([True], col[1:] != col[:-1])))
+        result = {}
+        for name in self.fields:
+            result[name] = (np.minimum.reduceat(mins[name][first:], starts),
+                            np.maximum.reduceat(maxs[name][first:], starts))
+        return col[starts], result
@@ -1,12 +1,32 @@
+"""
+GUI del SixthFinger: pulsanti Close/Open, controlli della finestra e grafico
+di torque e position ricevuti dal bridge.
+
+L'import del modulo non ha effetti collaterali: SDL, la finestra, il font e
+il socket dei comandi vengono inizializzati alla prima necessità
+(init_display(), get_font(), command_socket()). Con init_display(headless=True)
+il rendering usa il driver video "dummy" di SDL, senza finestra né display,
+per benchmark e test (vedi BenchGUI).
+
+Struttura:
+  - ingest dei dati: udp_feedback_listener / shm_feedback_listener -> history
+  - input: handle_event()
+  - rendering: Renderer (retained-mode, vedi sotto)
+"""
 import pygame
 import pygame.gfxdraw
 import socket
 import sys
+import os
 import ctypes
 from ctypes import wintypes
 import math
 import threading
 import time
+import argparse
+import numpy as np
+from FeedbackProtocol import CAPS_PREFIX, FeedbackDecoder, hello_message
+from GraphBuffer import MinMaxPyramid
 
 # Fattore di supersampling
 SUPERSAMPLE = 2
@@ -23,26 +43,35 @@ UDP_IP = "127.0.0.1"
 UDP_CMD_PORT = 5005       # Porta per inviare comandi (open/close)
 UDP_FEEDBACK_PORT = 5006  # Porta per ricevere i dati (torque e position)
 
-pygame.init()
-
-# Crea la finestra finale (display)
-screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.NOFRAME)
-pygame.display.set_caption("SixthFingerHostWin GUI")
-
-# Surface di rendering ad alta risoluzione
-render_surface = pygame.Surface((R_WIDTH, R_HEIGHT))
-
-# -------------------------
-# Creazione della regione arrotondata per la finestra (usa le dimensioni finali)
-# -------------------------
+screen = None   # Finestra finale, creata da init_display()
 hwnd = None
-if sys.platform == "win32":
-    wm_info = pygame.display.get_wm_info()
-    hwnd = wm_info.get("window")
-    if hwnd:
-        corner_radius = 30  # Raggio in pixel della finestra finale (non scalato)
-        rgn = ctypes.windll.gdi32.CreateRoundRectRgn(0, 0, WIDTH, HEIGHT, corner_radius, corner_radius)
-        ctypes.windll.user32.SetWindowRgn(hwnd, rgn, True)
+
+def init_display(headless=False):
+    """
+    Inizializza SDL e crea la finestra finale (una sola volta).
+    Con `headless` usa il driver video "dummy": nessuna finestra, stesso rendering.
+    """
+    global screen, hwnd
+    if screen is not None:
+        return screen
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    # Solo video e font: pygame.init() avvierebbe anche audio e joystick,
+    # che la GUI non usa e che all'avvio possono costare centinaia di ms
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.NOFRAME)
+    pygame.display.set_caption("SixthFingerHostWin GUI")
+
+    # Regione arrotondata per la finestra (usa le dimensioni finali)
+    if sys.platform == "win32" and not headless:
+        wm_info = pygame.display.get_wm_info()
+        hwnd = wm_info.get("window")
+        if hwnd:
+            corner_radius = 30  # Raggio in pixel della finestra finale (non scalato)
+            rgn = ctypes.windll.gdi32.CreateRoundRectRgn(0, 0, WIDTH, HEIGHT, corner_radius, corner_radius)
+            ctypes.windll.user32.SetWindowRgn(hwnd, rgn, True)
+    return screen
 
 # -------------------------
 # Definizione colori e stili (Apple-like)
@@ -56,7 +85,7 @@ BORDER_COLOR = (160, 160, 160)
 TEXT_COLOR = (255, 255, 255)             # Bianco
 SHADOW_COLOR = (200, 200, 200)
 
-# Parametri (scalati per il render_surface)
+# Parametri (scalati per il rendering ad alta risoluzione)
 button_width = 120 * SUPERSAMPLE
 button_height = 50 * SUPERSAMPLE
 padding = 20 * SUPERSAMPLE
@@ -89,7 +118,7 @@ def draw_window_controls(surface):
 
 def handle_window_controls_event(event):
     if event.type == pygame.MOUSEBUTTONUP:
-        # Per i controlli, convertiamo le coordinate dell'evento in quelle del render_surface
+        # Per i controlli, convertiamo le coordinate dell'evento in quelle del rendering ad alta risoluzione
         pos = (event.pos[0] * SUPERSAMPLE, event.pos[1] * SUPERSAMPLE)
         if is_point_in_circle(pos, control_red_center, CONTROL_RADIUS):
             pygame.quit()
@@ -126,7 +155,7 @@ def draw_rounded_button(surface, rect, text, is_hovered=False, is_pressed=False)
     draw_aa_rounded_rect(surface, rect, color, 15 * SUPERSAMPLE)
     pygame.draw.rect(surface, BORDER_COLOR, rect, 2, border_radius=15 * SUPERSAMPLE)
     
-    text_surface = font.render(text, True, TEXT_COLOR)
+    text_surface = get_font().render(text, True, TEXT_COLOR)
     text_rect = text_surface.get_rect(center=rect.center)
     surface.blit(text_surface, text_rect)
 
@@ -157,7 +186,6 @@ def set_window_pos(x, y):
 # -------------------------
 # Font Apple-like (con font embeddato)
 # -------------------------
-import sys, os
 def resource_path(relative_path):
     try:
         base_path = sys._MEIPASS
@@ -165,139 +193,396 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-try:
-    font = pygame.font.Font(resource_path("SF-Pro-Display-Regular.otf"), 28 * SUPERSAMPLE)
-except Exception as e:
-    print("Errore nel caricamento del font:", e)
-    font = pygame.font.SysFont("Arial", 28 * SUPERSAMPLE)
+font = None   # Caricato una sola volta da get_font()
+
+def get_font():
+    global font
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        try:
+            font = pygame.font.Font(resource_path("SF-Pro-Display-Regular.otf"), 28 * SUPERSAMPLE)
+        except Exception as e:
+            print("Errore nel caricamento del font:", e)
+            font = pygame.font.SysFont("Arial", 28 * SUPERSAMPLE)
+    return font
 
 # -------------------------
 # Socket UDP per i comandi
 # -------------------------
-udp_cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+udp_cmd_sock = None
+
+def command_socket():
+    global udp_cmd_sock
+    if udp_cmd_sock is None:
+        udp_cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return udp_cmd_sock
+
 def send_command(command):
     try:
-        udp_cmd_sock.sendto(command.encode('utf-8'), (UDP_IP, UDP_CMD_PORT))
+        command_socket().sendto(command.encode('utf-8'), (UDP_IP, UDP_CMD_PORT))
         print(f"Inviato comando: {command}")
     except Exception as e:
         print(f"Errore durante l'invio del comando: {e}")
 
 # -------------------------
-# Graph Data: Lista per i valori di position ricevuti via UDP
+# Graph Data: storico di torque e position ricevuti via UDP
 # -------------------------
-position_data = []       # Lista di valori interi (position)
-max_data_points = 100    # Numero massimo di punti visualizzati
-data_lock = threading.Lock()
+history_seconds = 60.0   # Secondi di storico visualizzati
+max_sample_rate = 2000   # Campioni/s massimi previsti (dimensiona il ring buffer)
+history = None           # MinMaxPyramid creata da configure_history()
+# Filtri chiesti al bridge (vedi FeedbackFilter): minimi e massimi ogni 10 ms
+# bastano al grafico e conservano i picchi; None per i campioni grezzi
+feedback_filter = "minmax:10"
+
+# Tracce del grafico: (campo, colore, intervallo dell'asse y; None = scala automatica)
+GRAPH_TRACES = [
+    ("torque", (220, 90, 60), None),
+    ("position", (0, 0, 0), (0, 100)),
+]
+
+def configure_history(seconds=history_seconds, rate=max_sample_rate):
+    """Prealloca lo storico per `seconds` secondi di dati a `rate` campioni/s."""
+    global history, history_seconds
+    history_seconds = seconds
+    history = MinMaxPyramid(max(2, int(seconds * rate)), fields=("torque", "position"))
+    return history
+
+def request_binary_feedback(sock):
+    """
+    Chiede al bridge il formato di feedback binario e i filtri (vedi
+    FeedbackProtocol). L'handshake parte dal socket del feedback: il bridge
+    negozia il formato per l'indirizzo da cui arriva HELLO.
+    """
+    try:
+        sock.sendto(hello_message(filter_spec=feedback_filter or "none"), (UDP_IP, UDP_CMD_PORT))
+    except Exception as e:
+        print(f"Errore durante l'invio dell'handshake: {e}")
 
 def udp_feedback_listener():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((UDP_IP, UDP_FEEDBACK_PORT))
     print(f"Ascolto dati UDP su {UDP_IP}:{UDP_FEEDBACK_PORT}")
+    decoder = FeedbackDecoder()
+    # Chiede al bridge il formato binario; se arrivano ancora datagrammi
+    # ASCII (bridge riavviato o datato) la richiesta viene ripetuta
+    request_binary_feedback(sock)
+    last_hello = time.monotonic()
     while True:
         try:
-            data, addr = sock.recvfrom(1024)
-            decoded = data.decode('utf-8').strip()
-            tokens = decoded.split()
-            if len(tokens) >= 2:
-                pos_value = int(tokens[1])
-            else:
-                pos_value = int(tokens[0])
-            with data_lock:
-                position_data.append(pos_value)
-                if len(position_data) > max_data_points:
-                    position_data.pop(0)
+            data, addr = sock.recvfrom(2048)
+            if data.startswith(CAPS_PREFIX.encode('ascii')):
+                # Risposta all'handshake, sullo stesso socket del feedback
+                continue
+            torques, positions, timestamps = decoder.decode_columns(data)
+            if decoder.ascii_datagrams and time.monotonic() - last_hello > 1.0:
+                request_binary_feedback(sock)
+                last_hello = time.monotonic()
+                decoder.ascii_datagrams = 0
+            # Unico produttore del ring buffer: nessun lock necessario
+            history.extend(timestamps, torque=torques, position=positions)
         except Exception as e:
             print("Errore nel listener UDP feedback:", e)
 
-def draw_graph(surface):
-    # Area grafico: più alto e posizionato più in basso
-    graph_rect = pygame.Rect(padding, R_HEIGHT - 140, R_WIDTH - 2 * padding, 120)
+def shm_feedback_listener(name):
+    """
+    Legge il feedback dalla memoria condivisa del bridge (--feedback-transport
+    shm|both): nessun socket sul percorso dei dati e nessun handshake.
+    """
+    from SharedFeedback import SharedFeedbackReader
+    reader = None
+    while reader is None:
+        try:
+            reader = SharedFeedbackReader(name)
+        except FileNotFoundError:
+            # Bridge non ancora avviato
+            time.sleep(0.5)
+    print(f"Lettura feedback dalla memoria condivisa {name}")
+    try:
+        # Dopo un riavvio del bridge il lettore si riallinea da solo
+        while True:
+            try:
+                if reader.wait(0.5):
+                    batch = reader.read_new()
+                    if len(batch):
+                        history.extend(batch.timestamp, torque=batch.torque, position=batch.position)
+            except Exception as e:
+                print("Errore nel listener del feedback condiviso:", e)
+                time.sleep(0.1)
+    finally:
+        # Libera lo slot di notifica nel segmento
+        reader.close()
+
+# Area grafico: più alto e posizionato più in basso
+graph_rect = pygame.Rect(padding, R_HEIGHT - 140, R_WIDTH - 2 * padding, 120)
+
+def draw_graph_panel(surface):
     draw_aa_rounded_rect(surface, graph_rect, (255, 255, 255), 10 * SUPERSAMPLE)
     pygame.draw.rect(surface, BORDER_COLOR, graph_rect, 2, border_radius=10 * SUPERSAMPLE)
-    
-    with data_lock:
-        data = position_data.copy()
-    if len(data) < 2:
+
+def draw_graph(surface, rect=graph_rect):
+    """
+    Disegna le tracce di GRAPH_TRACES nel rettangolo `rect` (pannello escluso).
+    Ogni colonna di pixel riceve al più un segmento verticale dal minimo al
+    massimo dei campioni che vi ricadono (vedi MinMaxPyramid.envelope).
+    """
+    columns, envelope = history.envelope(history_seconds, rect.width)
+    if len(columns) < 2:
         return
 
-    min_val = 0
-    max_val = 100
-    points = []
-    for i, value in enumerate(data):
-        clamped = max(min_val, min(value, max_val))
-        x = graph_rect.left + (i / (max_data_points - 1)) * graph_rect.width
-        y = graph_rect.bottom - 5 * SUPERSAMPLE - ((clamped - min_val) / (max_val - min_val)) * (graph_rect.height - 10 * SUPERSAMPLE)
-        points.append((int(x), int(y)))
-    
+    # L'asse x è il tempo, con il campione più recente sul bordo destro
+    xs = np.repeat(rect.left + columns, 2)
+    top = rect.top + 5 * SUPERSAMPLE
+    height = rect.height - 10 * SUPERSAMPLE
+
     old_clip = surface.get_clip()
-    surface.set_clip(graph_rect)
-    if len(points) >= 2:
-        pygame.draw.lines(surface, (0, 0, 0), False, points, 3)
+    surface.set_clip(rect)
+    for name, color, value_range in GRAPH_TRACES:
+        mins, maxs = envelope[name]
+        if value_range is None:
+            min_val, max_val = float(mins.min()), float(maxs.max())
+            if max_val - min_val < 1:
+                max_val = min_val + 1
+        else:
+            min_val, max_val = value_range
+        # Per ogni colonna i punti (minimo, massimo): la spezzata traccia l'inviluppo
+        values = np.column_stack((mins, maxs)).ravel()
+        clamped = np.clip(values, min_val, max_val)
+        ys = top + height - ((clamped - min_val) / (max_val - min_val)) * height
+        points = np.column_stack((xs, ys)).astype(np.int32)
+        pygame.draw.lines(surface, color, False, points.tolist(), 3)
     surface.set_clip(old_clip)
 
-def main():
+# -------------------------
+# Rendering retained-mode
+# -------------------------
+# Lo sfondo statico (finestra, controlli, pannello del grafico) e i pulsanti
+# in ogni stato vengono renderizzati una sola volta in supersampling e
+# ridotti alla risoluzione finale. A ogni frame si ricompongono solo le
+# regioni cambiate (pulsanti al cambio di hover/pressione, grafico all'arrivo
+# di nuovi dati); se nulla è cambiato il frame viene saltato.
+background_hi = None     # Sfondo statico ad alta risoluzione
+background = None        # Sfondo statico alla risoluzione finale
+button_sprites = {}      # (testo, stato) -> sprite alla risoluzione finale
+button_regions = {}      # testo -> regione della finestra finale occupata dal pulsante
+graph_region = None      # Regione (alta risoluzione) ricomposta per il grafico
+
+def aligned_region(rect):
+    """Allarga `rect` (alta risoluzione) a multipli di SUPERSAMPLE, così la riduzione è esatta."""
+    left = rect.left - rect.left % SUPERSAMPLE
+    top = rect.top - rect.top % SUPERSAMPLE
+    right = -(-rect.right // SUPERSAMPLE) * SUPERSAMPLE
+    bottom = -(-rect.bottom // SUPERSAMPLE) * SUPERSAMPLE
+    return pygame.Rect(left, top, right - left, bottom - top)
+
+def to_final(rect):
+    return pygame.Rect(rect.x // SUPERSAMPLE, rect.y // SUPERSAMPLE, rect.width // SUPERSAMPLE, rect.height // SUPERSAMPLE)
+
+def downscale(surface):
+    return pygame.transform.smoothscale(surface, (surface.get_width() // SUPERSAMPLE, surface.get_height() // SUPERSAMPLE))
+
+def build_assets():
+    """Renderizza sfondo e sprite dei pulsanti; le chiamate successive riusano quelli già pronti."""
+    global background_hi, background, graph_region
+    if background is not None:
+        return
+    background_hi = pygame.Surface((R_WIDTH, R_HEIGHT))
+    background_hi.fill(BACKGROUND_COLOR)
+    draw_window_controls(background_hi)
+    draw_graph_panel(background_hi)
+    background = downscale(background_hi)
+
+    shadow_offset = 3 * SUPERSAMPLE
+    for text, rect in (("Close", close_button_rect), ("Open", open_button_rect)):
+        region = aligned_region(rect.union(rect.move(shadow_offset, shadow_offset)))
+        button_regions[text] = to_final(region)
+        local_rect = rect.move(-region.x, -region.y)
+        for state in ("normal", "hover", "pressed"):
+            surface = background_hi.subsurface(region).copy()
+            draw_rounded_button(surface, local_rect, text, is_hovered=(state == "hover"), is_pressed=(state == "pressed"))
+            button_sprites[(text, state)] = downscale(surface)
+
+    graph_region = aligned_region(graph_rect)
+
+def button_state(is_hovered, is_pressed):
+    if is_pressed:
+        return "pressed"
+    return "hover" if is_hovered else "normal"
+
+def render_graph():
+    """Ricompone solo la regione del grafico e la restituisce alla risoluzione finale."""
+    surface = background_hi.subsurface(graph_region).copy()
+    draw_graph(surface, graph_rect.move(-graph_region.x, -graph_region.y))
+    return downscale(surface)
+
+class FrameStats:
+    """Tempi di rendering dei frame e frame saltati, stampati periodicamente."""
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.reset()
+        self.last_report = time.perf_counter()
+
+    def reset(self):
+        self.rendered = 0
+        self.skipped = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def frame(self, rendered, elapsed):
+        if rendered:
+            self.rendered += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+        else:
+            self.skipped += 1
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            mean = self.total_time / self.rendered * 1000 if self.rendered else 0.0
+            print(f"Frame: {self.rendered} renderizzati, {self.skipped} saltati, "
+                  f"tempo medio {mean:.2f} ms, max {self.max_time * 1000:.2f} ms")
+            self.reset()
+            self.last_report = now
+
+# Eventi che richiedono di ridisegnare tutta la finestra
+EXPOSE_EVENTS = {getattr(pygame, name) for name in ("VIDEOEXPOSE", "WINDOWEXPOSED", "WINDOWRESTORED", "WINDOWSHOWN")
+                 if hasattr(pygame, name)}
+
+class Renderer:
+    """
+    Compone i frame sulla finestra finale: ridisegna solo pulsanti e grafico
+    quando cambiano, tutto dopo invalidate() (es. finestra riesposta).
+    """
+    def __init__(self, target):
+        build_assets()
+        self.target = target
+        self.full_redraw = True
+        self.last_buttons = None
+        self.last_data_version = None
+
+    def invalidate(self):
+        self.full_redraw = True
+
+    def frame(self, mouse_pos, mouse_pressed):
+        """Aggiorna la finestra; restituisce le regioni ridisegnate (vuota se il frame è saltato)."""
+        # Per i pulsanti, usiamo le coordinate scalate
+        scaled_mouse_pos = (mouse_pos[0] * SUPERSAMPLE, mouse_pos[1] * SUPERSAMPLE)
+        close_hover = close_button_rect.collidepoint(scaled_mouse_pos)
+        open_hover = open_button_rect.collidepoint(scaled_mouse_pos)
+        buttons = {
+            "Close": button_state(close_hover, close_hover and mouse_pressed),
+            "Open": button_state(open_hover, open_hover and mouse_pressed),
+        }
+        current_data_version = history.count
+
+        dirty = []
+        if self.full_redraw:
+            self.target.blit(background, (0, 0))
+        if self.full_redraw or buttons != self.last_buttons:
+            for text, state in buttons.items():
+                region = button_regions[text]
+                self.target.blit(button_sprites[(text, state)], region)
+                dirty.append(region)
+            self.last_buttons = buttons
+        if self.full_redraw or current_data_version != self.last_data_version:
+            region = to_final(graph_region)
+            self.target.blit(render_graph(), region)
+            dirty.append(region)
+            self.last_data_version = current_data_version
+
+        if self.full_redraw:
+            pygame.display.flip()
+        elif dirty:
+            pygame.display.update(dirty)
+        self.full_redraw = False
+        return dirty
+
+def handle_event(event, renderer):
+    """Gestisce un evento di input; restituisce False se la finestra va chiusa."""
     global dragging, drag_offset
+    if event.type == pygame.QUIT:
+        return False
+
+    if event.type in EXPOSE_EVENTS:
+        renderer.invalidate()
+
+    if handle_window_controls_event(event):
+        renderer.invalidate()
+        return True
+
+    if event.type == pygame.MOUSEBUTTONUP:
+        dragging = False
+        # Per i pulsanti, convertiamo le coordinate per il rendering ad alta risoluzione
+        scaled_pos = (event.pos[0] * SUPERSAMPLE, event.pos[1] * SUPERSAMPLE)
+        if close_button_rect.collidepoint(scaled_pos):
+            send_command("CLOSE")
+        elif open_button_rect.collidepoint(scaled_pos):
+            send_command("OPEN")
+
+    if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+        # Per collisioni, usiamo le coordinate scalate; per il drag usiamo quelle originali
+        scaled_pos = (event.pos[0] * SUPERSAMPLE, event.pos[1] * SUPERSAMPLE)
+        if not (close_button_rect.collidepoint(scaled_pos) or
+                open_button_rect.collidepoint(scaled_pos) or
+                is_point_in_circle(scaled_pos, control_red_center, CONTROL_RADIUS) or
+                is_point_in_circle(scaled_pos, control_yellow_center, CONTROL_RADIUS)):
+            # Usa event.pos (non scalato) per il drag
+            drag_offset = event.pos
+            dragging = True
+
+    if event.type == pygame.MOUSEMOTION and dragging and sys.platform == "win32":
+        global_cursor = get_cursor_pos()
+        new_x = global_cursor[0] - drag_offset[0]
+        new_y = global_cursor[1] - drag_offset[1]
+        set_window_pos(new_x, new_y)
+    return True
+
+def start_feedback_listener(transport="udp", shm_name="sixthfinger_feedback"):
+    """Avvia il thread che riempie `history` dal bridge."""
+    if transport == "shm":
+        thread = threading.Thread(target=shm_feedback_listener, args=(shm_name,), daemon=True)
+    else:
+        thread = threading.Thread(target=udp_feedback_listener, daemon=True)
+    thread.start()
+    return thread
+
+def main(argv=None):
+    global feedback_filter
+    parser = argparse.ArgumentParser(description="GUI SixthFinger")
+    parser.add_argument("--frame-stats", action="store_true", help="stampa periodicamente i tempi di rendering")
+    parser.add_argument("--history", type=float, default=history_seconds, help="secondi di storico nel grafico")
+    parser.add_argument("--max-rate", type=float, default=max_sample_rate,
+                        help="campioni/s massimi previsti (dimensiona lo storico)")
+    parser.add_argument("--transport", choices=("udp", "shm"), default="udp",
+                        help="riceve il feedback via UDP (default) o dalla memoria condivisa del bridge")
+    parser.add_argument("--shm-name", default="sixthfinger_feedback",
+                        help="nome del segmento di memoria condivisa")
+    parser.add_argument("--feedback-filter", default=feedback_filter,
+                        help="filtri chiesti al bridge per il feedback UDP ('none': campioni grezzi)")
+    parser.add_argument("--headless", action="store_true",
+                        help="nessuna finestra (driver video SDL dummy), es. per test senza display")
+    args = parser.parse_args(argv)
+    feedback_filter = args.feedback_filter
+    configure_history(args.history, args.max_rate)
+
+    renderer = Renderer(init_display(args.headless))
     clock = pygame.time.Clock()
     running = True
+    stats = FrameStats() if args.frame_stats else None
 
-    udp_feedback_thread = threading.Thread(target=udp_feedback_listener, daemon=True)
-    udp_feedback_thread.start()
+    start_feedback_listener(args.transport, args.shm_name)
 
     while running:
-        render_surface.fill(BACKGROUND_COLOR)
-        draw_window_controls(render_surface)
-
         mouse_pos = pygame.mouse.get_pos()  # Coordinate della finestra finale (non scalate)
         mouse_pressed = pygame.mouse.get_pressed()[0]
 
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+            if not handle_event(event, renderer):
                 running = False
 
-            if handle_window_controls_event(event):
-                continue
-
-            if event.type == pygame.MOUSEBUTTONUP:
-                dragging = False
-                # Per i pulsanti, convertiamo le coordinate per il render_surface
-                scaled_pos = (event.pos[0] * SUPERSAMPLE, event.pos[1] * SUPERSAMPLE)
-                if close_button_rect.collidepoint(scaled_pos):
-                    send_command("CLOSE")
-                elif open_button_rect.collidepoint(scaled_pos):
-                    send_command("OPEN")
-
-            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                # Per collisioni, usiamo le coordinate scalate; per il drag usiamo quelle originali
-                scaled_pos = (event.pos[0] * SUPERSAMPLE, event.pos[1] * SUPERSAMPLE)
-                if not (close_button_rect.collidepoint(scaled_pos) or 
-                        open_button_rect.collidepoint(scaled_pos) or
-                        is_point_in_circle(scaled_pos, control_red_center, CONTROL_RADIUS) or
-                        is_point_in_circle(scaled_pos, control_yellow_center, CONTROL_RADIUS)):
-                    # Usa event.pos (non scalato) per il drag
-                    drag_offset = event.pos
-                    dragging = True
-
-            if event.type == pygame.MOUSEMOTION and dragging and sys.platform == "win32":
-                global_cursor = get_cursor_pos()
-                new_x = global_cursor[0] - drag_offset[0]
-                new_y = global_cursor[1] - drag_offset[1]
-                set_window_pos(new_x, new_y)
-
-        # Per i pulsanti, usiamo le coordinate scalate
-        scaled_mouse_pos = (mouse_pos[0] * SUPERSAMPLE, mouse_pos[1] * SUPERSAMPLE)
-        close_hover = close_button_rect.collidepoint(scaled_mouse_pos)
-        open_hover = open_button_rect.collidepoint(scaled_mouse_pos)
-        close_pressed = close_hover and mouse_pressed
-        open_pressed = open_hover and mouse_pressed
-
-        draw_rounded_button(render_surface, close_button_rect, "Close", is_hovered=close_hover, is_pressed=close_pressed)
-        draw_rounded_button(render_surface, open_button_rect, "Open", is_hovered=open_hover, is_pressed=open_pressed)
-
-        draw_graph(render_surface)
-
-        final_surface = pygame.transform.smoothscale(render_surface, (WIDTH, HEIGHT))
-        screen.blit(final_surface, (0, 0))
-        pygame.display.flip()
+        frame_start = time.perf_counter()
+        dirty = renderer.frame(mouse_pos, mouse_pressed)
+        if stats is not None:
+            stats.frame(bool(dirty), time.perf_counter() - frame_start)
         clock.tick(30)
 
     pygame.quit()
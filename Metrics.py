@@ -0,0 +1,456 @@
+"""
+Metriche del bridge: contatori, gauge e istogrammi di latenza.
+
+Le metriche sono pensate per essere aggiornate dai thread caldi (reader
+seriale, listener UDP, loop di controllo) senza lock globali: ogni thread
+scrive in una propria cella (threading.local) e solo la lettura
+(snapshot) somma le celle. Il lock di una metrica serve solo la prima
+volta che un thread la usa.
+
+Gli istogrammi usano bucket log-lineari in stile HDR: errore relativo
+massimo ~3% su tutto l'intervallo (da 1 µs a ore), memoria fissa.
+
+Esposizione:
+  - StatsEndpoint: endpoint UDP locale; "STATS" restituisce lo snapshot
+    JSON, "PROFILE ON|OFF" attiva o ferma il profiler, "PROFILE" ne
+    restituisce il report
+  - SnapshotDumper: accoda periodicamente lo snapshot a un file JSON lines
+
+Esempi:
+    python Metrics.py stats --port 5007
+    python Metrics.py profile on
+"""
+import argparse
+import collections
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from ConsoleLog import get_logger
+
+log = get_logger("Metrics")
+
+UDP_IP = "127.0.0.1"
+UDP_STATS_PORT = 5007
+
+
+class Counter:
+    """Contatore monotono; inc() scrive solo nella cella del thread chiamante."""
+    kind = "counter"
+
+    def __init__(self, name):
+        self.name = name
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        cell = [0]
+        with self._lock:
+            self._cells.append(cell)
+        self._local.cell = cell
+        return cell
+
+    def inc(self, n=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[0] += n
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells))
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Valore istantaneo (l'ultima scrittura vince) oppure calcolato da `fn` alla lettura."""
+    kind = "gauge"
+
+    def __init__(self, name, fn=None):
+        self.name = name
+        self.fn = fn
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception as e:
+                return f"errore: {e}"
+        return self.value
+
+
+# Bucket log-lineari: SUB_BUCKETS bucket lineari per ogni potenza di 2
+SUB_BITS = 6
+SUB_BUCKETS = 1 << SUB_BITS
+HALF_BUCKETS = SUB_BUCKETS // 2
+MAX_EXPONENT = 40   # 2^45 µs ~ 1 anno
+
+
+def bucket_index(value):
+    """Indice del bucket per un valore intero non negativo (µs)."""
+    if value < SUB_BUCKETS:
+        return value
+    shift = min(value.bit_length() - SUB_BITS, MAX_EXPONENT)
+    return SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + min(value >> shift, SUB_BUCKETS - 1) - HALF_BUCKETS
+
+
+def bucket_bounds(index):
+    """Intervallo [basso, alto) di valori (µs) del bucket `index`."""
+    if index < SUB_BUCKETS:
+        return index, index + 1
+    shift = (index - SUB_BUCKETS) // HALF_BUCKETS + 1
+    mantissa = (index - SUB_BUCKETS) % HALF_BUCKETS + HALF_BUCKETS
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+N_BUCKETS = SUB_BUCKETS + MAX_EXPONENT * HALF_BUCKETS
+
+
+class Histogram:
+    """
+    Istogramma di durate in secondi (risoluzione 1 µs), bucket log-lineari.
+    record() scrive solo nella cella del thread chiamante.
+    """
+    kind = "histogram"
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, name):
+        self.name = name
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        # [conteggi per bucket, somma (s), minimo (s), massimo (s)]
+        cell = [[0] * N_BUCKETS, 0.0, None, None]
+        with self._lock:
+            self._cells.append(cell)
+        self._local.cell = cell
+        return cell
+
+    def record(self, seconds):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        micros = int(seconds * 1e6)
+        cell[0][bucket_index(micros if micros > 0 else 0)] += 1
+        cell[1] += seconds
+        if cell[2] is None or seconds < cell[2]:
+            cell[2] = seconds
+        if cell[3] is None or seconds > cell[3]:
+            cell[3] = seconds
+
+    def time(self):
+        """Context manager che registra la durata del blocco."""
+        return _Timer(self)
+
+    def snapshot(self):
+        counts = [0] * N_BUCKETS
+        total = 0.0
+        low = high = None
+        for cell in list(self._cells):
+            for i, c in enumerate(cell[0]):
+                if c:
+                    counts[i] += c
+            total += cell[1]
+            if cell[2] is not None and (low is None or cell[2] < low):
+                low = cell[2]
+            if cell[3] is not None and (high is None or cell[3] > high):
+                high = cell[3]
+        count = sum(counts)
+        result = {"count": count, "mean_ms": _ms(total / count) if count else None,
+                  "min_ms": _ms(low), "max_ms": _ms(high)}
+        for pct in self.PERCENTILES:
+            result[f"p{pct:g}_ms"] = _ms(_percentile(counts, count, pct))
+        return result
+
+
+def _percentile(counts, count, pct):
+    if not count:
+        return None
+    rank = max(1, int(round(pct / 100.0 * count)))
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= rank:
+            low, high = bucket_bounds(i)
+            return (low + high - 1) / 2 / 1e6
+    return None
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000.0, 3)
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+    """Registro delle metriche per nome; la creazione è idempotente."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _get(self, cls, name, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = cls(name, *args)
+                    self._metrics[name] = metric
+        if not isinstance(metric, cls):
+            raise ValueError(f"La metrica {name} esiste già come {metric.kind}")
+        return metric
+
+    def counter(self, name):
+        return self._get(Counter, name)
+
+    def gauge(self, name, fn=None):
+        gauge = self._get(Gauge, name)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name):
+        return self._get(Histogram, name)
+
+    def snapshot(self):
+        metrics = {name: metric.snapshot() for name, metric in sorted(self._metrics.items())}
+        return {"timestamp": time.time(), "uptime_s": round(time.time() - self.started, 3), "metrics": metrics}
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name):
+    return REGISTRY.counter(name)
+
+
+def gauge(name, fn=None):
+    return REGISTRY.gauge(name, fn)
+
+
+def histogram(name):
+    return REGISTRY.histogram(name)
+
+
+class SamplingProfiler:
+    """
+    Profiler a campionamento per i thread osservati (es. il reader seriale).
+
+    Quando è attivo, un thread in background legge ogni `interval` secondi
+    lo stack corrente dei thread registrati con watch_current_thread() e
+    conta gli stack collassati ("file:funzione;..."). Spento non costa
+    nulla oltre al controllo di `enabled` nel percorso caldo.
+    """
+    def __init__(self, interval=0.001, max_depth=32):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.enabled = False
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._threads = set()
+        self._thread = None
+
+    def watch_current_thread(self):
+        self._threads.add(threading.get_ident())
+
+    def start(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        log.info("Profiler a campionamento attivo (intervallo %.1f ms)", self.interval * 1000)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        log.info("Profiler fermato: %s campioni", self.samples)
+
+    def reset(self):
+        self.samples = 0
+        self.stacks.clear()
+
+    def _run(self):
+        while self.enabled:
+            frames = sys._current_frames()
+            for ident in list(self._threads):
+                frame = frames.get(ident)
+                if frame is None:
+                    self._threads.discard(ident)
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def report(self, top=20):
+        return {
+            "enabled": self.enabled,
+            "samples": self.samples,
+            "top": [{"stack": stack, "samples": n} for stack, n in self.stacks.most_common(top)],
+        }
+
+
+PROFILER = SamplingProfiler()
+
+
+class StatsEndpoint:
+    """
+    Endpoint UDP locale per le metriche. Comandi (una riga per datagramma):
+      STATS            -> snapshot JSON
+      PROFILE          -> report JSON del profiler
+      PROFILE ON|OFF   -> attiva/ferma il profiler
+      PROFILE RESET    -> azzera i campioni del profiler
+    """
+    def __init__(self, registry=REGISTRY, profiler=PROFILER, addr=(UDP_IP, UDP_STATS_PORT)):
+        self.registry = registry
+        self.profiler = profiler
+        self.addr = addr
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(self.addr)
+        self._thread = threading.Thread(target=self._run, name="stats", daemon=True)
+        self._thread.start()
+        log.info("Metriche disponibili su %s:%s (UDP, comando STATS)", self.addr[0], self.addr[1])
+        return self
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def handle(self, command):
+        tokens = command.strip().upper().split()
+        if not tokens or tokens[0] == "STATS":
+            return self.registry.snapshot()
+        if tokens[0] == "PROFILE":
+            action = tokens[1] if len(tokens) > 1 else ""
+            if action == "ON":
+                self.profiler.start()
+            elif action == "OFF":
+                self.profiler.stop()
+            elif action == "RESET":
+                self.profiler.reset()
+            return self.profiler.report()
+        return {"error": f"comando sconosciuto: {command.strip()}"}
+
+    def _run(self):
+        sock = self._sock
+        while True:
+            try:
+                data, addr = sock.recvfrom(1024)
+            except OSError:
+                return
+            try:
+                reply = self.handle(data.decode('utf-8', errors='replace'))
+                sock.sendto(json.dumps(reply).encode('utf-8'), addr)
+            except Exception as e:
+                log.error("Errore nell'endpoint delle metriche: %s", e)
+
+
+class SnapshotDumper:
+    """Accoda lo snapshot delle metriche a `path` (una riga JSON) ogni `interval` secondi."""
+    def __init__(self, path, interval=10.0, registry=REGISTRY, profiler=PROFILER):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.profiler = profiler
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stats-dump", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        self.dump()
+
+    def dump(self):
+        snapshot = self.registry.snapshot()
+        if self.profiler.samples:
+            snapshot["profile"] = self.profiler.report(top=10)
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(snapshot) + "\n")
+        except OSError as e:
+            log.error("Errore nella scrittura dello snapshot delle metriche: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+
+def query(command="STATS", addr=(UDP_IP, UDP_STATS_PORT), timeout=1.0):
+    """Invia un comando all'endpoint delle metriche e restituisce la risposta JSON."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(command.encode('utf-8'), addr)
+        data, _ = sock.recvfrom(65535)
+    finally:
+        sock.close()
+    return json.loads(data.decode('utf-8'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Interroga l'endpoint delle metriche del bridge")
+    parser.add_argument("command", choices=("stats", "profile"), nargs="?", default="stats")
+    parser.add_argument("action", nargs="?", choices=("on", "off", "reset"), default=None,
+                        help="con profile: attiva, ferma o azzera il profiler")
+    parser.add_argument("--port", type=int, default=UDP_STATS_PORT)
+    args = parser.parse_args(argv)
+    command = args.command.upper() + (f" {args.action.upper()}" if args.action else "")
+    try:
+        reply = query(command, (UDP_IP, args.port))
+    except socket.timeout:
+        print(f"Nessuna risposta da {UDP_IP}:{args.port}: il bridge è avviato con le metriche attive?")
+        return 1
+    print(json.dumps(reply, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Bridge multi-dongle: apre in un solo processo tutti i dongle noti
+(feedback, input, robot) trovati con un'unica enumerazione delle porte,
+con un ReaderThread per porta e una coppia di porte UDP per dispositivo.
+
+I dongle feedback e input usano lo stesso framing '$' a 11 byte del robot;
+il comando di velocità '$VS***' viene inviato solo al robot. Ogni porta è
+gestita da una SerialSession, quindi un dongle scollegato viene riaperto
+senza fermare gli altri.
+"""
+import argparse
+import socket
+import threading
+import time
+
+from BridgeCore import (COMMAND_RECV_ERRORS, UDP_IP, command_ack_sender, handle_control, submit_command,
+                        write_pending_commands)
+from COMDeviceManager import COMDeviceManager, PORT_PROFILES
+from CommandQueue import CommandQueue
+from FeedbackFanout import FeedbackFanout
+from ConsoleLog import LEVELS, get_logger, setup_logging, shutdown_logging
+from FeedbackFilter import parse_pipeline
+from FeedbackProtocol import FeedbackPublisher
+from PacketFramer import FRAME_CHECKS
+from SerialSession import SerialSession
+
+# Porte UDP (comandi, feedback) per ciascun tipo di dongle.
+# Il robot mantiene le porte storiche 5005/5006 usate dalla GUI.
+DEVICE_UDP_PORTS = {
+    "robot": (5005, 5006),
+    "feedback": (5015, 5016),
+    "input": (5025, 5026),
+}
+
+log = get_logger("MultiDongleBridge")
+
+
+class DongleBridge:
+    """
+    Sessione di un singolo dongle: lettura seriale adattiva (vedi SerialReader,
+    supervisionata da SerialSession), inoltro del feedback sulla sua porta UDP e listener dei comandi sulla
+    sua porta comandi. I comandi passano da una CommandQueue per dongle
+    (coalescenza, precedenza di STOP, conferme ACK/NAK) e i messaggi di
+    controllo (HELLO, SUBSCRIBE, UNSUBSCRIBE) da handle_control, con una
+    FeedbackFanout per dongle, come nel bridge a dongle singolo.
+    Tiene statistiche di throughput e scarti.
+    """
+    def __init__(self, dongle_type, cmd_port, feedback_port, comport=None, profile=None, spec=None,
+                 feedback_filter=None):
+        self.dongle_type = dongle_type
+        self.session = SerialSession(dongle_type, self._batch_received, comport=comport,
+                                     send_velocity=(dongle_type == "robot"), profile=profile,
+                                     spec=spec)
+        self.cmd_port = cmd_port
+        self.feedback_port = feedback_port
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.publisher = FeedbackPublisher(self.udp_sock, (UDP_IP, feedback_port), default_filter=feedback_filter)
+        self.commands = CommandQueue()
+        self.fanout = FeedbackFanout(name=dongle_type)
+        self.samples = 0
+        self.commands_written = 0
+        self.last_sample = None
+        self._cmd_sock = None
+        self._cmd_thread = None
+        self._running = False
+
+    def _batch_received(self, batch):
+        self.samples += len(batch)
+        self.last_sample = batch.last()
+        self.publisher.publish(batch)
+        self.fanout.publish(batch)
+        if len(batch):
+            self.commands.feedback(self.last_sample[1])
+
+    def start(self):
+        self._running = True
+        self.fanout.start()
+        self.session.start()
+
+        self._cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._cmd_sock.bind((UDP_IP, self.cmd_port))
+        # Timeout breve: il listener fa scadere anche le conferme dei comandi
+        self._cmd_sock.settimeout(0.1)
+        self.commands.ack = command_ack_sender(self._cmd_sock)
+        self._cmd_thread = threading.Thread(target=self._command_listener, daemon=True)
+        self._cmd_thread.start()
+        log.info("[%s] comandi su %s:%s, feedback su %s:%s", self.dongle_type, UDP_IP, self.cmd_port, UDP_IP, self.feedback_port)
+
+    def stop(self):
+        self._running = False
+        self.session.stop()
+        if self._cmd_thread is not None:
+            self._cmd_thread.join(timeout=1.0)
+        if self._cmd_sock is not None:
+            self._cmd_sock.close()
+        self.fanout.stop()
+        self.udp_sock.close()
+
+    @property
+    def connected(self):
+        return self.session.connected.is_set()
+
+    def _command_listener(self):
+        while self._running:
+            self.commands.expire()
+            try:
+                data, addr = self._cmd_sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self._cmd_sock.fileno() == -1:
+                    return
+                # Es. ICMP "port unreachable" di una conferma a un client già chiuso
+                COMMAND_RECV_ERRORS.inc()
+                log.debug("[%s] Errore nella ricezione dei comandi UDP: %s", self.dongle_type, e)
+                continue
+            try:
+                cmd = data.decode('utf-8').strip()
+                reply = handle_control(cmd, addr, self.publisher, self.fanout)
+                if reply is not None:
+                    self._cmd_sock.sendto(reply, addr)
+                    continue
+                if submit_command(cmd, addr, self.commands, self._cmd_sock.sendto):
+                    self.commands_written += write_pending_commands(self.session, self.commands)
+            except Exception as e:
+                log.error("[%s] Errore nel listener UDP: %s", self.dongle_type, e)
+
+    def stats(self):
+        session = self.session.stats()
+        return {
+            "dongle_type": self.dongle_type,
+            "port": session["port"],
+            "connected": session["connected"],
+            "reconnects": session["reconnects"],
+            "samples": self.samples,
+            "commands_written": self.commands_written,
+            "bytes_dropped": session["bytes_dropped"],
+            "resyncs": session["resyncs"],
+            "frames_rejected": session["frames_rejected"],
+            "datagrams_sent": self.publisher.datagrams_sent,
+            "send_errors": self.publisher.send_errors,
+        }
+
+
+def open_all_dongles(ports=None, profile=None, spec=None, feedback_filter=None):
+    """
+    Prepara un DongleBridge per ogni dongle. `ports` ({tipo: porta})
+    sostituisce la ricerca automatica, altrimenti i dongle presenti sono
+    scoperti con una sola enumerazione e, dopo uno scollegamento, ritrovati
+    per tipo anche se la porta cambia.
+    """
+    fixed = bool(ports)
+    if not fixed:
+        ports = COMDeviceManager.discover_all_com_devices()
+    bridges = []
+    for dongle_type, comport in ports.items():
+        if dongle_type not in DEVICE_UDP_PORTS:
+            log.warning("Tipo di dongle sconosciuto: %s", dongle_type)
+            continue
+        cmd_port, feedback_port = DEVICE_UDP_PORTS[dongle_type]
+        bridges.append(DongleBridge(dongle_type, cmd_port, feedback_port, comport if fixed else None, profile,
+                                    spec, feedback_filter))
+    return bridges
+
+
+def print_stats(bridges, previous, elapsed):
+    for bridge in bridges:
+        stats = bridge.stats()
+        rate = (stats["samples"] - previous.get(bridge.dongle_type, 0)) / elapsed if elapsed > 0 else 0.0
+        previous[bridge.dongle_type] = stats["samples"]
+        state = "OK" if stats["connected"] else "DISCONNESSO"
+        log.info("[%s] %s %s: %.0f campioni/s, scartati %s byte e %s pacchetti, resync %s, errori UDP %s, "
+                 "riconnessioni %s",
+                 stats['dongle_type'], stats['port'], state, rate, stats['bytes_dropped'], stats['frames_rejected'],
+                 stats['resyncs'], stats['send_errors'], stats['reconnects'])
+
+
+def parse_ports(values):
+    ports = {}
+    for value in values or []:
+        dongle_type, _, comport = value.partition("=")
+        if not comport:
+            raise argparse.ArgumentTypeError(f"Formato atteso tipo=porta, ricevuto: {value}")
+        ports[dongle_type] = comport
+    return ports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bridge UDP <-> seriale per tutti i dongle SixthFinger")
+    parser.add_argument("--port", action="append", metavar="TIPO=PORTA",
+                        help="porta di un dongle (es. robot=COM5), ripetibile; disattiva la ricerca automatica")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="intervallo di stampa statistiche (s)")
+    parser.add_argument("--dongles-config", default=None,
+                        help="file JSON con i numeri di serie dei dongle (sostituisce la tabella interna)")
+    parser.add_argument("--log-level", choices=tuple(LEVELS), default="info",
+                        help="livello dei messaggi sulla console (off: nessun output)")
+    parser.add_argument("--serial-profile", choices=tuple(PORT_PROFILES), default="default",
+                        help="impostazioni delle porte e dei reader (vedi COMDeviceManager.PortProfile)")
+    parser.add_argument("--frame-check", choices=tuple(FRAME_CHECKS), default="format",
+                        help="validazione dei pacchetti (vedi PacketFramer.FRAME_CHECKS)")
+    parser.add_argument("--feedback-filter", default=None, metavar="FILTRI",
+                        help="filtri del feedback dei consumer che non li scelgono con HELLO (vedi FeedbackFilter)")
+    args = parser.parse_args(argv)
+    try:
+        parse_pipeline(args.feedback_filter)
+    except ValueError as e:
+        parser.error(f"--feedback-filter: {e}")
+    setup_logging(args.log_level)
+    if args.dongles_config:
+        COMDeviceManager.load_serial_table(args.dongles_config)
+
+    bridges = open_all_dongles(parse_ports(args.port), PORT_PROFILES[args.serial_profile],
+                                FRAME_CHECKS[args.frame_check], args.feedback_filter)
+    if not bridges:
+        log.warning("Nessun dongle trovato.")
+        shutdown_logging()
+        return
+    for bridge in bridges:
+        bridge.start()
+
+    previous = {}
+    last = time.perf_counter()
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            now = time.perf_counter()
+            print_stats(bridges, previous, now - last)
+            last = now
+    except KeyboardInterrupt:
+        log.info("Terminazione tramite KeyboardInterrupt.")
+    finally:
+        for bridge in bridges:
+            bridge.stop()
+        log.info("Chiusura degli endpoint UDP.")
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
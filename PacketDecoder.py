@@ -0,0 +1,112 @@
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale: si usa il percorso pure-Python
+    np = None
+
+# Posizioni delle cifre nel pacchetto '$ttt_ppp...'
+TORQUE_COLS = (1, 2, 3)
+POSITION_COLS = (5, 6, 7)
+# Lunghezza del pacchetto di default; il passo effettivo viene dallo spec
+# del framer (vedi check_layout)
+PACKET_LENGTH = 11
+
+if np is not None:
+    SAMPLE_DTYPE = np.dtype([('torque', '<i2'), ('position', '<i2'), ('timestamp', '<f8')])
+    _DIGIT_COLS = np.array(TORQUE_COLS + POSITION_COLS, dtype=np.intp)
+    _WEIGHTS = np.array([100, 10, 1], dtype=np.int16)
+else:
+    SAMPLE_DTYPE = None
+
+
+class SampleBatch:
+    """
+    Blocco di campioni decodificati (torque, position, timestamp host).
+    Con NumPy i campioni sono un array strutturato (`records`), altrimenti
+    tre array.array compatti. In entrambi i casi `torque`, `position` e
+    `timestamp` sono sequenze indicizzabili della stessa lunghezza.
+    `velocity` è presente solo nei blocchi filtrati che la calcolano (vedi
+    FeedbackFilter), altrimenti è None.
+    """
+    def __init__(self, torque, position, timestamp, records=None, velocity=None):
+        self.torque = torque
+        self.position = position
+        self.timestamp = timestamp
+        self.records = records
+        self.velocity = velocity
+
+    @classmethod
+    def from_records(cls, records):
+        return cls(records['torque'], records['position'], records['timestamp'], records)
+
+    def __len__(self):
+        return len(self.torque)
+
+    def __iter__(self):
+        """Itera sulle tuple (torque, position, timestamp)."""
+        return zip(self.torque, self.position, self.timestamp)
+
+    def last(self):
+        """Ultimo campione del blocco come tupla di interi/float Python."""
+        return int(self.torque[-1]), int(self.position[-1]), float(self.timestamp[-1])
+
+
+def check_layout(spec):
+    """
+    Verifica che i pacchetti descritti da `spec` (PacketFramer.PacketSpec)
+    abbiano le cifre di torque e position nelle colonne TORQUE_COLS e
+    POSITION_COLS; solleva ValueError altrimenti. Restituisce la lunghezza
+    del pacchetto, da passare a decode_batch.
+    """
+    columns = TORQUE_COLS + POSITION_COLS
+    if spec.length <= max(columns):
+        raise ValueError(f"pacchetti di {spec.length} byte troppo corti per le colonne {columns}")
+    if spec.frame_format is not None and any(spec.frame_format[c] != "d" for c in columns):
+        raise ValueError(f"il formato {spec.frame_format} non ha cifre nelle colonne {columns}")
+    return spec.length
+
+
+def _decode_numpy(buffer, offsets, timestamp, length):
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    n = len(offsets)
+    first = offsets[0]
+    if offsets[-1] - first == (n - 1) * length:
+        # Caso comune: pacchetti contigui, vista strided senza copie
+        frames = np.lib.stride_tricks.as_strided(
+            raw[first:], shape=(n, length), strides=(length, 1), writeable=False)
+        digits = frames[:, _DIGIT_COLS]
+    else:
+        digits = raw[np.asarray(offsets, dtype=np.intp)[:, None] + _DIGIT_COLS]
+    digits = digits.astype(np.int16) - ord('0')
+    records = np.empty(n, dtype=SAMPLE_DTYPE)
+    records['torque'] = digits[:, 0:3] @ _WEIGHTS
+    records['position'] = digits[:, 3:6] @ _WEIGHTS
+    records['timestamp'] = timestamp
+    return SampleBatch.from_records(records)
+
+
+def _decode_python(buffer, offsets, timestamp):
+    zero = ord('0') * 111
+    torque = array('h', [buffer[o + 1] * 100 + buffer[o + 2] * 10 + buffer[o + 3] - zero for o in offsets])
+    position = array('h', [buffer[o + 5] * 100 + buffer[o + 6] * 10 + buffer[o + 7] - zero for o in offsets])
+    return SampleBatch(torque, position, array('d', [timestamp]) * len(offsets))
+
+
+def decode_batch(buffer, offsets, timestamp=None, use_numpy=True, length=PACKET_LENGTH):
+    """
+    Decodifica insieme tutti i pacchetti di un blocco.
+      - buffer: buffer con i byte grezzi (bytes, bytearray o memoryview)
+      - offsets: posizioni di inizio dei pacchetti nel buffer
+      - timestamp: istante di ricezione (time.time()) assegnato ai campioni
+      - length: lunghezza dei pacchetti (vedi check_layout)
+    Restituisce una SampleBatch.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    if not offsets:
+        return SampleBatch(array('h'), array('h'), array('d'))
+    if use_numpy and np is not None:
+        return _decode_numpy(buffer, offsets, timestamp, length)
+    return _decode_python(buffer, offsets, timestamp)
@@ -0,0 +1,304 @@
+import re
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale: il checksum si verifica pacchetto per pacchetto
+    np = None
+
+# Classi di byte usabili nei formati dei pacchetti (vedi PacketSpec)
+DIGITS = b"0123456789"
+HEX_DIGITS = b"0123456789ABCDEF"
+ALL_BYTES = bytes(range(256))
+
+# Formato del pacchetto di feedback: '$', torque (3 cifre), separatore,
+# position (3 cifre), 3 byte di coda. Separatore e coda non sono
+# specificati dal firmware: si accetta qualsiasi byte tranne lo start byte
+FEEDBACK_FORMAT = "$ddd?ddd???"
+# Sotto questo numero di pacchetti contigui il checksum in blocco (NumPy) costa più di quello per pacchetto
+BATCH_CHECKSUM_MIN_PACKETS = 32
+# Firmware con CRC: gli ultimi due byte sono il CRC-8 dei byte 1..8 in esadecimale (es. '$123_456*A7')
+FEEDBACK_CRC8_FORMAT = "$ddd?ddd?hh"
+
+
+def _crc8_table(poly=0x07):
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    """CRC-8 (polinomio 0x07, valore iniziale 0) calcolato con tabella."""
+    crc = 0
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+def crc8_hex_checksum(packet):
+    """Checksum per FEEDBACK_CRC8_FORMAT: i byte 1..8 devono avere il CRC-8 scritto nei byte 9-10."""
+    return int(bytes(packet[9:11]), 16) == crc8(packet[1:9])
+
+
+if np is not None:
+    _CRC8_TABLE_NP = np.frombuffer(CRC8_TABLE, dtype=np.uint8)
+    # Valore di una cifra esadecimale maiuscola (il formato garantisce già il carattere)
+    _HEX_VALUES = np.zeros(256, dtype=np.uint8)
+    _HEX_VALUES[np.frombuffer(HEX_DIGITS, dtype=np.uint8)] = np.arange(16, dtype=np.uint8)
+
+
+def crc8_hex_batch_checksum(buffer, start, end, length):
+    """
+    Versione in blocco di crc8_hex_checksum per i pacchetti contigui in
+    buffer[start:end]: restituisce l'offset del primo pacchetto con CRC
+    errato, oppure `end` se sono tutti validi.
+    """
+    n = (end - start) // length
+    frames = np.frombuffer(buffer, dtype=np.uint8, count=end - start, offset=start).reshape(n, length)
+    crc = np.zeros(n, dtype=np.uint8)
+    for col in range(1, 9):
+        crc = _CRC8_TABLE_NP[crc ^ frames[:, col]]
+    written = (_HEX_VALUES[frames[:, 9]] << 4) | _HEX_VALUES[frames[:, 10]]
+    bad = np.flatnonzero(crc != written)
+    return start + int(bad[0]) * length if len(bad) else end
+
+
+def add_crc8_hex(frame):
+    """Completa un pacchetto FEEDBACK_CRC8_FORMAT (senza i due byte del CRC); usato dal dongle simulato."""
+    return bytes(frame) + b"%02X" % crc8(frame[1:9])
+
+
+class PacketSpec:
+    """
+    Descrizione del formato di un pacchetto seriale.
+      - start_byte: byte di inizio pacchetto (default '$')
+      - length: lunghezza totale del pacchetto, start byte incluso
+      - checksum: callable opzionale che riceve il pacchetto (memoryview)
+        e restituisce True se il pacchetto è valido
+      - batch_checksum: versione opzionale in blocco del checksum, usata
+        al suo posto sui tratti di almeno BATCH_CHECKSUM_MIN_PACKETS
+        pacchetti (vedi crc8_hex_batch_checksum)
+      - frame_format: stringa opzionale con la classe di byte ammessa in
+        ogni posizione: 'd' cifra, 'h' cifra esadecimale maiuscola, '?'
+        qualsiasi byte tranne lo start byte, 'x' qualsiasi byte, altri
+        caratteri letterali (il primo deve essere lo start byte)
+
+    La tabella per posizione (`table`) viene compilata in un'espressione
+    regolare che riconosce una sequenza di pacchetti validi consecutivi:
+    ricerca dello start byte, validazione del formato e risincronizzazione
+    avvengono in C, con una sola chiamata per ogni tratto di pacchetti
+    contigui (di norma l'intero blocco ricevuto).
+    """
+    def __init__(self, start_byte=b'$', length=11, checksum=None, frame_format=None, batch_checksum=None):
+        if isinstance(start_byte, int):
+            start_byte = bytes([start_byte])
+        if len(start_byte) != 1:
+            raise ValueError("start_byte deve essere un singolo byte")
+        if length < 1:
+            raise ValueError("length deve essere positiva")
+        self.start_byte = bytes(start_byte)
+        self.length = length
+        self.checksum = checksum
+        self.batch_checksum = batch_checksum if checksum is not None else None
+        self.frame_format = frame_format
+        self.table = self._build_table(frame_format)
+        frame = b"".join(self._byte_class(allowed) for allowed in self.table)
+        self.pattern = re.compile(frame)
+        self.run_pattern = re.compile(b"(?:" + frame + b")+")
+
+    def _build_table(self, frame_format):
+        if frame_format is None:
+            # Solo lo start byte: comportamento storico, nessun controllo del contenuto
+            return [self.start_byte] + [ALL_BYTES] * (self.length - 1)
+        if len(frame_format) != self.length:
+            raise ValueError("frame_format deve avere la lunghezza del pacchetto")
+        if frame_format[0].encode('latin-1') != self.start_byte:
+            raise ValueError("frame_format deve iniziare con lo start byte")
+        not_start = ALL_BYTES.replace(self.start_byte, b"")
+        classes = {"d": DIGITS, "h": HEX_DIGITS, "?": not_start, "x": ALL_BYTES}
+        return [self.start_byte] + [classes.get(c, c.encode('latin-1')) for c in frame_format[1:]]
+
+    @staticmethod
+    def _byte_class(allowed):
+        if len(allowed) == 256:
+            return rb"[\x00-\xff]"
+        if len(allowed) == 1:
+            return re.escape(allowed)
+        return b"[" + b"".join(b"\\x%02x" % b for b in allowed) + b"]"
+
+    def is_valid(self, packet):
+        if self.pattern.fullmatch(packet) is None:
+            return False
+        if self.checksum is None:
+            return True
+        return bool(self.checksum(packet))
+
+
+# Pacchetto di feedback del dongle robot: '$' + 10 byte
+DEFAULT_SPEC = PacketSpec(b'$', 11, frame_format=FEEDBACK_FORMAT)
+# Firmware con CRC-8 in coda (vedi FEEDBACK_CRC8_FORMAT)
+CRC8_SPEC = PacketSpec(b'$', 11, checksum=crc8_hex_checksum, frame_format=FEEDBACK_CRC8_FORMAT,
+                       batch_checksum=crc8_hex_batch_checksum if np is not None else None)
+# Nessuna validazione del contenuto (firmware con formato diverso da FEEDBACK_FORMAT)
+UNCHECKED_SPEC = PacketSpec(b'$', 11)
+FRAME_CHECKS = {"format": DEFAULT_SPEC, "crc8": CRC8_SPEC, "none": UNCHECKED_SPEC}
+
+
+class RingBufferFramer:
+    """
+    Framer a capacità fissa basato su un ring buffer.
+
+    I dati ricevuti vengono copiati una sola volta nel buffer interno; i
+    pacchetti completi vengono consegnati alla callback come slice
+    memoryview del buffer, senza ulteriori copie. La slice è valida solo
+    durante la chiamata alla callback: chi deve conservarla ne faccia una
+    copia (bytes(packet)).
+
+    Quando la scrittura raggiunge la fine del buffer, i pochi byte non
+    ancora consumati (al massimo un pacchetto parziale) vengono riportati
+    all'inizio, e la scrittura riparte da zero.
+
+    Se viene passata `batch_callback`, al termine di ogni blocco ricevuto
+    questa viene chiamata una sola volta con il buffer interno e la lista
+    degli offset dei pacchetti completi trovati nel blocco, in modo da
+    poterli decodificare tutti insieme (vedi PacketDecoder.decode_batch).
+
+    Validazione: sono consegnati solo i pacchetti conformi al formato della
+    spec (vedi PacketSpec) e, se indicato, al checksum. Un pacchetto non
+    valido (es. uno start byte spurio dentro i dati, che sposterebbe
+    l'allineamento) viene scartato e la ricerca riprende dallo start byte
+    plausibile successivo.
+
+    Contatori:
+      - packets: pacchetti validi consegnati
+      - rejected: pacchetti candidati (start byte trovato) scartati dalla validazione
+      - bytes_dropped: byte scartati (spazzatura o pacchetti non validi)
+      - resyncs: numero di risincronizzazioni sullo start byte
+    """
+    def __init__(self, packet_callback=None, spec=DEFAULT_SPEC, capacity=4096, batch_callback=None):
+        if capacity < 2 * spec.length:
+            raise ValueError("capacity deve contenere almeno due pacchetti")
+        self.packet_callback = packet_callback
+        self.batch_callback = batch_callback
+        self.spec = spec
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._head = 0   # primo byte non consumato
+        self._tail = 0   # prossima posizione di scrittura
+        self.packets = 0
+        self.rejected = 0
+        self.bytes_dropped = 0
+        self.resyncs = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def reset(self):
+        """Svuota il buffer (es. dopo una riconnessione), mantenendo i contatori."""
+        self._head = 0
+        self._tail = 0
+
+    def feed(self, data):
+        """Accoda i byte ricevuti e consegna tutti i pacchetti completi."""
+        data = memoryview(data)
+        # Se il blocco è più grande dello spazio disponibile lo si processa a pezzi
+        chunk = self.capacity - self.spec.length
+        while len(data) > chunk:
+            self._feed(data[:chunk])
+            data = data[chunk:]
+        self._feed(data)
+
+    def _feed(self, data):
+        n = len(data)
+        if self._tail + n > self.capacity:
+            self._wrap()
+        self._view[self._tail:self._tail + n] = data
+        self._tail += n
+        self._scan()
+
+    def _wrap(self):
+        pending = self._tail - self._head
+        if pending:
+            self._view[0:pending] = self._view[self._head:self._tail]
+        self._head = 0
+        self._tail = pending
+
+    def _skip(self, head, start):
+        """Scarta i byte [head, start) prima del prossimo pacchetto o pacchetto parziale."""
+        self.bytes_dropped += start - head
+        self.resyncs += 1
+        # Ogni start byte nel tratto scartato era un pacchetto candidato non valido
+        self.rejected += self._buf.count(self.spec.start_byte, head, start)
+
+    def _scan(self):
+        buf = self._buf
+        view = self._view
+        spec = self.spec
+        length = spec.length
+        search = spec.run_pattern.search
+        checksum = spec.checksum
+        batch_checksum = spec.batch_checksum
+        batch_min = BATCH_CHECKSUM_MIN_PACKETS * length
+        head = self._head
+        tail = self._tail
+        packet_callback = self.packet_callback
+        offsets = [] if self.batch_callback is not None else None
+        try:
+            while True:
+                match = search(buf, head, tail)
+                if match is None:
+                    break
+                start, end = match.span()
+                if start != head:
+                    self._skip(head, start)
+                    head = start
+                # Il tratto valido si ferma al primo pacchetto con checksum errato
+                if batch_checksum is not None and end - start >= batch_min:
+                    end = batch_checksum(buf, start, end, length)
+                elif checksum is not None:
+                    for offset in range(start, end, length):
+                        if not checksum(view[offset:offset + length]):
+                            end = offset
+                            break
+                if end > start:
+                    run = range(start, end, length)
+                    if packet_callback is not None:
+                        for offset in run:
+                            packet_callback(view[offset:offset + length])
+                    if offsets is not None:
+                        offsets.extend(run)
+                    self.packets += len(run)
+                    head = end
+                if end < match.end():
+                    # Checksum errato: scarta il pacchetto fino al prossimo start byte
+                    # (una sola risincronizzazione, contata da _skip)
+                    start = buf.find(spec.start_byte, end + 1, tail)
+                    if start == -1:
+                        start = tail
+                    self._skip(end, start)
+                    head = start
+            if tail > head:
+                # Resta al più un pacchetto parziale, che inizia con uno start byte
+                # negli ultimi length-1 byte: il resto è spazzatura
+                start = buf.find(spec.start_byte, max(head, tail - length + 1), tail)
+                if start == -1:
+                    start = tail
+                if start != head:
+                    self._skip(head, start)
+                    head = start
+            if offsets:
+                # I dati restano nel buffer fino al prossimo feed
+                self.batch_callback(buf, offsets)
+        finally:
+            self._head = head
+            if head == tail:
+                self._head = 0
+                self._tail = 0
@@ -0,0 +1,163 @@
+"""
+Lettura adattiva della porta seriale.
+
+ReaderThread di pyserial legge "quello che c'è" appena arriva un byte: a
+flussi alti il thread si sveglia (e chiama data_received) ogni pochi
+pacchetti. ReadPacer stima il flusso in byte/s e, dopo ogni lettura,
+indica quanto attendere perché si accumuli un blocco adeguato:
+
+    blocco = flusso * latency_budget    (limitato tra min_chunk e max_chunk)
+    attesa = (blocco - byte già in coda) / flusso    (al più latency_budget)
+
+A flussi bassi il blocco è un solo pacchetto e non si attende mai
+(latenza minima, come ReaderThread); a flussi alti si scambiano sveglie con
+al più latency_budget secondi di ritardo aggiuntivo. latency_budget = 0
+disattiva l'attesa. I parametri vengono dal profilo della porta
+(COMDeviceManager.PortProfile).
+
+Metriche: serial.reads (letture/sveglie), l'istogramma
+serial.read_wait_seconds delle attese aggiunte e, per ogni dispositivo
+(register_pacer_gauges), serial.reads_per_s.<dispositivo>,
+serial.bytes_per_read.<dispositivo>, serial.read_target_bytes.<dispositivo>
+e serial.byte_rate.<dispositivo>.
+"""
+import threading
+import time
+
+import serial
+from serial.threaded import ReaderThread
+
+from Metrics import counter, gauge, histogram
+
+SERIAL_READS = counter("serial.reads")
+SERIAL_READ_WAIT = histogram("serial.read_wait_seconds")
+
+# Attese più brevi non valgono una sveglia in più del thread
+MIN_WAIT = 0.0002
+
+
+class ReadPacer:
+    """Stima del flusso e dimensionamento delle letture (vedi modulo)."""
+    def __init__(self, latency_budget=0.001, min_chunk=11, max_chunk=4096, window=0.05):
+        self.latency_budget = latency_budget
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.window = window
+        self.byte_rate = 0.0        # byte/s (media sulle ultime finestre)
+        self.reads_per_s = 0.0
+        self.bytes_per_read = 0.0
+        self.target = min_chunk
+        self._window_start = time.perf_counter()
+        self._window_bytes = 0
+        self._window_reads = 0
+
+    @classmethod
+    def from_profile(cls, profile):
+        return cls(profile.latency_budget, profile.min_chunk, profile.max_chunk)
+
+    def record(self, nbytes):
+        """Registra una lettura di `nbytes` byte (0 se scaduto il timeout)."""
+        if nbytes:
+            SERIAL_READS.inc()
+            self._window_reads += 1
+            self._window_bytes += nbytes
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        rate = self._window_bytes / elapsed
+        # Media con la finestra precedente: reagisce in ~2 finestre ai cambi di flusso
+        self.byte_rate = rate if not self.byte_rate else 0.5 * (self.byte_rate + rate)
+        self.reads_per_s = self._window_reads / elapsed
+        if self._window_reads:
+            self.bytes_per_read = self._window_bytes / self._window_reads
+        self.target = int(min(max(self.byte_rate * self.latency_budget, self.min_chunk), self.max_chunk))
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_reads = 0
+
+    def read_size(self, waiting):
+        """Byte da leggere con `waiting` byte in coda: tutti (fino a max_chunk), o 1 per attendere."""
+        return min(waiting, self.max_chunk) or 1
+
+    def wait_time(self, waiting):
+        """Secondi da attendere prima della prossima lettura con `waiting` byte già in coda."""
+        if self.latency_budget <= 0 or self.byte_rate <= 0:
+            return 0.0
+        missing = self.target - waiting
+        if missing <= 0:
+            return 0.0
+        wait = min(missing / self.byte_rate, self.latency_budget)
+        return wait if wait >= MIN_WAIT else 0.0
+
+    def snapshot(self):
+        return {
+            "byte_rate": round(self.byte_rate, 1),
+            "reads_per_s": round(self.reads_per_s, 1),
+            "bytes_per_read": round(self.bytes_per_read, 1),
+            "target_bytes": self.target,
+        }
+
+
+def register_pacer_gauges(device, current_pacer):
+    """
+    Registra (una volta per dispositivo) le gauge serial.<nome>.<device>,
+    che leggono il pacer restituito da current_pacer() al momento della lettura.
+    """
+    gauge(f"serial.byte_rate.{device}", lambda: current_pacer().snapshot()["byte_rate"])
+    gauge(f"serial.reads_per_s.{device}", lambda: current_pacer().snapshot()["reads_per_s"])
+    gauge(f"serial.bytes_per_read.{device}", lambda: current_pacer().snapshot()["bytes_per_read"])
+    gauge(f"serial.read_target_bytes.{device}", lambda: current_pacer().snapshot()["target_bytes"])
+
+
+class AdaptiveReaderThread(ReaderThread):
+    """
+    ReaderThread che dimensiona le letture con un ReadPacer. L'attesa tra
+    una lettura e la successiva è interrotta subito da stop().
+    """
+    def __init__(self, serial_instance, protocol_factory, pacer=None):
+        super().__init__(serial_instance, protocol_factory)
+        self.pacer = pacer or ReadPacer()
+        self._wake = threading.Event()
+
+    def stop(self):
+        self.alive = False
+        self._wake.set()
+        super().stop()
+
+    def run(self):
+        """Ciclo di lettura (come ReaderThread.run, con le attese del pacer)."""
+        if not hasattr(self.serial, 'cancel_read'):
+            self.serial.timeout = 1
+        self.protocol = self.protocol_factory()
+        try:
+            self.protocol.connection_made(self)
+        except Exception as e:
+            self.alive = False
+            self.protocol.connection_lost(e)
+            self._connection_made.set()
+            return
+        error = None
+        self._connection_made.set()
+        pacer = self.pacer
+        ser = self.serial
+        while self.alive and ser.is_open:
+            try:
+                data = ser.read(pacer.read_size(ser.in_waiting))
+                if data:
+                    self.protocol.data_received(data)
+                pacer.record(len(data))
+                wait = pacer.wait_time(ser.in_waiting) if data else 0.0
+            except serial.SerialException as e:
+                # Es. adattatore USB scollegato
+                error = e
+                break
+            except Exception as e:
+                error = e
+                break
+            if wait:
+                SERIAL_READ_WAIT.record(wait)
+                self._wake.wait(wait)
+        self.alive = False
+        self.protocol.connection_lost(error)
+        self.protocol = None
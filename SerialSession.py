@@ -0,0 +1,204 @@
+import collections
+import threading
+import time
+
+import serial
+
+from COMDeviceManager import COMDeviceManager, PORT_PROFILES
+from BridgeCore import SerialProtocol, open_dongle
+from ConsoleLog import get_logger
+from SerialReader import AdaptiveReaderThread, ReadPacer, register_pacer_gauges
+
+log = get_logger("SerialSession")
+
+# Tempi di recupero conservati in recovery_times (i più recenti)
+RECOVERY_HISTORY = 100
+
+
+class SerialSession:
+    """
+    Sessione seriale supervisionata con riconnessione automatica.
+
+    Se la porta si perde (dongle scollegato), la sessione ripete la ricerca
+    con COMDeviceManager (il nome della porta può cambiare), riapre con
+    backoff esponenziale limitato, reinvia '$VS***' e riprende a inoltrare
+    il feedback senza riavviare il processo.
+
+    La porta viene aperta con `profile` (COMDeviceManager.PortProfile, default
+    PORT_PROFILES["default"]) e letta da un AdaptiveReaderThread che
+    dimensiona le letture sul flusso osservato (vedi SerialReader).
+
+    Metriche:
+      - reconnects: riconnessioni riuscite
+      - last_recovery_time / recovery_times: tempo (s) tra la perdita della
+        porta e il primo pacchetto ricevuto dopo la riconnessione (gli ultimi
+        RECOVERY_HISTORY); max_recovery_time: il massimo dall'avvio
+    """
+    def __init__(self, dongle_type="robot", batch_callback=None, comport=None, send_velocity=True,
+                 backoff_initial=0.2, backoff_max=5.0, backoff_factor=2.0, resolver=None, raw_callback=None,
+                 profile=None, spec=None):
+        self.dongle_type = dongle_type
+        self.batch_callback = batch_callback
+        self.raw_callback = raw_callback
+        self.comport = comport
+        self.send_velocity = send_velocity
+        self.profile = profile or PORT_PROFILES["default"]
+        self.spec = spec
+        # Unico per la sessione: la stima del flusso sopravvive alle riconnessioni
+        self.pacer = ReadPacer.from_profile(self.profile)
+        register_pacer_gauges(dongle_type, lambda: self.pacer)
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff_factor = backoff_factor
+        # resolver() restituisce la porta da aprire ("" se non trovata)
+        self.resolver = resolver or self._resolve_port
+        self.ser = None
+        self.protocol = None
+        self.connected = threading.Event()
+        self.reconnects = 0
+        self.recovery_times = collections.deque(maxlen=RECOVERY_HISTORY)
+        self.last_recovery_time = None
+        self.max_recovery_time = None
+        self._lost_at = None
+        self._has_connected = False
+        self._reader = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _resolve_port(self):
+        if self.comport:
+            return self.comport
+        # Dopo una disconnessione la cache delle porte non è più affidabile
+        return COMDeviceManager.discover_com_devices(self.dongle_type, force=self._has_connected)
+
+    @property
+    def port(self):
+        return self.ser.port if self.ser is not None else None
+
+    def connect(self):
+        """
+        Apre la porta (bloccante), riprovando con backoff esponenziale finché
+        non riesce o finché la sessione non viene fermata. Restituisce la
+        porta seriale aperta oppure None.
+        """
+        delay = self.backoff_initial
+        while not self._stop.is_set():
+            comport = self.resolver()
+            ser = open_dongle(self.dongle_type, comport, self.send_velocity, self.profile) if comport else None
+            if ser is not None:
+                if self._has_connected:
+                    self.reconnects += 1
+                self._has_connected = True
+                self.ser = ser
+                self.connected.set()
+                return ser
+            if not comport:
+                log.warning("Dongle %s non trovato.", self.dongle_type)
+            log.info("Nuovo tentativo di connessione tra %.1f s", delay)
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * self.backoff_factor, self.backoff_max)
+        return None
+
+    def connection_lost(self, exc=None):
+        """Registra la perdita della porta e la chiude."""
+        if exc is not None:
+            log.warning("Connessione seriale persa: %s", exc)
+        self.connected.clear()
+        if self._lost_at is None:
+            self._lost_at = time.perf_counter()
+        ser, self.ser = self.ser, None
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception as e:
+                log.error("Errore nella chiusura della porta seriale: %s", e)
+        COMDeviceManager.invalidate_cache()
+
+    def batch_received(self, batch):
+        """Callback per SerialProtocol: misura il tempo di recupero e inoltra il blocco."""
+        if self._lost_at is not None:
+            self.last_recovery_time = time.perf_counter() - self._lost_at
+            self.recovery_times.append(self.last_recovery_time)
+            self.max_recovery_time = max(self.max_recovery_time or 0.0, self.last_recovery_time)
+            self._lost_at = None
+            log.info("Feedback ripreso dopo %.2f s", self.last_recovery_time)
+        if self.batch_callback is not None:
+            self.batch_callback(batch)
+
+    def make_protocol(self):
+        return SerialProtocol(batch_callback=self.batch_received, raw_callback=self.raw_callback, spec=self.spec)
+
+    def write(self, data):
+        ser = self.ser
+        if ser is None or not self.connected.is_set():
+            raise serial.SerialException("porta seriale non connessa")
+        return ser.write(data)
+
+    # -------------------------
+    # Supervisione su thread (modalità threaded)
+    # -------------------------
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        reader = self._reader
+        if reader is not None:
+            reader.stop()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self.connected.clear()
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except Exception as e:
+                log.error("Errore nella chiusura della porta seriale: %s", e)
+            self.ser = None
+
+    def _run(self):
+        delay = self.backoff_initial
+        while not self._stop.is_set():
+            ser = self.connect()
+            if ser is None:
+                break
+            self._reader = AdaptiveReaderThread(ser, self.make_protocol, self.pacer)
+            self._reader.start()
+            try:
+                _, self.protocol = self._reader.connect()
+                failed_at_start = False
+            except RuntimeError:
+                # La porta ha dato errore prima che il reader fosse pronto
+                failed_at_start = True
+            # Il reader termina da solo quando la porta genera un errore
+            self._reader.join()
+            self._reader = None
+            if self._stop.is_set():
+                break
+            self.connection_lost(None)
+            if not failed_at_start:
+                delay = self.backoff_initial
+                log.warning("Porta seriale persa, riconnessione in corso...")
+                continue
+            # Porta che si apre ma fallisce subito: backoff come in connect()
+            log.warning("Porta seriale persa all'avvio del reader, nuovo tentativo tra %.1f s", delay)
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * self.backoff_factor, self.backoff_max)
+
+    def stats(self):
+        framer = self.protocol.framer if self.protocol is not None else None
+        return {
+            "connected": self.connected.is_set(),
+            "port": self.port,
+            "reconnects": self.reconnects,
+            "last_recovery_time": self.last_recovery_time,
+            "max_recovery_time": self.max_recovery_time,
+            "bytes_dropped": framer.bytes_dropped if framer else 0,
+            "resyncs": framer.resyncs if framer else 0,
+            "frames_rejected": framer.rejected if framer else 0,
+            "reader": self.pacer.snapshot(),
+        }
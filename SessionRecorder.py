@@ -0,0 +1,344 @@
+"""
+Registrazione e replay di sessioni di feedback.
+
+Formato del file dei campioni (.sfrec), append-only:
+  - header di HEADER.size byte: magic, versione, dimensione record, istante di inizio
+  - record a dimensione fissa (torque int16, position int16, timestamp float64)
+Essendo i record contigui, il file si rilegge con una vista np.memmap.
+
+Con i byte grezzi della seriale abilitati viene scritto anche un file
+.sfraw a blocchi: (timestamp float64, lunghezza uint32, dati).
+
+Esempi:
+    python SessionRecorder.py info sessione.sfrec
+    python SessionRecorder.py replay sessione.sfrec --speed 4
+"""
+import argparse
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale per la registrazione, richiesto per memmap
+    np = None
+
+from BridgeCore import UDP_FEEDBACK_PORT, UDP_IP
+from ConsoleLog import get_logger
+from FeedbackProtocol import FeedbackPublisher, FORMAT_ASCII, FORMAT_BINARY
+from PacketDecoder import SampleBatch, SAMPLE_DTYPE
+
+MAGIC = b'SFREC\x00'
+VERSION = 1
+HEADER = struct.Struct('<6sHId48x')   # 64 byte
+RECORD = struct.Struct('<hhd')        # 12 byte, come PacketDecoder.SAMPLE_DTYPE
+RAW_CHUNK = struct.Struct('<dI')
+RAW_SUFFIX = ".sfraw"
+
+log = get_logger("SessionRecorder")
+
+
+class SessionRecorder:
+    """
+    Registratore di campioni (e opzionalmente byte grezzi) su file.
+
+    record()/record_raw() non bloccano mai il chiamante (reader seriale):
+    i dati vengono accodati e scritti a blocchi da un thread in background.
+    Se la coda è piena il blocco viene scartato e contato in `dropped_batches`.
+    """
+    def __init__(self, path, record_raw=False, chunk_size=64 * 1024, flush_interval=0.5, max_queue=4096):
+        self.path = path
+        self.record_raw_bytes = record_raw
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.samples_written = 0
+        self.raw_bytes_written = 0
+        self.dropped_batches = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._file = None
+        self._raw_file = None
+
+    def start(self):
+        """
+        Apre i file in append. Se la registrazione esiste già se ne verifica
+        l'header (ValueError se non è compatibile) e si tronca un eventuale
+        record finale incompleto lasciato da un'interruzione, che
+        disallineerebbe tutti i record successivi.
+        """
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+        if exists:
+            _prepare_append(self.path)
+        self._file = open(self.path, "ab")
+        if not exists:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time()))
+        if self.record_raw_bytes:
+            raw_path = os.path.splitext(self.path)[0] + RAW_SUFFIX
+            if os.path.exists(raw_path):
+                _truncate_raw(raw_path)
+            self._raw_file = open(raw_path, "ab")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        log.info("Registrazione della sessione su %s", self.path)
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        if self._raw_file is not None:
+            self._raw_file.close()
+        log.info("Registrazione chiusa: %s campioni, %s blocchi scartati", self.samples_written, self.dropped_batches)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped_batches += 1
+
+    def record(self, batch):
+        """Accoda una SampleBatch (non bloccante)."""
+        if len(batch):
+            self._put(("s", _batch_to_bytes(batch), len(batch)))
+
+    def record_raw(self, data):
+        """Accoda i byte grezzi ricevuti dalla seriale (non bloccante)."""
+        if self.record_raw_bytes and data:
+            self._put(("r", time.time(), bytes(data)))
+
+    def _run(self):
+        samples = bytearray()
+        raw = bytearray()
+        pending = 0
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                running = False
+            elif item:
+                if item[0] == "s":
+                    samples += item[1]
+                    pending += item[2]
+                else:
+                    raw += RAW_CHUNK.pack(item[1], len(item[2]))
+                    raw += item[2]
+            now = time.monotonic()
+            if (not running or len(samples) + len(raw) >= self.chunk_size
+                    or now - last_flush >= self.flush_interval):
+                self._flush(samples, raw, pending)
+                samples.clear()
+                raw.clear()
+                pending = 0
+                last_flush = now
+
+    def _flush(self, samples, raw, pending):
+        try:
+            if samples:
+                self._file.write(samples)
+                self._file.flush()
+                self.samples_written += pending
+            if raw and self._raw_file is not None:
+                self._raw_file.write(raw)
+                self._raw_file.flush()
+                self.raw_bytes_written += len(raw)
+        except OSError as e:
+            log.error("Errore nella scrittura della registrazione: %s", e)
+
+
+def _batch_to_bytes(batch):
+    if batch.records is not None:
+        return batch.records.tobytes()
+    out = bytearray(len(batch) * RECORD.size)
+    offset = 0
+    for t, p, ts in batch:
+        RECORD.pack_into(out, offset, t, p, ts)
+        offset += RECORD.size
+    return bytes(out)
+
+
+def _prepare_append(path):
+    """Verifica l'header di una registrazione esistente e la tronca a record interi."""
+    read_header(path)
+    size = os.path.getsize(path)
+    partial = (size - HEADER.size) % RECORD.size
+    if partial:
+        log.warning("Record finale incompleto in %s (%s byte): rimosso prima di continuare", path, partial)
+        with open(path, "r+b") as f:
+            f.truncate(size - partial)
+
+
+def _truncate_raw(path):
+    """Tronca un file .sfraw all'ultimo blocco completo (vedi iter_raw)."""
+    size = os.path.getsize(path)
+    end = 0
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(RAW_CHUNK.size)
+            if len(head) < RAW_CHUNK.size:
+                break
+            _, length = RAW_CHUNK.unpack(head)
+            if end + RAW_CHUNK.size + length > size:
+                break
+            end += RAW_CHUNK.size + length
+            f.seek(end)
+    if end < size:
+        log.warning("Blocco finale incompleto in %s (%s byte): rimosso prima di continuare", path, size - end)
+        with open(path, "r+b") as f:
+            f.truncate(end)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path}: header della registrazione incompleto")
+    magic, version, record_size, start_time = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} non è una registrazione SixthFinger")
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"Versione di registrazione non supportata: {version}")
+    return start_time
+
+
+def open_recording(path):
+    """
+    Restituisce i campioni registrati come vista np.memmap di sola lettura
+    (campi 'torque', 'position', 'timestamp'). Un eventuale record finale
+    incompleto viene ignorato.
+    """
+    if np is None:
+        raise RuntimeError("NumPy è necessario per leggere la registrazione con memmap")
+    read_header(path)
+    count = (os.path.getsize(path) - HEADER.size) // RECORD.size
+    if count == 0:
+        return np.empty(0, dtype=SAMPLE_DTYPE)
+    return np.memmap(path, dtype=SAMPLE_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+
+
+def iter_recording(path, block=1024):
+    """Legge la registrazione a blocchi come SampleBatch (funziona anche senza NumPy)."""
+    if np is not None:
+        records = open_recording(path)
+        for start in range(0, len(records), block):
+            yield SampleBatch.from_records(records[start:start + block])
+        return
+    read_header(path)
+    with open(path, "rb") as f:
+        f.seek(HEADER.size)
+        while True:
+            data = f.read(block * RECORD.size)
+            usable = len(data) - len(data) % RECORD.size
+            if not usable:
+                return
+            torque, position, timestamp = array('h'), array('h'), array('d')
+            for t, p, ts in RECORD.iter_unpack(data[:usable]):
+                torque.append(t)
+                position.append(p)
+                timestamp.append(ts)
+            yield SampleBatch(torque, position, timestamp)
+
+
+def iter_raw(path):
+    """Itera sui blocchi di byte grezzi (timestamp, dati) di un file .sfraw."""
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(RAW_CHUNK.size)
+            if len(head) < RAW_CHUNK.size:
+                return
+            timestamp, length = RAW_CHUNK.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, data
+
+
+def replay(path, speed=1.0, dest=(UDP_IP, UDP_FEEDBACK_PORT), fmt=FORMAT_BINARY, block_interval=0.005,
+           loop=False):
+    """
+    Reinvia una registrazione sulla porta di feedback rispettando i tempi
+    originali divisi per `speed` (speed <= 0: il più velocemente possibile).
+    I campioni sono inviati a gruppi che coprono `block_interval` secondi
+    di registrazione. Restituisce il numero di campioni inviati.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    publisher = FeedbackPublisher(sock, dest, fmt)
+    sent = 0
+    try:
+        while True:
+            origin = None
+            wall_start = time.perf_counter()
+            for batch in iter_recording(path, block=4096):
+                timestamps = batch.timestamp
+                start = 0
+                n = len(batch)
+                while start < n:
+                    t0 = float(timestamps[start])
+                    if origin is None:
+                        origin = t0
+                    end = start + 1
+                    while end < n and float(timestamps[end]) - t0 < block_interval:
+                        end += 1
+                    if speed > 0:
+                        delay = (t0 - origin) / speed - (time.perf_counter() - wall_start)
+                        if delay > 0:
+                            time.sleep(delay)
+                    publisher.publish(SampleBatch(batch.torque[start:end], batch.position[start:end],
+                                                  timestamps[start:end]))
+                    sent += end - start
+                    start = end
+            if not loop:
+                break
+    finally:
+        sock.close()
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registrazioni di sessione SixthFinger")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="riepilogo di una registrazione")
+    info.add_argument("path")
+    rep = sub.add_parser("replay", help="reinvia una registrazione sulla porta di feedback")
+    rep.add_argument("path")
+    rep.add_argument("--speed", type=float, default=1.0, help="fattore di accelerazione (0 = massima velocità)")
+    rep.add_argument("--port", type=int, default=UDP_FEEDBACK_PORT)
+    rep.add_argument("--format", choices=(FORMAT_BINARY, FORMAT_ASCII), default=FORMAT_BINARY)
+    rep.add_argument("--loop", action="store_true", help="ripete la registrazione all'infinito")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        start_time = read_header(args.path)
+        count = (os.path.getsize(args.path) - HEADER.size) // RECORD.size
+        print(f"Inizio registrazione: {time.ctime(start_time)}")
+        print(f"Campioni: {count}")
+        if count and np is not None:
+            records = open_recording(args.path)
+            span = float(records['timestamp'][-1] - records['timestamp'][0])
+            print(f"Durata: {span:.2f} s ({count / span if span > 0 else 0:.0f} campioni/s)")
+    else:
+        try:
+            sent = replay(args.path, args.speed, (UDP_IP, args.port), args.format, loop=args.loop)
+            print(f"Replay completato: {sent} campioni inviati")
+        except KeyboardInterrupt:
+            print("Replay interrotto.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Canale di feedback su memoria condivisa per i consumer sulla stessa macchina.
+
+Il bridge (unico scrittore) copia ogni blocco di campioni in un ring di
+record a dimensione fissa (PacketDecoder.SAMPLE_DTYPE) dentro un segmento
+multiprocessing.shared_memory; i lettori (GUI, strumenti locali) leggono
+direttamente dal segmento, senza syscall, copie sul socket né parsing.
+
+Layout del segmento:
+  - header di HEADER.size byte: magic, versione, capacità, dimensione del
+    record, contatore dei campioni scritti (uint64, monotono)
+  - DOORBELL_SLOTS porte UDP dei lettori in attesa (uint16, 0 = libero)
+  - generazione dello scrittore (uint64 casuale, 0 = segmento chiuso)
+  - capacity record
+
+Il contatore viene aggiornato dopo aver scritto i record: un lettore legge
+il contatore, copia i record e verifica che nel frattempo lo scrittore non
+li abbia sovrascritti (come GraphBuffer.SampleRing).
+
+Notifica: un lettore può fare polling oppure chiamare wait(), che registra
+una porta UDP locale in uno slot del segmento; lo scrittore vi invia un
+datagramma di un byte per ogni blocco (non per campione). Gli slot si
+occupano sotto un lock su file (_doorbell_lock); lo slot di un lettore
+terminato senza close() si libera quando la sua porta non è più in uso.
+
+Riavvio del bridge: ogni scrittore scrive una generazione nuova e la azzera
+in close(). Un lettore che vede cambiare la generazione riparte dall'inizio
+del ring (segmento riusato) oppure riapre il nome (segmento chiuso o
+sostituito da uno nuovo); senza dati per tutto il timeout di wait()
+controlla comunque il nome, perché su POSIX il segmento di un bridge
+terminato male viene eliminato dal resource_tracker senza azzerarne la
+generazione.
+"""
+import contextlib
+import os
+import select
+import socket
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from ConsoleLog import get_logger
+from PacketDecoder import SAMPLE_DTYPE, SampleBatch
+
+log = get_logger("SharedFeedback")
+
+DEFAULT_NAME = "sixthfinger_feedback"
+DEFAULT_CAPACITY = 1 << 16
+MAGIC = b'SFSHM\x00'
+VERSION = 2
+HEADER = struct.Struct('<6sHII')          # magic, versione, capacità, dimensione record
+COUNT_OFFSET = 16                         # uint64 allineato a 8 byte
+DOORBELL_SLOTS = 8
+DOORBELL_OFFSET = COUNT_OFFSET + 8
+GENERATION_OFFSET = DOORBELL_OFFSET + 2 * DOORBELL_SLOTS
+DATA_OFFSET = 64
+UDP_IP = "127.0.0.1"
+
+
+def _segment_size(capacity):
+    return DATA_OFFSET + capacity * SAMPLE_DTYPE.itemsize
+
+
+def _attach(name):
+    """Apre un segmento esistente senza che il processo lettore lo distrugga all'uscita."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # Prima di Python 3.13 anche i lettori registrano il segmento nel
+        # resource_tracker, che lo eliminerebbe alla loro uscita
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _new_generation():
+    return int.from_bytes(os.urandom(8), "little") | 1
+
+
+@contextlib.contextmanager
+def _doorbell_lock(name):
+    """Lock tra processi sulla tabella delle porte di notifica del segmento `name`."""
+    with open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+            return
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _port_in_use(port):
+    """True se la porta UDP locale è ancora aperta da qualcuno (il lettore dello slot è vivo)."""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.bind((UDP_IP, port))
+    except OSError:
+        return True
+    finally:
+        probe.close()
+    return False
+
+
+def _clear_stale_doorbells(doorbells):
+    """Libera gli slot dei lettori terminati senza close() (da chiamare sotto _doorbell_lock)."""
+    for slot, port in enumerate(doorbells.tolist()):
+        if port and not _port_in_use(port):
+            doorbells[slot] = 0
+
+
+class _Segment:
+    """Viste NumPy sulle aree del segmento."""
+    def __init__(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        buf = shm.buf
+        self.count = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=COUNT_OFFSET)
+        self.doorbells = np.ndarray((DOORBELL_SLOTS,), dtype=np.uint16, buffer=buf, offset=DOORBELL_OFFSET)
+        self.generation = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=GENERATION_OFFSET)
+        self.records = np.ndarray((capacity,), dtype=SAMPLE_DTYPE, buffer=buf, offset=DATA_OFFSET)
+
+    def release(self):
+        # Le viste vanno rilasciate prima di chiudere il segmento
+        self.count = self.doorbells = self.generation = self.records = None
+        self.shm.close()
+
+
+def _open_segment(name):
+    """Apre il segmento `name` come lettore, verificandone l'header."""
+    shm = _attach(name)
+    magic, version, capacity, record_size = HEADER.unpack_from(shm.buf, 0)
+    if magic != MAGIC or version != VERSION or record_size != SAMPLE_DTYPE.itemsize:
+        shm.close()
+        raise ValueError(f"Il segmento {name} non è un canale di feedback compatibile")
+    return _Segment(shm, capacity)
+
+
+class SharedFeedbackWriter:
+    """Scrittore del ring condiviso (il bridge). publish() non blocca mai."""
+    def __init__(self, name=DEFAULT_NAME, capacity=DEFAULT_CAPACITY):
+        self.name = name
+        self._created = True
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=_segment_size(capacity))
+        except FileExistsError:
+            # Segmento rimasto da un bridge terminato male (o tenuto aperto da
+            # un lettore su Windows): lo si riusa se compatibile
+            shm = _attach(name)
+            self._created = False
+            if shm.size < _segment_size(capacity):
+                shm.close()
+                raise ValueError(f"Il segmento {name} esiste già con dimensione diversa")
+        segment = _Segment(shm, capacity)
+        # Generazione a 0 durante la reinizializzazione: i lettori non leggono un ring a metà
+        segment.generation[0] = 0
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, capacity, SAMPLE_DTYPE.itemsize)
+        segment.count[0] = 0
+        with _doorbell_lock(name):
+            if self._created:
+                segment.doorbells[:] = 0
+            else:
+                # I lettori ancora attivi tengono il loro slot
+                _clear_stale_doorbells(segment.doorbells)
+        segment.generation[0] = _new_generation()
+        self._segment = segment
+        self._count = 0
+        self._doorbell_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._doorbell_sock.setblocking(False)
+        log.info("Feedback su memoria condivisa: %s (%s campioni)", name, capacity)
+
+    @property
+    def capacity(self):
+        return self._segment.capacity
+
+    def publish(self, batch):
+        """Copia un SampleBatch nel ring e notifica i lettori in attesa."""
+        n = len(batch)
+        if not n:
+            return
+        segment = self._segment
+        capacity = segment.capacity
+        if batch.records is not None:
+            records = batch.records
+        else:
+            records = np.empty(n, dtype=SAMPLE_DTYPE)
+            records['torque'] = batch.torque
+            records['position'] = batch.position
+            records['timestamp'] = batch.timestamp
+        if n > capacity:
+            records = records[-capacity:]
+            self._count += n - capacity
+            n = capacity
+        start = self._count % capacity
+        first = min(n, capacity - start)
+        segment.records[start:start + first] = records[:first]
+        segment.records[:n - first] = records[first:]
+        self._count += n
+        # Pubblicazione: i lettori vedono i nuovi record solo da qui in poi
+        segment.count[0] = self._count
+        for port in segment.doorbells.tolist():
+            if port:
+                try:
+                    self._doorbell_sock.sendto(b"\x01", (UDP_IP, port))
+                except OSError:
+                    pass
+
+    def close(self):
+        """
+        Segnala ai lettori la chiusura (generazione 0) e chiude il segmento.
+        Lo elimina solo se l'ha creato questo processo: uno riusato non è
+        registrato nel resource_tracker (vedi _attach), che in unlink()
+        stamperebbe un KeyError; resta disponibile per il prossimo bridge.
+        """
+        self._doorbell_sock.close()
+        self._segment.generation[0] = 0
+        shm = self._segment.shm
+        self._segment.release()
+        if self._created:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedFeedbackReader:
+    """
+    Lettore del ring condiviso. Ogni lettore tiene un proprio cursore per
+    read_new(); latest() legge gli ultimi campioni indipendentemente dal
+    cursore. Dopo un riavvio del bridge il lettore si riallinea da solo
+    (vedi modulo); i campioni persi nel frattempo non vengono contati.
+    """
+    def __init__(self, name=DEFAULT_NAME):
+        self.name = name
+        self._segment = _open_segment(name)
+        self.generation = int(self._segment.generation[0])
+        self.cursor = int(self._segment.count[0])
+        self.lost = 0
+        self.restarts = 0
+        self._doorbell = None
+        self._slot = None
+
+    @property
+    def capacity(self):
+        return self._segment.capacity
+
+    @property
+    def count(self):
+        """Numero totale di campioni scritti dal bridge."""
+        return int(self._segment.count[0])
+
+    def _copy(self, end, n):
+        records = self._segment.records
+        capacity = self._segment.capacity
+        start = (end - n) % capacity
+        if start + n <= capacity:
+            return records[start:start + n].copy()
+        return np.concatenate((records[start:], records[:start + n - capacity]))
+
+    def _read(self, end, n):
+        """
+        Copia `n` record che terminano a `end`, ripetendo se lo scrittore li ha
+        sovrascritti. Restituisce (record, fine effettiva della lettura).
+        """
+        capacity = self._segment.capacity
+        while True:
+            data = self._copy(end, n)
+            count = self.count
+            if count - end <= capacity - n:
+                return data, end
+            # Sovrascritti durante la copia: si rilegge fino alla nuova fine,
+            # al più mezzo ring per non essere superati di nuovo
+            start = end - n
+            end = count
+            n = min(end - start, capacity // 2)
+
+    def latest(self, n):
+        """Ultimi `n` campioni (array strutturato SAMPLE_DTYPE), dal più vecchio al più recente."""
+        self._check_writer()
+        end = self.count
+        return self._read(end, min(n, end, self._segment.capacity))[0]
+
+    def read_new(self, max_samples=None):
+        """
+        Campioni scritti dopo l'ultima chiamata, come SampleBatch. I campioni
+        già sovrascritti (lettore troppo lento) vengono contati in `lost`.
+        """
+        self._check_writer()
+        end = self.count
+        available = end - self.cursor
+        if available <= 0:
+            return SampleBatch.from_records(self._segment.records[:0].copy())
+        limit = self._segment.capacity if max_samples is None else min(max_samples, self._segment.capacity)
+        if available > limit:
+            self.lost += available - limit
+            available = limit
+        start = end - available
+        records, end = self._read(end, available)
+        # Campioni saltati se lo scrittore ha superato la lettura
+        self.lost += end - len(records) - start
+        self.cursor = end
+        return SampleBatch.from_records(records)
+
+    def wait(self, timeout=None):
+        """
+        Attende che il bridge pubblichi un nuovo blocco (True) o lo scadere
+        del timeout (False). Alla prima chiamata registra una porta di notifica.
+        """
+        if self._check_writer() or self.count != self.cursor:
+            return True
+        if self._doorbell is None:
+            self._register_doorbell()
+        sock = self._doorbell
+        if not sock:
+            # Nessuno slot libero: polling
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.count == self.cursor:
+                if self._check_writer():
+                    return True
+                if deadline is not None and time.monotonic() >= deadline:
+                    return self._check_writer(probe=True)
+                time.sleep(0.001)
+            return True
+        ready, _, _ = select.select([sock], [], [], timeout)
+        if ready:
+            try:
+                while True:
+                    sock.recv(64)
+            except (BlockingIOError, OSError):
+                pass
+        if self.count != self.cursor:
+            return True
+        # Nessun dato per tutto il timeout: il bridge potrebbe essere stato riavviato
+        return self._check_writer(probe=True)
+
+    def _check_writer(self, probe=False):
+        """
+        Riallinea il lettore se il bridge ha riusato, chiuso o sostituito il
+        segmento (vedi modulo). Con `probe` riapre anche il nome, per
+        accorgersi di un segmento nuovo. True se il lettore è stato riallineato.
+        """
+        generation = int(self._segment.generation[0])
+        if generation == self.generation and not probe:
+            return False
+        if generation and generation != self.generation:
+            # Stesso segmento, nuovo scrittore: si riparte dall'inizio del ring
+            self._restart(generation)
+            return True
+        if not generation and not probe:
+            return False
+        try:
+            segment = _open_segment(self.name)
+        except (FileNotFoundError, ValueError):
+            # Bridge non ancora riavviato (o segmento in inizializzazione)
+            return False
+        generation = int(segment.generation[0])
+        if not generation or generation == self.generation:
+            # Lo stesso segmento, o uno nuovo non ancora pronto
+            segment.release()
+            return False
+        self._release_doorbell()
+        self._segment.release()
+        self._segment = segment
+        self._restart(generation)
+        return True
+
+    def _restart(self, generation):
+        self.generation = generation
+        self.cursor = 0
+        self.restarts += 1
+        if self._doorbell:
+            self._claim_doorbell(self._doorbell.getsockname()[1])
+        log.info("Bridge riavviato: riallineato il lettore di %s", self.name)
+
+    def _register_doorbell(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((UDP_IP, 0))
+        sock.setblocking(False)
+        if self._claim_doorbell(sock.getsockname()[1]):
+            self._doorbell = sock
+            return
+        sock.close()
+        self._doorbell = False
+        log.warning("Nessuno slot di notifica libero in %s: si usa il polling", self.name)
+
+    def _claim_doorbell(self, port):
+        """Occupa uno slot con `port` (o tiene quello già occupato). False se non ce ne sono liberi."""
+        with _doorbell_lock(self.name):
+            doorbells = self._segment.doorbells
+            ports = doorbells.tolist()
+            if port in ports:
+                self._slot = ports.index(port)
+                return True
+            if 0 not in ports:
+                _clear_stale_doorbells(doorbells)
+                ports = doorbells.tolist()
+            if 0 not in ports:
+                return False
+            self._slot = ports.index(0)
+            doorbells[self._slot] = port
+            return True
+
+    def _release_doorbell(self):
+        if not self._doorbell:
+            return
+        port = self._doorbell.getsockname()[1]
+        with _doorbell_lock(self.name):
+            # Lo slot potrebbe essere già stato liberato e riassegnato
+            if self._segment.doorbells[self._slot] == port:
+                self._segment.doorbells[self._slot] = 0
+
+    def close(self):
+        if self._doorbell:
+            self._release_doorbell()
+            self._doorbell.close()
+        self._doorbell = None
+        self._segment.release()
@@ -0,0 +1,206 @@
+import os
+import select
+import threading
+import time
+
+from PacketFramer import add_crc8_hex
+
+# Valori di position riportati dal dongle simulato per ciascun comando
+COMMAND_POSITIONS = {b"C": 100, b"O": 0}
+
+
+class SimulatedDongle:
+    """
+    Dongle robot simulato su una coppia pty (solo POSIX).
+
+    Il bridge apre `port_name` come una normale porta seriale. Il dongle:
+      - dopo '$VS***' inizia a inviare pacchetti '$ttt_ppp***' a `rate` pacchetti/s
+      - su '$C****' / '$O****' porta la position a 100 / 0, su '$S****' la mantiene
+    Il campo torque contiene un contatore di pacchetto (modulo 1000), così
+    il consumer può contare i pacchetti persi. Con `crc` i pacchetti hanno
+    il CRC-8 in coda come nei firmware recenti ('$ttt_ppp*CC', vedi
+    PacketFramer.FEEDBACK_CRC8_FORMAT).
+
+    Per ogni comando ricevuto viene registrato (time.perf_counter(), codice)
+    in `command_log` (solo con `log_commands`: nelle prove lunghe bastano i
+    contatori `commands_received` e `commands_by_code`).
+
+    Con `link` il dongle mantiene un symlink stabile alla pty corrente:
+    unplug()/plug() simulano lo scollegamento e il ricollegamento USB
+    (la pty cambia, il symlink viene aggiornato).
+    """
+    def __init__(self, rate=1000, autostart=False, link=None, crc=False, log_commands=True):
+        self.rate = rate
+        self.link = link
+        self.crc = crc
+        self.master = self.slave = None
+        self.port_name = None
+        self._lock = threading.Lock()
+        self._open_pty()
+        self.streaming = autostart
+        self.position = 0
+        self.counter = 0
+        self.packets_sent = 0
+        self.bytes_overflowed = 0
+        self.velocity_cmds = 0
+        self.log_commands = log_commands
+        self.command_log = []
+        self.commands_received = 0
+        self.commands_by_code = {}
+        self._rx = bytearray()
+        self._running = False
+        self._thread = None
+
+    def _open_pty(self):
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        with self._lock:
+            self.master, self.slave = master, slave
+            self.port_name = os.ttyname(slave)
+        if self.link:
+            tmp = self.link + ".tmp"
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            os.symlink(self.port_name, tmp)
+            os.replace(tmp, self.link)
+            self.port_name = self.link
+
+    def _close_pty(self):
+        with self._lock:
+            fds = (self.master, self.slave)
+            self.master = self.slave = None
+        for fd in fds:
+            if fd is None:
+                continue
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @property
+    def plugged(self):
+        return self.master is not None
+
+    def unplug(self):
+        """Simula lo scollegamento: la pty viene chiusa, il bridge riceve EIO."""
+        self._close_pty()
+        if self.link and os.path.lexists(self.link):
+            os.unlink(self.link)
+        self.streaming = False
+
+    def plug(self):
+        """Simula il ricollegamento su una nuova pty (si riparte in attesa di '$VS***')."""
+        self._rx.clear()
+        self._open_pty()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        self._close_pty()
+        if self.link and os.path.lexists(self.link):
+            os.unlink(self.link)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle_commands(self, data):
+        now = time.perf_counter()
+        self._rx.extend(data)
+        while True:
+            start = self._rx.find(b"$")
+            if start == -1:
+                self._rx.clear()
+                return
+            if len(self._rx) < start + 6:
+                del self._rx[:start]
+                return
+            frame = bytes(self._rx[start:start + 6])
+            del self._rx[:start + 6]
+            if frame == b"$VS***":
+                self.velocity_cmds += 1
+                self.streaming = True
+                continue
+            code = frame[1:2]
+            self.commands_received += 1
+            self.commands_by_code[code] = self.commands_by_code.get(code, 0) + 1
+            if self.log_commands:
+                self.command_log.append((now, code))
+            if code in COMMAND_POSITIONS:
+                self.position = COMMAND_POSITIONS[code]
+
+    def _build_packets(self, count):
+        out = bytearray()
+        for _ in range(count):
+            if self.crc:
+                out += add_crc8_hex(b"$%03d_%03d*" % (self.counter, self.position))
+            else:
+                out += b"$%03d_%03d***" % (self.counter, self.position)
+            self.counter = (self.counter + 1) % 1000
+        return out
+
+    def _run(self):
+        interval = 1.0 / self.rate
+        next_send = time.perf_counter()
+        while self._running:
+            master = self.master
+            if master is None:
+                time.sleep(0.01)
+                continue
+            timeout = max(0.0, next_send - time.perf_counter()) if self.streaming else 0.05
+            try:
+                readable, _, _ = select.select([master], [], [], timeout)
+                if readable:
+                    data = os.read(master, 4096)
+                    if data:
+                        self._handle_commands(data)
+            except BlockingIOError:
+                pass
+            except (OSError, ValueError):
+                # pty chiusa da unplug()
+                continue
+            if not self.streaming:
+                next_send = time.perf_counter()
+                continue
+            now = time.perf_counter()
+            due = int((now - next_send) / interval) + 1 if now >= next_send else 0
+            if due:
+                out = self._build_packets(due)
+                try:
+                    written = os.write(master, out)
+                except BlockingIOError:
+                    written = 0
+                except OSError:
+                    continue
+                # Buffer pty pieno: il bridge non sta leggendo, i byte in eccesso sono persi
+                self.bytes_overflowed += len(out) - written
+                self.packets_sent += due
+                next_send += due * interval
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Dongle robot simulato su pty")
+    parser.add_argument("--rate", type=float, default=1000, help="pacchetti al secondo")
+    parser.add_argument("--crc", action="store_true", help="pacchetti con CRC-8 in coda (bridge con --frame-check crc8)")
+    args = parser.parse_args()
+    with SimulatedDongle(args.rate, crc=args.crc) as dongle:
+        print("Porta del dongle simulato:", dongle.port_name)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
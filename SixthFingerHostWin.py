@@ -1,174 +1,265 @@
+import argparse
+import ipaddress
 import socket
-import serial
-from serial.threaded import ReaderThread, Protocol
 import threading
 import time
-from COMDeviceManager import COMDeviceManager  # Assicurati che il modulo sia nel PYTHONPATH
+from BridgeCore import (COMMAND_RECV_ERRORS, UDP_CMD_PORT, UDP_FEEDBACK_PORT, UDP_IP, command_ack_sender,
+                        handle_control, submit_command, write_pending_commands)
+from COMDeviceManager import COMDeviceManager, PORT_PROFILES  # Assicurati che il modulo sia nel PYTHONPATH
+from CommandQueue import CommandQueue
+from ConsoleLog import LEVELS, get_logger, set_status, setup_logging, shutdown_logging
+from PacketFramer import FRAME_CHECKS
+from FeedbackFilter import parse_pipeline
+from FeedbackFanout import FeedbackFanout
+from FeedbackProtocol import FeedbackPublisher
+from Metrics import PROFILER, SnapshotDumper, StatsEndpoint, UDP_STATS_PORT, counter, gauge, histogram
+from SerialSession import SerialSession
 from colorama import init, Fore, Style
 init()
 
-# Impostazioni UDP
-UDP_IP = "127.0.0.1"
-UDP_CMD_PORT = 5005       # Porta per ricevere i comandi (stato)
-UDP_FEEDBACK_PORT = 5006  # Porta per inviare i dati (torque e position)
+log = get_logger("SixthFingerHostWin")
 
-# Variabili globali per lo stato (equivalente al callback ROS)
-current_state_string = ""
-state_changed = False
-state_lock = threading.Lock()
+# Riga di stato (formattata dal thread della console, vedi ConsoleLog)
+STATUS_TEMPLATE = f"{Fore.LIGHTGREEN_EX}Torque: %d - Position: %d{Style.RESET_ALL}"
 
-def udp_command_listener():
+# Metriche del loop principale (quelle di seriale e comandi sono in BridgeCore)
+LOOP_CYCLE_TIME = histogram("loop.cycle_seconds")
+LOOP_PERIOD = histogram("loop.period_seconds")
+LOOP_OVERRUNS = counter("loop.overruns")
+
+def udp_command_listener(sock, commands, publisher=None, fanout=None):
     """
     Thread che ascolta i comandi UDP su UDP_CMD_PORT.
-    I messaggi attesi sono stringhe come "CLOSE", "STOP" o "OPEN".
+    I messaggi attesi sono stringhe come "CLOSE", "STOP" o "OPEN",
+    eventualmente seguite da un identificativo per le conferme
+    (vedi CommandQueue): i comandi vengono accodati in `commands`.
+    I messaggi di controllo (HELLO, SUBSCRIBE, UNSUBSCRIBE) ricevono
+    subito una risposta (vedi handle_control).
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((UDP_IP, UDP_CMD_PORT))
-    print(f"Ascolto comandi UDP su {UDP_IP}:{UDP_CMD_PORT}")
+    log.info("Ascolto comandi UDP su %s:%s", UDP_IP, UDP_CMD_PORT)
     while True:
         try:
             data, addr = sock.recvfrom(1024)
+        except OSError as e:
+            if sock.fileno() == -1:
+                # Socket chiuso: il bridge si sta fermando
+                return
+            # Es. su Windows: ICMP "port unreachable" di una risposta a un
+            # client già chiuso (WSAECONNRESET) o datagramma oltre i 1024
+            # byte (WSAEMSGSIZE). Il listener deve restare attivo.
+            COMMAND_RECV_ERRORS.inc()
+            log.debug("Errore nella ricezione dei comandi UDP: %s", e)
+            continue
+        try:
             cmd = data.decode('utf-8').strip()
-            with state_lock:
-                global current_state_string, state_changed
-                current_state_string = cmd
-                state_changed = True
-            print(f"Ricevuto comando UDP: {cmd}")
+            reply = handle_control(cmd, addr, publisher, fanout)
+            if reply is not None:
+                sock.sendto(reply, addr)
+                continue
+            submit_command(cmd, addr, commands, sock.sendto)
         except Exception as e:
-            print("Errore nel listener UDP:", e)
+            log.error("Errore nel listener UDP: %s", e)
 
-def process_packet(packet, udp_sock):
+def process_batch(batch, publisher):
     """
-    Elabora un pacchetto (assunto lungo 11 byte, inizio con '$')
-    ed estrae torque e position per poi inviarli via UDP.
-    Formato atteso:
-      index 0: '$'
-      index 1-3: cifre del torque
-      index 5-7: cifre della position
+    Elabora un blocco di campioni decodificati insieme (vedi PacketDecoder).
+    La riga di stato riceve solo l'ultimo campione del blocco e viene
+    ridisegnata dal thread della console a frequenza limitata (vedi
+    ConsoleLog); il blocco viene poi inviato via UDP dal publisher nel
+    formato negoziato (vedi FeedbackProtocol), se presente.
     """
-    try:
-        torque_val = ((packet[1] - ord('0')) * 100 +
-                      (packet[2] - ord('0')) * 10 +
-                      (packet[3] - ord('0')))
-        # Legge il valore di position dagli indici 5,6,7
-        position_val = ((packet[5] - ord('0')) * 100 +
-                        (packet[6] - ord('0')) * 10 +
-                        (packet[7] - ord('0')))
-    except Exception as e:
-        print("Errore nel processing del pacchetto:", e)
+    if not len(batch):
         return
+    torque_val, position_val, _ = batch.last()
+    set_status(STATUS_TEMPLATE, torque_val, position_val)
+    if publisher is not None:
+        publisher.publish(batch)
 
-    print(f"\r{Fore.LIGHTGREEN_EX}Torque: {torque_val} - Position: {position_val}{Style.RESET_ALL}\033[K", end="")
-
+def run_threaded(session, publisher, commands, fanout=None):
+    """
+    Modalità classica: listener UDP su un thread, ReaderThread per la
+    seriale (supervisionato da SerialSession, con riconnessione automatica)
+    e loop principale a 33 Hz che a ogni ciclo scrive sul dongle i comandi
+    accodati (già coalescenti, vedi CommandQueue).
+    """
+    cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    cmd_sock.bind((UDP_IP, UDP_CMD_PORT))
+    commands.ack = command_ack_sender(cmd_sock)
+    udp_thread = threading.Thread(target=udp_command_listener, args=(cmd_sock, commands, publisher, fanout),
+                                  daemon=True)
+    udp_thread.start()
 
-    # Costruisce il messaggio includendo entrambi i valori
-    message = f"{torque_val} {position_val}"
+    session.start()
+    loop_delay = 0.03  # 33 Hz ~ 30 ms per ciclo
+    last_cycle_start = None
     try:
-        udp_sock.sendto(message.encode(), (UDP_IP, UDP_FEEDBACK_PORT))
+        while True:
+            cycle_start = time.perf_counter()
+            if last_cycle_start is not None:
+                LOOP_PERIOD.record(cycle_start - last_cycle_start)
+            last_cycle_start = cycle_start
+            write_pending_commands(session, commands)
+            commands.expire()
+            elapsed = time.perf_counter() - cycle_start
+            LOOP_CYCLE_TIME.record(elapsed)
+            remaining_time = loop_delay - elapsed
+            if remaining_time > 0:
+                time.sleep(remaining_time)
+            else:
+                LOOP_OVERRUNS.inc()
+    except KeyboardInterrupt:
+        log.info("Terminazione tramite KeyboardInterrupt.")
     except Exception as e:
-        print("Errore nell'invio UDP:", e)
+        log.error("Errore nel loop principale: %s", e)
+    finally:
+        session.stop()
+        cmd_sock.close()
 
-class SerialProtocol(Protocol):
-    """
-    Protocollo per ReaderThread che accumula i dati in un buffer.
-    Quando trova un pacchetto completo (11 byte che iniziano con '$'),
-    lo passa alla callback `packet_callback`.
-    """
-    def __init__(self, packet_callback, packet_length=11, start_byte=b'$'):
-        self.packet_callback = packet_callback
-        self.packet_length = packet_length
-        self.start_byte = start_byte
-        self.buffer = bytearray()
-
-    def data_received(self, data):
-        self.buffer.extend(data)
-        while True:
-            start_index = self.buffer.find(self.start_byte)
-            if start_index == -1:
-                if len(self.buffer) > 1024:
-                    self.buffer.clear()
-                break
-            if len(self.buffer) < start_index + self.packet_length:
-                break
-            packet = self.buffer[start_index:start_index+self.packet_length]
-            del self.buffer[:start_index+self.packet_length]
-            self.packet_callback(packet)
-
-def set_velocity_cmd(ser):
-    """Invia il comando di velocità '$VS***' alla porta seriale."""
-    data = b"$VS***"
-    print("Invio comando di velocità:", data)
+def parse_multicast(text):
+    """'GRUPPO:PORTA' -> (gruppo, porta); solleva ValueError se non è un gruppo multicast valido."""
+    group, sep, port = text.rpartition(":")
     try:
-        ser.write(data)
-    except Exception as e:
-        print("Errore nell'invio del comando di velocità:", e)
+        if not sep or not ipaddress.ip_address(group).is_multicast:
+            raise ValueError
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"atteso GRUPPO:PORTA con un gruppo multicast, es. 239.0.0.1:5008 (non {text})")
+    if not 0 < port < 65536:
+        raise ValueError(f"porta fuori intervallo: {port}")
+    return group, port
+
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bridge UDP <-> seriale per il dongle SixthFinger")
+    parser.add_argument("--mode", choices=("threaded", "async"), default="threaded",
+                        help="threaded: loop a 33 Hz (default); async: bridge asyncio a eventi")
+    parser.add_argument("--port", default=None,
+                        help="porta seriale da usare al posto della ricerca automatica (es. COM5 o /dev/pts/3)")
+    parser.add_argument("--dongles-config", default=None,
+                        help="file JSON con i numeri di serie dei dongle (sostituisce la tabella interna)")
+    parser.add_argument("--record", default=None, metavar="FILE",
+                        help="registra i campioni decodificati nel file indicato (vedi SessionRecorder)")
+    parser.add_argument("--record-raw", action="store_true",
+                        help="con --record, registra anche i byte grezzi della seriale")
+    parser.add_argument("--log-level", choices=tuple(LEVELS), default="info",
+                        help="livello dei messaggi sulla console (off: nessun output, neanche la riga di stato)")
+    parser.add_argument("--status-rate", type=float, default=10.0,
+                        help="aggiornamenti al secondo della riga di stato (0: disattivata)")
+    parser.add_argument("--stats-port", type=int, default=UDP_STATS_PORT,
+                        help="porta UDP locale dell'endpoint delle metriche (0: disattivato)")
+    parser.add_argument("--stats-dump", default=None, metavar="FILE",
+                        help="accoda periodicamente lo snapshot delle metriche al file (JSON lines)")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="intervallo (s) tra gli snapshot di --stats-dump")
+    parser.add_argument("--profile", action="store_true",
+                        help="avvia il profiler a campionamento sul reader seriale (attivabile anche a runtime)")
+    parser.add_argument("--serial-profile", choices=tuple(PORT_PROFILES), default="default",
+                        help="impostazioni della porta e del reader (vedi COMDeviceManager.PortProfile)")
+    parser.add_argument("--read-latency", type=float, default=None, metavar="SECONDI",
+                        help="ritardo massimo che il reader può aggiungere per leggere blocchi più grandi "
+                             "(sostituisce quello del profilo; 0: legge ogni byte appena arriva)")
+    parser.add_argument("--frame-check", choices=tuple(FRAME_CHECKS), default="format",
+                        help="validazione dei pacchetti: formato '$ddd?ddd???' (default), "
+                             "formato con CRC-8 in coda (firmware recenti) o nessuna")
+    parser.add_argument("--feedback-transport", choices=("udp", "shm", "both"), default="udp",
+                        help="consumer principale via UDP (default), memoria condivisa (vedi SharedFeedback) o entrambi")
+    parser.add_argument("--shm-name", default=None,
+                        help="nome del segmento di memoria condivisa (default sixthfinger_feedback)")
+    parser.add_argument("--feedback-multicast", default=None, metavar="GRUPPO:PORTA",
+                        help="invia il feedback (binario) anche a un gruppo multicast, es. 239.0.0.1:5008")
+    parser.add_argument("--feedback-filter", default=None, metavar="FILTRI",
+                        help="filtri del consumer principale se non li sceglie con HELLO, es. 'minmax:10' "
+                             "o 'ma:8,mean:33,velocity' (vedi FeedbackFilter; default: campioni grezzi)")
+    args = parser.parse_args(argv)
+    if args.record_raw and not args.record:
+        parser.error("--record-raw richiede --record")
+    try:
+        parse_pipeline(args.feedback_filter)
+    except ValueError as e:
+        parser.error(f"--feedback-filter: {e}")
+    if args.feedback_multicast:
+        try:
+            args.feedback_multicast = parse_multicast(args.feedback_multicast)
+        except ValueError as e:
+            parser.error(f"--feedback-multicast: {e}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    console = setup_logging(args.log_level, args.status_rate)
+    gauge("log.records_dropped", lambda: console.handler.dropped)
+    if args.dongles_config:
+        COMDeviceManager.load_serial_table(args.dongles_config)
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    publisher = FeedbackPublisher(udp_sock, (UDP_IP, UDP_FEEDBACK_PORT), default_filter=args.feedback_filter)
 
-    dongle_type = "robot"  # Può essere "feedback", "input" o "robot"
-    comport = COMDeviceManager.discover_com_devices(dongle_type)
-    if not comport:
-        print("Nessun dispositivo COM trovato per il dongle specificato.")
-        return
-    ser = COMDeviceManager.open_serial_port(comport)
-    if ser is None:
-        print("Apertura della porta seriale fallita.")
-        return
-    print("Porta seriale aperta correttamente:", comport)
+    recorder = None
+    if args.record:
+        from SessionRecorder import SessionRecorder
+        recorder = SessionRecorder(args.record, record_raw=args.record_raw).start()
 
-    try:
-        while ser.in_waiting:
-            ser.read(ser.in_waiting)
-    except Exception as e:
-        print("Errore nel flush della porta seriale:", e)
-    set_velocity_cmd(ser)
+    commands = CommandQueue()
+    gauge("command.queued", lambda: len(commands))
+    fanout = FeedbackFanout().start()
+    if args.feedback_multicast:
+        fanout.add_multicast(*args.feedback_multicast)
 
-    udp_thread = threading.Thread(target=udp_command_listener, daemon=True)
-    udp_thread.start()
+    shm_writer = None
+    if args.feedback_transport != "udp":
+        from SharedFeedback import DEFAULT_NAME, SharedFeedbackWriter
+        shm_writer = SharedFeedbackWriter(args.shm_name or DEFAULT_NAME)
+    primary = publisher if args.feedback_transport != "shm" else None
+
+    def batch_callback(batch):
+        process_batch(batch, primary)
+        if shm_writer is not None:
+            shm_writer.publish(batch)
+        # Gli iscritti ricevono il blocco dal thread di fan-out, dopo il consumer principale
+        fanout.publish(batch)
+        if len(batch):
+            commands.feedback(batch.last()[1])
+        if recorder is not None:
+            recorder.record(batch)
 
-    def packet_callback(packet):
-        process_packet(packet, udp_sock)
+    dongle_type = "robot"  # Può essere "feedback", "input" o "robot"
+    profile = PORT_PROFILES[args.serial_profile].replace(latency_budget=args.read_latency)
+    session = SerialSession(dongle_type, batch_callback, comport=args.port,
+                            raw_callback=recorder.record_raw if args.record_raw else None,
+                            profile=profile, spec=FRAME_CHECKS[args.frame_check])
+    gauge("serial.connected", session.connected.is_set)
+    gauge("serial.reconnects", lambda: session.reconnects)
+    gauge("serial.last_recovery_seconds", lambda: session.last_recovery_time)
+    gauge("udp.feedback_format", lambda: publisher.format)
 
-    with ReaderThread(ser, lambda: SerialProtocol(packet_callback)) as protocol:
-        loop_delay = 0.03  # 33 Hz ~ 30 ms per ciclo
+    stats_endpoint = None
+    if args.stats_port:
         try:
-            while True:
-                cycle_start = time.perf_counter()
-                global current_state_string, state_changed
-                if state_changed:
-                    with state_lock:
-                        cmd = current_state_string
-                        state_changed = False
-                    data = bytearray(7)
-                    data[0] = ord('$')
-                    if cmd == "CLOSE":
-                        data[1] = ord('C')
-                    elif cmd == "STOP":
-                        data[1] = ord('S')
-                    elif cmd == "OPEN":
-                        data[1] = ord('O')
-                    else:
-                        print("Comando sconosciuto ricevuto:", cmd)
-                        continue
-                    for i in range(2, 6):
-                        data[i] = ord('*')
-                    try:
-                        ser.write(data[:-1])
-                        print("Comando inviato al dongle:", data[:-1].decode('ascii', errors='ignore'))
-                    except Exception as e:
-                        print("Errore nell'invio del comando sulla porta seriale:", e)
-                elapsed = time.perf_counter() - cycle_start
-                remaining_time = loop_delay - elapsed
-                if remaining_time > 0:
-                    time.sleep(remaining_time)
-        except KeyboardInterrupt:
-            print("Terminazione tramite KeyboardInterrupt.")
-        except Exception as e:
-            print("Errore nel loop principale:", e)
-        finally:
-            udp_sock.close()
-            print("Chiusura dell'endpoint UDP.")
+            stats_endpoint = StatsEndpoint(addr=(UDP_IP, args.stats_port)).start()
+        except OSError as e:
+            log.error("Errore nell'avvio dell'endpoint delle metriche: %s", e)
+    dumper = SnapshotDumper(args.stats_dump, args.stats_interval).start() if args.stats_dump else None
+    if args.profile:
+        PROFILER.start()
+    try:
+        if args.mode == "async":
+            from AsyncBridge import run_async_bridge
+            run_async_bridge(session, publisher, commands, fanout)
+        else:
+            run_threaded(session, publisher, commands, fanout)
+    finally:
+        fanout.stop()
+        if shm_writer is not None:
+            shm_writer.close()
+        if recorder is not None:
+            recorder.stop()
+        PROFILER.stop()
+        if dumper is not None:
+            dumper.stop()
+        if stats_endpoint is not None:
+            stats_endpoint.stop()
+        udp_sock.close()
+        log.info("Chiusura dell'endpoint UDP.")
+        shutdown_logging()
 
 if __name__ == "__main__":
     main()